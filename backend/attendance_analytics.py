@@ -0,0 +1,179 @@
+import os
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import and_, delete, select
+from sqlalchemy.orm import Session
+
+from backend import models
+
+# Codes of the status matrix; NO_RECORD pads the columns a row has no record for
+STATUS_CODES = {"present": 0, "late": 1, "absent": 2, "excused": 3, "pending": 4}
+NO_RECORD = -1
+PRESENT, LATE, ABSENT = STATUS_CODES["present"], STATUS_CODES["late"], STATUS_CODES["absent"]
+
+# A student is flagged when any threshold is reached over at least AT_RISK_MIN_SESSIONS sessions
+AT_RISK_MIN_SESSIONS = int(os.getenv("AT_RISK_MIN_SESSIONS", "3"))
+AT_RISK_ABSENCE_STREAK = int(os.getenv("AT_RISK_ABSENCE_STREAK", "3"))
+AT_RISK_ABSENCE_RATE = float(os.getenv("AT_RISK_ABSENCE_RATE", "0.2"))
+AT_RISK_RECENT_WINDOW = int(os.getenv("AT_RISK_RECENT_WINDOW", "5"))
+AT_RISK_RECENT_ABSENCE_RATE = float(os.getenv("AT_RISK_RECENT_ABSENCE_RATE", "0.4"))
+
+
+class StatusMatrix:
+    """
+    Attendance of enrolled students over finalized schedules as an int8 array: one row per
+    (room_id, user_id), one column per session of the row's room in date order. Rooms with
+    fewer sessions than the widest room are padded with NO_RECORD on the right.
+    """
+
+    def __init__(self, room_ids, user_ids, session_counts, matrix):
+        self.room_ids = room_ids
+        self.user_ids = user_ids
+        self.session_counts = session_counts  # Sessions of each row's room
+        self.matrix = matrix
+
+
+def load_status_matrix(db: Session, room_id: int = None) -> StatusMatrix:
+    """Load the status matrix of one room, or of every room, with two queries."""
+    schedule = models.AttendanceScheduleModel
+    record = models.AttendanceRecordModel
+    room_user = models.RoomUsersModel
+
+    schedules = select(schedule.schedule_id, schedule.room_id).where(
+        schedule.finalized_at.isnot(None),
+        schedule.is_archived.isnot(True)
+    ).order_by(schedule.room_id, schedule.date, schedule.start_time, schedule.schedule_id)
+    records = select(record.room_id, record.user_id, record.schedule_id, record.status).join(
+        schedule, schedule.schedule_id == record.schedule_id
+    ).join(
+        room_user, and_(room_user.room_id == record.room_id, room_user.user_id == record.user_id)
+    ).where(
+        schedule.finalized_at.isnot(None),
+        schedule.is_archived.isnot(True),
+        room_user.status == "accepted"
+    )
+    if room_id is not None:
+        schedules = schedules.where(schedule.room_id == room_id)
+        records = records.where(record.room_id == room_id)
+
+    # Column of each schedule: its position among its room's sessions
+    column = {}
+    session_count = {}
+    for schedule_id, schedule_room_id in db.execute(schedules):
+        column[schedule_id] = session_count.get(schedule_room_id, 0)
+        session_count[schedule_room_id] = column[schedule_id] + 1
+
+    rows = db.execute(records).all()
+    if not rows:
+        empty = np.empty(0, dtype=np.int64)
+        return StatusMatrix(empty, empty, empty, np.empty((0, 0), dtype=np.int8))
+
+    room_column = np.fromiter((row.room_id for row in rows), dtype=np.int64, count=len(rows))
+    user_column = np.fromiter((row.user_id for row in rows), dtype=np.int64, count=len(rows))
+    columns = np.fromiter((column[row.schedule_id] for row in rows), dtype=np.int64, count=len(rows))
+    codes = np.fromiter(
+        (STATUS_CODES[getattr(row.status, "value", row.status)] for row in rows), dtype=np.int8, count=len(rows)
+    )
+
+    keys, row_index = np.unique(np.stack([room_column, user_column], axis=1), axis=0, return_inverse=True)
+    session_counts = np.array([session_count[room] for room in keys[:, 0]], dtype=np.int64)
+    matrix = np.full((len(keys), session_counts.max()), NO_RECORD, dtype=np.int8)
+    matrix[row_index.ravel(), columns] = codes
+    return StatusMatrix(keys[:, 0], keys[:, 1], session_counts, matrix)
+
+
+def absence_streaks(matrix: np.ndarray):
+    """
+    Current and longest run of absences of each row. Only attending (present or late) ends a
+    run; excused sessions and missing records are skipped. Returns (current, longest).
+    """
+    rows, sessions = matrix.shape
+    absent = matrix == ABSENT
+    attended = (matrix == PRESENT) | (matrix == LATE)
+
+    positions = np.arange(sessions)
+    last_attended = np.where(attended, positions, -1).max(axis=1, initial=-1)
+    current = (absent & (positions > last_attended[:, None])).sum(axis=1)
+
+    # Absences between two attended sessions share a run id; count the absences of every run
+    run_ids = np.cumsum(attended, axis=1) + np.arange(rows)[:, None] * (sessions + 1)
+    longest = np.bincount(run_ids[absent], minlength=rows * (sessions + 1)).reshape(rows, sessions + 1).max(
+        axis=1, initial=0
+    )
+    return current, longest
+
+
+def rolling_absence_rates(matrix: np.ndarray, window: int) -> np.ndarray:
+    """
+    Share of absences among the present, late and absent records of the last `window` sessions,
+    at every session. NaN where the window holds none of them.
+    """
+    sessions = matrix.shape[1]
+    counted = (matrix == PRESENT) | (matrix == LATE) | (matrix == ABSENT)
+    zeros = np.zeros((matrix.shape[0], 1), dtype=np.int64)
+    absent_total = np.concatenate([zeros, np.cumsum(matrix == ABSENT, axis=1)], axis=1)
+    counted_total = np.concatenate([zeros, np.cumsum(counted, axis=1)], axis=1)
+
+    window_start = np.maximum(np.arange(sessions) + 1 - window, 0)
+    absences = absent_total[:, 1:] - absent_total[:, window_start]
+    records = counted_total[:, 1:] - counted_total[:, window_start]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(records > 0, absences / records, np.nan)
+
+
+def find_at_risk_students(status: StatusMatrix):
+    """Compute the attendance indicators of every row and return those breaching a threshold."""
+    matrix = status.matrix
+    if matrix.size == 0:
+        return []
+
+    sessions = ((matrix == PRESENT) | (matrix == LATE) | (matrix == ABSENT)).sum(axis=1)
+    absences = (matrix == ABSENT).sum(axis=1)
+    absence_rate = np.divide(absences, sessions, out=np.zeros(len(sessions)), where=sessions > 0)
+    current, longest = absence_streaks(matrix)
+    # Rolling rate at each row's latest session
+    recent = rolling_absence_rates(matrix, AT_RISK_RECENT_WINDOW)[np.arange(len(matrix)), status.session_counts - 1]
+    recent = np.nan_to_num(recent)
+
+    breaches = {
+        "absence_streak": current >= AT_RISK_ABSENCE_STREAK,
+        "absence_rate": absence_rate >= AT_RISK_ABSENCE_RATE,
+        "recent_absence_rate": recent >= AT_RISK_RECENT_ABSENCE_RATE,
+    }
+    flagged = (sessions >= AT_RISK_MIN_SESSIONS) & np.logical_or.reduce(list(breaches.values()))
+
+    return [
+        {
+            "room_id": int(status.room_ids[row]),
+            "user_id": int(status.user_ids[row]),
+            "sessions": int(sessions[row]),
+            "absence_rate": float(absence_rate[row]),
+            "recent_absence_rate": float(recent[row]),
+            "current_streak": int(current[row]),
+            "longest_streak": int(longest[row]),
+            "reasons": [reason for reason, breached in breaches.items() if breached[row]],
+        }
+        for row in np.flatnonzero(flagged)
+    ]
+
+
+def flag_at_risk_students(db: Session, room_id: int = None) -> int:
+    """
+    Replace the at_risk_students rows of one room, or of every room, with a fresh detection.
+    The caller commits. Returns the number of students flagged.
+    """
+    flagged = find_at_risk_students(load_status_matrix(db, room_id))
+
+    stale = delete(models.AtRiskStudentModel)
+    if room_id is not None:
+        stale = stale.where(models.AtRiskStudentModel.room_id == room_id)
+    db.execute(stale)
+
+    if flagged:
+        flagged_at = datetime.now()
+        db.execute(
+            models.AtRiskStudentModel.__table__.insert(),
+            [{**student, "flagged_at": flagged_at} for student in flagged]
+        )
+    return len(flagged)
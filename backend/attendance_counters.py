@@ -0,0 +1,158 @@
+import sys
+from collections import defaultdict
+from datetime import date, datetime
+
+from sqlalchemy import case, delete, func, literal, select
+from sqlalchemy.orm import Session
+
+from backend import models
+from backend.database import SessionLocal
+
+# Counter table, the record columns it is keyed on besides status, and its unique key
+COUNTER_TABLES = (
+    (models.StudentAttendanceCounterModel.__table__, ("room_id", "user_id"), ("room_id", "user_id", "status")),
+    (models.ScheduleAttendanceCounterModel.__table__, ("schedule_id", "room_id"), ("schedule_id", "status")),
+    (models.RoomAttendanceCounterModel.__table__, ("room_id",), ("room_id", "status")),
+)
+
+
+def _increment(db: Session, table, conflict_columns, source, columns=None):
+    """Insert counts from a list of rows or from a select, adding them to the existing counters on conflict."""
+    if db.get_bind().dialect.name == "mysql":
+        from sqlalchemy.dialects.mysql import insert
+
+        stmt = insert(table).values(source) if columns is None else insert(table).from_select(columns, source)
+        stmt = stmt.on_duplicate_key_update(count=table.c.count + stmt.inserted.count)
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+
+        stmt = insert(table).values(source) if columns is None else insert(table).from_select(columns, source)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(conflict_columns),
+            set_={"count": table.c.count + stmt.excluded.count}
+        )
+    db.execute(stmt)
+
+
+def apply_counter_deltas(db: Session, deltas):
+    """
+    Add per record deltas to the counters, in the caller's transaction.
+    deltas maps (room_id, user_id, schedule_id, status) to the change in the number of records.
+    """
+    for table, key_columns, conflict_columns in COUNTER_TABLES:
+        totals = defaultdict(int)
+        for (room_id, user_id, schedule_id, status), delta in deltas.items():
+            record = {"room_id": room_id, "user_id": user_id, "schedule_id": schedule_id}
+            totals[tuple(record[column] for column in key_columns) + (status,)] += delta
+
+        rows = [
+            {**dict(zip(key_columns, key[:-1])), "status": key[-1], "count": delta}
+            for key, delta in totals.items() if delta
+        ]
+        if rows:
+            _increment(db, table, conflict_columns, rows)
+
+
+def apply_counter_select(db: Session, source):
+    """
+    Set based apply_counter_deltas: source is a select with room_id, user_id, schedule_id, status
+    and delta columns, one row per changed record.
+    """
+    changes = source.subquery()
+    for table, key_columns, conflict_columns in COUNTER_TABLES:
+        group = [changes.c[column] for column in key_columns] + [changes.c.status]
+        _increment(
+            db, table, conflict_columns,
+            select(*group, func.sum(changes.c.delta)).group_by(*group),
+            columns=list(key_columns) + ["status", "count"]
+        )
+
+
+def rebuild_attendance_counters(db: Session, room_id: int = None):
+    """Recount the counters of one room, or of every room, from attendance_record. The caller commits."""
+    record = models.AttendanceRecordModel
+    for table, key_columns, _ in COUNTER_TABLES:
+        stmt = delete(table)
+        if room_id is not None:
+            stmt = stmt.where(table.c.room_id == room_id)
+        db.execute(stmt)
+
+        group = [record.__table__.c[column] for column in key_columns] + [record.status]
+        recount = select(*group, func.count()).group_by(*group)
+        if room_id is not None:
+            recount = recount.where(record.room_id == room_id)
+        db.execute(table.insert().from_select(list(key_columns) + ["status", "count"], recount))
+
+
+ROLLUP_STATUSES = ("present", "late", "absent", "excused", "pending")
+
+
+def refresh_daily_rollups(db: Session, since: date = None, until: date = None, room_id: int = None) -> int:
+    """
+    Recompute the daily rollups of the days between since and until (all days when omitted)
+    from the schedule counters: one row per room and schedule date. The caller commits.
+    Returns the number of rollup rows written.
+    """
+    rollup = models.AttendanceDailyRollupModel
+    schedule = models.AttendanceScheduleModel
+    counter = models.ScheduleAttendanceCounterModel
+
+    stale = delete(rollup)
+    source = select(
+        schedule.room_id,
+        schedule.date,
+        *[func.coalesce(func.sum(case((counter.status == status, counter.count), else_=0)), 0) for status in ROLLUP_STATUSES],
+        literal(datetime.now()),
+    ).select_from(counter).join(
+        schedule, schedule.schedule_id == counter.schedule_id
+    ).group_by(schedule.room_id, schedule.date)
+
+    if since is not None:
+        stale = stale.where(rollup.day >= since)
+        source = source.where(schedule.date >= since)
+    if until is not None:
+        stale = stale.where(rollup.day <= until)
+        source = source.where(schedule.date <= until)
+    if room_id is not None:
+        stale = stale.where(rollup.room_id == room_id)
+        source = source.where(schedule.room_id == room_id)
+
+    # Replace rather than merge, so days whose schedules moved away are cleared
+    db.execute(stale)
+    return db.execute(
+        rollup.__table__.insert().from_select(["room_id", "day", *ROLLUP_STATUSES, "updated_at"], source)
+    ).rowcount
+
+
+def backfill_attendance_counters(db: Session) -> bool:
+    """
+    Fill the counters and daily rollups of a database whose records predate them: when the
+    counter tables are empty but attendance records exist. Commits. Returns True if it rebuilt them.
+    """
+    if db.query(models.RoomAttendanceCounterModel.id).first() is not None:
+        return False
+    if db.query(models.AttendanceRecordModel.attendance_id).first() is None:
+        return False
+
+    rebuild_attendance_counters(db)
+    refresh_daily_rollups(db)
+    db.commit()
+    print("Built the attendance counters and daily rollups from the existing attendance records")
+    return True
+
+
+if __name__ == "__main__":
+    # Repair the counters and daily rollups: python -m backend.attendance_counters rebuild [room_id]
+    if len(sys.argv) < 2 or sys.argv[1] != "rebuild":
+        print("Usage: python -m backend.attendance_counters rebuild [room_id]")
+        sys.exit(1)
+
+    db = SessionLocal()
+    try:
+        rebuild_room_id = int(sys.argv[2]) if len(sys.argv) > 2 else None
+        rebuild_attendance_counters(db, rebuild_room_id)
+        refresh_daily_rollups(db, room_id=rebuild_room_id)
+        db.commit()
+        print(f"Rebuilt attendance counters for {'room ' + str(rebuild_room_id) if rebuild_room_id else 'all rooms'}")
+    finally:
+        db.close()
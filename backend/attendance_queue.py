@@ -0,0 +1,264 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy.exc import DataError, IntegrityError
+
+from backend import models
+from backend.database import SessionLocal
+from backend.utils import upsert_attendance_records
+
+ATTENDANCE_FLUSH_INTERVAL_SECONDS = 0.2
+# Scans that fail to write are retried one by one with exponential backoff, for up to
+# ATTENDANCE_RETRY_SECONDS; after that, or on an error retrying cannot fix, they are dead-lettered
+ATTENDANCE_RETRY_BASE_SECONDS = 0.5
+ATTENDANCE_RETRY_MAX_BACKOFF_SECONDS = 30
+ATTENDANCE_RETRY_SECONDS = int(os.getenv("ATTENDANCE_RETRY_SECONDS", "900"))
+ATTENDANCE_DEAD_LETTER_FILE = os.getenv("ATTENDANCE_DEAD_LETTER_FILE", "failed_attendance_scans.jsonl")
+# How long closing a schedule waits for this worker's queued scans of it
+ATTENDANCE_DRAIN_TIMEOUT_SECONDS = 5
+
+
+class AttendanceWriteQueue:
+    """
+    Write-behind queue for validated attendance scans.
+    take_attendance acknowledges a scan as soon as it is queued; a background thread applies
+    the queued scans every few hundred milliseconds as one multi-row upsert, together with
+    their audit logs and teacher notifications.
+    Queued scans stay visible through pending() until they are written, so the scanning
+    student reads their own attendance. When a batch fails its scans are written one at a
+    time, so one bad row does not hold back the others, and failing scans are retried with
+    backoff. Scans that cannot be written are appended to ATTENDANCE_DEAD_LETTER_FILE and
+    reported to the room's teacher, never dropped silently. The queue lives in memory: scans
+    that are still queued when the process is killed without a shutdown are lost.
+    """
+
+    def __init__(self, interval: float = ATTENDANCE_FLUSH_INTERVAL_SECONDS):
+        self.interval = interval
+        self._queue = []
+        self._pending = {}  # (room_id, user_id, schedule_id) -> entry
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="attendance-flusher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the flusher, make a last attempt at everything still queued and dead-letter what still fails."""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self.flush(force=True)
+        with self._flush_lock, self._lock:
+            remaining, self._queue = self._queue, []
+        for entry in remaining:
+            self._dead_letter(entry, entry.get("error", "Attendance queue stopped before the scan was written"))
+
+    def submit(self, entry: dict) -> bool:
+        """
+        Queue a scan. The entry holds the record columns (room_id, user_id, schedule_id, status,
+        taken_at) plus what the flusher needs for the log and notification.
+        Returns False if a scan for the same student and schedule is already queued.
+        """
+        key = (entry["room_id"], entry["user_id"], entry["schedule_id"])
+        with self._lock:
+            if key in self._pending:
+                return False
+            entry["attempts"] = 0
+            entry["retry_at"] = 0
+            self._pending[key] = entry
+            self._queue.append(entry)
+        return True
+
+    def pending(self, room_id: int, user_id: int, schedule_id: int = None):
+        """Return the queued entry for a schedule, or a {schedule_id: entry} dict of the student's queued scans in the room."""
+        with self._lock:
+            if schedule_id is not None:
+                return self._pending.get((room_id, user_id, schedule_id))
+            return {
+                key[2]: entry for key, entry in self._pending.items()
+                if key[0] == room_id and key[1] == user_id
+            }
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+    def drain(self, schedule_id: int, timeout: float = ATTENDANCE_DRAIN_TIMEOUT_SECONDS) -> bool:
+        """
+        Write this worker's queued scans of a schedule, retrying early if needed, and wait up to
+        timeout seconds for them. Returns False if some are still queued.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                waiting = any(key[2] == schedule_id for key in self._pending)
+            if not waiting:
+                return True
+            if time.monotonic() >= deadline:
+                return False
+            self.flush(force=True)
+            time.sleep(self.interval)
+
+    def flush(self, force: bool = False) -> int:
+        """
+        Write the queued scans that are due, in one transaction, falling back to one transaction
+        per scan when that fails. force ignores the retry backoff. Returns the number of entries attempted.
+        """
+        with self._flush_lock:
+            now = time.monotonic()
+            with self._lock:
+                batch = [entry for entry in self._queue if force or entry["retry_at"] <= now]
+                self._queue = [entry for entry in self._queue if not (force or entry["retry_at"] <= now)]
+            if not batch:
+                return 0
+
+            db = SessionLocal()
+            try:
+                self._write(db, batch)
+                db.commit()
+                done = batch
+            except Exception as e:
+                db.rollback()
+                print(f"Error flushing {len(batch)} queued attendance scans, writing them one by one: {e}")
+                done = self._write_each(db, batch)
+            finally:
+                db.close()
+
+            with self._lock:
+                for entry in done:
+                    self._pending.pop((entry["room_id"], entry["user_id"], entry["schedule_id"]), None)
+            return len(batch)
+
+    def _write_each(self, db, batch):
+        """Write the scans of a failed batch one transaction each. Returns the entries that are finished with."""
+        done = []
+        retry = []
+        for entry in batch:
+            try:
+                self._write(db, [entry])
+                db.commit()
+                done.append(entry)
+                continue
+            except (IntegrityError, DataError) as e:
+                # The row itself is invalid, e.g. its room or schedule was deleted
+                db.rollback()
+                self._dead_letter(entry, repr(e))
+                done.append(entry)
+                continue
+            except Exception as e:
+                db.rollback()
+                entry["error"] = repr(e)
+
+            now = time.monotonic()
+            entry.setdefault("first_failed_at", now)
+            if now - entry["first_failed_at"] >= ATTENDANCE_RETRY_SECONDS:
+                self._dead_letter(entry, entry["error"])
+                done.append(entry)
+            else:
+                entry["retry_at"] = now + min(
+                    ATTENDANCE_RETRY_BASE_SECONDS * 2 ** entry["attempts"], ATTENDANCE_RETRY_MAX_BACKOFF_SECONDS
+                )
+                entry["attempts"] += 1
+                retry.append(entry)
+
+        with self._lock:
+            self._queue[:0] = retry
+        return done
+
+    def _dead_letter(self, entry, error: str):
+        """Keep a scan that could not be written in the dead-letter file and tell the room's teacher."""
+        print(f"Could not write the attendance scan of user {entry['user_id']} for schedule {entry['schedule_id']}: {error}")
+        fields = ("room_id", "user_id", "schedule_id", "status", "taken_at", "ip_address", "user_agent")
+        try:
+            with open(ATTENDANCE_DEAD_LETTER_FILE, "a") as dead_letters:
+                dead_letters.write(json.dumps(
+                    {**{field: entry.get(field) for field in fields}, "error": error, "failed_at": datetime.now()},
+                    default=str
+                ) + "\n")
+        except OSError as e:
+            print(f"Error writing the attendance dead-letter file: {e}")
+
+        db = SessionLocal()
+        try:
+            db.add(models.Notification(
+                user_id=entry["owner_id"],
+                title="Attendance Not Saved",
+                message=(
+                    f"The {entry['status']} attendance of student ID {entry['user_id']} for schedule "
+                    f"'{entry['schedule_name']}' in room '{entry['class_name']}' could not be saved. "
+                    f"Please record it manually."
+                ),
+                is_read=False,
+                created_at=datetime.utcnow(),
+                room_id=entry["room_id"]
+            ))
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"Error notifying the teacher of an unsaved attendance scan: {e}")
+        finally:
+            db.close()
+
+    def _write(self, db, batch):
+        # Another worker may have written the record since the scan was validated; its record
+        # is kept. An absent record was written by the schedule closing while the scan was
+        # still queued; the scan was validated within the schedule, so it replaces it
+        written = upsert_attendance_records(db, [
+            {
+                "room_id": entry["room_id"],
+                "user_id": entry["user_id"],
+                "schedule_id": entry["schedule_id"],
+                "status": entry["status"],
+                "taken_at": entry["taken_at"],
+            }
+            for entry in batch
+        ], update_from=("pending", "absent"))
+
+        # Only the scans that changed their record get a log and a notification
+        entries = [entry for entry in batch if (entry["room_id"], entry["user_id"], entry["schedule_id"]) in written]
+        if not entries:
+            return
+
+        students = {
+            student.user_id: student
+            for student in db.query(models.UserModel).filter(
+                models.UserModel.user_id.in_({entry["user_id"] for entry in entries})
+            ).all()
+        }
+        for entry in entries:
+            student = students.get(entry["user_id"])
+            db.add(models.Logs(
+                user_id=entry["user_id"],
+                action="Take Attendance",
+                level="INFO",
+                timestamp=entry["taken_at"],
+                ip_address=entry["ip_address"],
+                user_agent=entry["user_agent"],
+                details=f"User {entry['user_id']} marked attendance for schedule {entry['schedule_id']}",
+                action_type="CREATE",
+            ))
+            if student:
+                db.add(models.Notification(
+                    user_id=entry["owner_id"],  # Teacher's user_id (owner of the room)
+                    title="Student Attendance Marked",
+                    message=(
+                        f"Student {student.first_name} {student.last_name} (ID: {student.user_id}) "
+                        f"has marked '{entry['status']}' attendance for schedule '{entry['schedule_name']}' "
+                        f"in room '{entry['class_name']}'."
+                    ),
+                    is_read=False,
+                    created_at=datetime.utcnow(),
+                    room_id=entry["room_id"]
+                ))
+
+
+attendance_queue = AttendanceWriteQueue()
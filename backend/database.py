@@ -1,14 +1,25 @@
-from sqlalchemy import create_engine
+import os
+from sqlalchemy import create_engine, make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 
-URL_DATABASE = 'DATABASE URL HERE'
+URL_DATABASE = os.getenv("DATABASE_URL", 'DATABASE URL HERE')
+
+# Async driver of each backend, so the async engine always points at the same database
+ASYNC_DRIVERS = {"mysql": "mysql+aiomysql", "sqlite": "sqlite+aiosqlite"}
+_url = make_url(URL_DATABASE)
+ASYNC_URL_DATABASE = _url.set(drivername=ASYNC_DRIVERS.get(_url.get_backend_name(), _url.drivername))
 
 # Create engine with MySQL-specific options
 engine = create_engine(URL_DATABASE, pool_recycle=3600, pool_pre_ping=True)
 SessionLocal = sessionmaker(bind=engine)
 Base = declarative_base()
 
+# Async engine for the hot paths that run inside the event loop (attendance scans, notifications)
+async_engine = create_async_engine(ASYNC_URL_DATABASE, pool_recycle=3600, pool_pre_ping=True)
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, expire_on_commit=False)
+
 # Dependency function to get a database session
 def get_db():
     db = SessionLocal()
@@ -16,3 +27,8 @@ def get_db():
         yield db
     finally:
         db.close()
+
+# Dependency function to get an async database session
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
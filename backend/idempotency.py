@@ -0,0 +1,159 @@
+import hashlib
+import json
+from datetime import datetime, timedelta
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import delete, update
+from sqlalchemy.exc import IntegrityError
+from starlette.concurrency import run_in_threadpool
+
+from backend import models
+from backend.database import SessionLocal
+
+IDEMPOTENCY_TTL_SECONDS = 600
+# A claim left by a worker that died mid-request blocks retries for at most this long
+IDEMPOTENCY_IN_FLIGHT_SECONDS = 60
+
+
+class IdempotencyStore:
+    """
+    Remembers the response of a mutating request under its idempotency key for a bounded
+    window, so a client retrying after a dropped connection gets the original result back
+    instead of redoing the work. Only successful responses are kept; a failed request can
+    be retried with the same key. Keys live in the idempotency_keys table, so a retry that
+    lands on another worker is answered the same way; the primary key makes claiming a key
+    atomic across workers.
+    """
+
+    def __init__(self, ttl_seconds: float = IDEMPOTENCY_TTL_SECONDS, in_flight_seconds: float = IDEMPOTENCY_IN_FLIGHT_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self.in_flight_seconds = in_flight_seconds
+
+    @staticmethod
+    def _hash(key) -> str:
+        return hashlib.sha256(json.dumps(key, default=str).encode()).hexdigest()
+
+    def begin(self, key):
+        """
+        Claim a key before running the request. Returns the stored response if the key
+        already completed, None if the caller should run the request.
+        Raises 409 if a request with the same key is still running.
+        """
+        key_hash = self._hash(key)
+        table = models.IdempotencyKeyModel
+        db = SessionLocal()
+        try:
+            while True:
+                db.expunge_all()
+                now = datetime.now()
+                expires_at = now + timedelta(seconds=self.in_flight_seconds)
+                try:
+                    db.add(table(key_hash=key_hash, response=None, expires_at=expires_at))
+                    db.commit()
+                    return None
+                except IntegrityError:
+                    db.rollback()
+
+                entry = db.get(table, key_hash)
+                if entry is None:
+                    continue  # Pruned or released meanwhile, claim it again
+                if entry.expires_at <= now:
+                    # Take over an expired entry, unless another request just did
+                    claimed = db.execute(
+                        update(table)
+                        .where(table.key_hash == key_hash, table.expires_at <= now)
+                        .values(response=None, expires_at=expires_at)
+                    ).rowcount
+                    db.commit()
+                    if claimed:
+                        return None
+                    continue
+                if entry.response is None:
+                    raise HTTPException(
+                        status_code=409,
+                        detail="A request with this idempotency key is still being processed",
+                        headers={"Retry-After": "1"}
+                    )
+                return entry.response
+        finally:
+            db.close()
+
+    def complete(self, key, response):
+        db = SessionLocal()
+        try:
+            db.execute(
+                update(models.IdempotencyKeyModel)
+                .where(models.IdempotencyKeyModel.key_hash == self._hash(key))
+                .values(
+                    response=jsonable_encoder(response),
+                    expires_at=datetime.now() + timedelta(seconds=self.ttl_seconds)
+                )
+            )
+            db.commit()
+        finally:
+            db.close()
+
+    def release(self, key):
+        """Forget a key whose request failed."""
+        db = SessionLocal()
+        try:
+            db.execute(delete(models.IdempotencyKeyModel).where(models.IdempotencyKeyModel.key_hash == self._hash(key)))
+            db.commit()
+        finally:
+            db.close()
+
+
+idempotency_store = IdempotencyStore()
+
+
+def prune_idempotency_keys() -> int:
+    """Delete expired idempotency keys. Returns the number of rows deleted."""
+    db = SessionLocal()
+    try:
+        deleted = db.execute(
+            delete(models.IdempotencyKeyModel).where(models.IdempotencyKeyModel.expires_at <= datetime.now())
+        ).rowcount
+        db.commit()
+        return deleted
+    finally:
+        db.close()
+
+
+async def run_idempotent(scope, endpoint: str, idempotency_key: str, handler):
+    """
+    Run an async endpoint body at most once per (scope, endpoint, idempotency_key).
+    scope identifies the caller, usually the user id. Requests without a key run normally.
+    """
+    if not idempotency_key:
+        return await handler()
+
+    key = (scope, endpoint, idempotency_key)
+    stored = await run_in_threadpool(idempotency_store.begin, key)
+    if stored is not None:
+        return stored
+    try:
+        response = await handler()
+    except BaseException:
+        await run_in_threadpool(idempotency_store.release, key)
+        raise
+    await run_in_threadpool(idempotency_store.complete, key, response)
+    return response
+
+
+def run_idempotent_sync(scope, endpoint: str, idempotency_key: str, handler):
+    """Sync variant of run_idempotent for endpoints running in the threadpool."""
+    if not idempotency_key:
+        return handler()
+
+    key = (scope, endpoint, idempotency_key)
+    stored = idempotency_store.begin(key)
+    if stored is not None:
+        return stored
+    try:
+        response = handler()
+    except BaseException:
+        idempotency_store.release(key)
+        raise
+    idempotency_store.complete(key, response)
+    return response
@@ -0,0 +1,140 @@
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from apscheduler.events import (
+    EVENT_JOB_ERROR, EVENT_JOB_EXECUTED, EVENT_JOB_MAX_INSTANCES, EVENT_JOB_MISSED, EVENT_JOB_SUBMITTED
+)
+from sqlalchemy import case, func
+
+from backend import models
+from backend.database import SessionLocal
+
+JOB_RUN_RETENTION_DAYS = int(os.getenv("JOB_RUN_RETENTION_DAYS", "7"))
+# Scheduler housekeeping that runs every few seconds in every worker and is not worth a row per run
+UNRECORDED_JOB_IDS = {"campaign_for_leader", "refresh_schedule_index", "refresh_schedule_index_midnight"}
+
+
+class JobRunRecorder:
+    """
+    Records every run of the scheduler's jobs in job_runs: when it was due, when it started
+    and finished, how long it took, how far behind its fire time it started, the rows it
+    changed (the job's return value, when it returns a count) and the error it raised.
+    Runs that were missed, or skipped because the previous run was still going, are recorded too.
+    """
+
+    def __init__(self):
+        self._started = {}  # (job_id, scheduled run time) -> (job name, started_at, monotonic start)
+        # Runs that finished before their submission event was handled, which happens for
+        # jobs quicker than the scheduler thread; their start time is unknown
+        self._finished_early = set()
+        self._lock = threading.Lock()
+
+    def attach(self, scheduler):
+        self._scheduler = scheduler
+        scheduler.add_listener(
+            self._on_event,
+            EVENT_JOB_SUBMITTED | EVENT_JOB_EXECUTED | EVENT_JOB_ERROR | EVENT_JOB_MISSED | EVENT_JOB_MAX_INSTANCES
+        )
+
+    def _job_name(self, job_id: str) -> str:
+        job = self._scheduler.get_job(job_id)
+        return job.name if job else job_id
+
+    def _on_event(self, event):
+        if event.job_id in UNRECORDED_JOB_IDS:
+            return
+        try:
+            if event.code == EVENT_JOB_SUBMITTED:
+                name = self._job_name(event.job_id)
+                with self._lock:
+                    for run_time in event.scheduled_run_times:
+                        key = (event.job_id, run_time)
+                        if key in self._finished_early:
+                            self._finished_early.discard(key)
+                        else:
+                            self._started[key] = (name, datetime.now(), time.monotonic())
+            elif event.code in (EVENT_JOB_EXECUTED, EVENT_JOB_ERROR):
+                key = (event.job_id, event.scheduled_run_time)
+                with self._lock:
+                    if key in self._started:
+                        name, started_at, start = self._started.pop(key)
+                    else:
+                        self._finished_early.add(key)
+                        name, started_at, start = self._job_name(event.job_id), None, None
+                self._record(
+                    event.job_id, name, "ERROR" if event.exception else "SUCCESS", event.scheduled_run_time,
+                    started_at=started_at,
+                    duration_ms=(time.monotonic() - start) * 1000 if start is not None else None,
+                    rows_affected=event.retval if isinstance(event.retval, int) else None,
+                    error=repr(event.exception)[:2000] if event.exception else None,
+                )
+            elif event.code == EVENT_JOB_MAX_INSTANCES:
+                for run_time in event.scheduled_run_times:
+                    self._record(event.job_id, self._job_name(event.job_id), "SKIPPED", run_time,
+                                 error="Previous run was still in progress")
+            elif event.code == EVENT_JOB_MISSED:
+                self._record(event.job_id, self._job_name(event.job_id), "MISSED", event.scheduled_run_time)
+        except Exception as e:
+            print(f"Error recording run of job {event.job_id}: {e}")
+
+    def _record(self, job_id, job_name, status, scheduled_run_time, started_at=None, duration_ms=None,
+                rows_affected=None, error=None):
+        # APScheduler run times are timezone aware, job_runs stores local naive datetimes like the other tables
+        scheduled_at = datetime.fromtimestamp(scheduled_run_time.timestamp()) if scheduled_run_time else None
+        lag_ms = (started_at - scheduled_at).total_seconds() * 1000 if started_at and scheduled_at else None
+
+        db = SessionLocal()
+        try:
+            db.add(models.JobRunModel(
+                job_id=job_id,
+                job_name=job_name,
+                status=status,
+                scheduled_at=scheduled_at,
+                started_at=started_at,
+                finished_at=datetime.now(),
+                duration_ms=duration_ms,
+                lag_ms=lag_ms,
+                rows_affected=rows_affected,
+                error=error,
+                worker_pid=os.getpid(),
+            ))
+            db.commit()
+        finally:
+            db.close()
+
+
+job_run_recorder = JobRunRecorder()
+
+
+def prune_job_runs() -> int:
+    """Delete job runs older than the retention window. Returns the number of rows deleted."""
+    db = SessionLocal()
+    try:
+        deleted = db.query(models.JobRunModel).filter(
+            models.JobRunModel.finished_at < datetime.now() - timedelta(days=JOB_RUN_RETENTION_DAYS)
+        ).delete(synchronize_session=False)
+        db.commit()
+        return deleted
+    finally:
+        db.close()
+
+
+def job_run_metrics(db, since: datetime):
+    """Aggregate the job runs finished since a moment, one row per job name."""
+    run = models.JobRunModel
+    rows = db.query(
+        run.job_name,
+        func.count().label("runs"),
+        func.sum(case((run.status == "ERROR", 1), else_=0)).label("errors"),
+        func.sum(case((run.status == "MISSED", 1), else_=0)).label("missed"),
+        func.sum(case((run.status == "SKIPPED", 1), else_=0)).label("skipped"),
+        func.avg(run.duration_ms).label("avg_duration_ms"),
+        func.max(run.duration_ms).label("max_duration_ms"),
+        func.avg(run.lag_ms).label("avg_lag_ms"),
+        func.max(run.lag_ms).label("max_lag_ms"),
+        func.sum(run.rows_affected).label("rows_affected"),
+        func.max(run.finished_at).label("last_finished_at"),
+    ).filter(run.finished_at >= since).group_by(run.job_name).all()
+    return [dict(row._mapping) for row in rows]
@@ -0,0 +1,121 @@
+import os
+import tempfile
+import time
+
+from sqlalchemy import text
+
+from backend.database import engine
+
+# Name of the lock the background scheduler's leader holds
+LEADER_LOCK_NAME = os.getenv("SCHEDULER_LOCK_NAME", "attendance_scheduler_leader")
+# "mysql" for a database advisory lock shared by every host, "file" for a lock file on a
+# single host; defaults to the advisory lock when the database is MySQL
+LEADER_LOCK_BACKEND = os.getenv("SCHEDULER_LOCK_BACKEND")
+LEADER_LOCK_FILE = os.getenv(
+    "SCHEDULER_LOCK_FILE", os.path.join(tempfile.gettempdir(), f"{LEADER_LOCK_NAME}.lock")
+)
+
+
+class MySQLLeaderLock:
+    """
+    MySQL advisory lock (GET_LOCK) held on a dedicated connection. The server releases it
+    when that connection closes, so a crashed leader frees the lock for another worker.
+    """
+
+    def __init__(self, name: str = LEADER_LOCK_NAME):
+        self.name = name
+        self._connection = None
+
+    def acquire(self, timeout: float = 0) -> bool:
+        """Try to take the lock, waiting up to timeout seconds. Returns True if this process holds it."""
+        if self._connection is not None:
+            return self.held()
+        connection = engine.connect()
+        try:
+            acquired = connection.execute(
+                text("SELECT GET_LOCK(:name, :timeout)"), {"name": self.name, "timeout": timeout}
+            ).scalar()
+        except Exception:
+            connection.close()
+            raise
+        if acquired == 1:
+            self._connection = connection
+            return True
+        connection.close()
+        return False
+
+    def held(self) -> bool:
+        """Check that the lock is still ours, e.g. that the connection holding it has not dropped."""
+        if self._connection is None:
+            return False
+        try:
+            return self._connection.execute(
+                text("SELECT IS_USED_LOCK(:name) = CONNECTION_ID()"), {"name": self.name}
+            ).scalar() == 1
+        except Exception as e:
+            print(f"Lost the scheduler leader lock connection: {e}")
+            self.release()
+            return False
+
+    def release(self):
+        if self._connection is None:
+            return
+        try:
+            self._connection.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": self.name})
+        except Exception:
+            pass
+        finally:
+            try:
+                self._connection.close()
+            except Exception:
+                pass
+            self._connection = None
+
+
+class FileLeaderLock:
+    """Exclusive lock on a file, for a single host running several workers. Freed by the OS when the holder exits."""
+
+    def __init__(self, path: str = LEADER_LOCK_FILE):
+        self.path = path
+        self._file = None
+
+    def acquire(self, timeout: float = 0) -> bool:
+        import fcntl
+
+        if self._file is not None:
+            return True
+        lock_file = open(self.path, "a")
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except OSError:
+                if time.monotonic() >= deadline:
+                    lock_file.close()
+                    return False
+                time.sleep(0.2)
+        self._file = lock_file
+        return True
+
+    def held(self) -> bool:
+        return self._file is not None
+
+    def release(self):
+        if self._file is None:
+            return
+        import fcntl
+
+        fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._file.close()
+        self._file = None
+
+
+def make_leader_lock(name: str = LEADER_LOCK_NAME):
+    """Build a lock of the backend configured by SCHEDULER_LOCK_BACKEND, the scheduler leader's by default."""
+    backend = LEADER_LOCK_BACKEND or ("mysql" if engine.dialect.name == "mysql" else "file")
+    if backend == "mysql":
+        return MySQLLeaderLock(name)
+    if name == LEADER_LOCK_NAME:
+        return FileLeaderLock()
+    return FileLeaderLock(os.path.join(tempfile.gettempdir(), f"{name}.lock"))
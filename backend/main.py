@@ -3,9 +3,13 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from backend import models
+from backend.attendance_counters import backfill_attendance_counters
+from backend.attendance_queue import attendance_queue
 from backend.database import SessionLocal, engine
-from backend.utils import hash_password, mark_pending_as_absent
-from apscheduler.schedulers.background import BackgroundScheduler
+from backend.leader_lock import LEADER_LOCK_NAME, make_leader_lock
+from backend.schedule_index import refresh_schedule_index
+from backend.scheduler import start_scheduler, stop_scheduler
+from backend.utils import add_schedule_finalized_column, create_missing_index, hash_password
 from backend.routers import admin_logs, admin_rooms, admin_users, attendance, auth, calendar, face_auth, generate_report, geofence, notification, profile, rooms
 
 app = FastAPI()
@@ -25,6 +29,29 @@ app.add_middleware(
 
 models.Base.metadata.create_all(bind=engine)
 
+def upgrade_database():
+    """Bring a database created by an earlier release up to date. Workers take turns, so only the first one does the work."""
+    startup_lock = make_leader_lock(f"{LEADER_LOCK_NAME}_startup")
+    if not startup_lock.acquire(timeout=120):
+        print("Timed out waiting for another worker to upgrade the database, upgrading anyway")
+    try:
+        # Databases created before schedules were finalized need the column, with past schedules stamped
+        add_schedule_finalized_column(engine)
+        # Indexes added after the tables were first created
+        create_missing_index(engine, models.AttendanceScheduleModel.__table__, "ix_attendance_schedule_room_date")
+        create_missing_index(engine, models.AttendanceRecordModel.__table__, "ix_attendance_record_status_schedule")
+        create_missing_index(engine, models.AttendanceScheduleModel.__table__, "ix_attendance_schedule_date")
+        # The summary, rate and dashboard endpoints read the counters, which start empty
+        db = SessionLocal()
+        try:
+            backfill_attendance_counters(db)
+        finally:
+            db.close()
+    finally:
+        startup_lock.release()
+
+upgrade_database()
+
 def create_admin_account():
     db = SessionLocal()
     try:
@@ -51,6 +78,7 @@ def create_admin_account():
         db.close()
 
 create_admin_account()
+refresh_schedule_index()
 app.include_router(auth.router, prefix="/auth", tags=["Authentication"])
 app.include_router(rooms.router, prefix="/rooms", tags=["Rooms"])
 app.include_router(attendance.router, prefix="/attendance", tags=["Attendance"])
@@ -74,19 +102,16 @@ app.mount(
     name="excuse_attachments"
 )
 
-from apscheduler.schedulers.background import BackgroundScheduler
-
-scheduler = BackgroundScheduler()
-
-# Add the job to the scheduler (runs every 10 minutes)
-scheduler.add_job(lambda: mark_pending_as_absent(SessionLocal()), "interval", minutes=5)
-
-# Start the scheduler
-scheduler.start()
+# Close schedules at their end time and keep the schedule index fresh
+start_scheduler()
 
 # Ensure the scheduler shuts down gracefully on app termination
 import atexit
-atexit.register(lambda: scheduler.shutdown())
+atexit.register(stop_scheduler)
+
+# Apply queued attendance scans in batches; write whatever is left on shutdown
+attendance_queue.start()
+atexit.register(attendance_queue.stop)
 
 if __name__ == '__main__':
     import uvicorn
@@ -1,6 +1,6 @@
 from datetime import datetime
 from sqlalchemy import (
-    JSON, VARCHAR, Column, Date, DateTime, Float, Integer, String, ForeignKey, Boolean, Enum, Time, UniqueConstraint
+    JSON, VARCHAR, Column, Date, DateTime, Float, Integer, String, ForeignKey, Boolean, Enum, Index, Time, UniqueConstraint
 )
 from sqlalchemy.orm import relationship, backref
 from backend.database import Base
@@ -90,6 +90,14 @@ class AttendanceScheduleModel(Base):
     end_time = Column(Time, nullable=False)
     created_at = Column(DateTime, default=datetime.now, nullable=False)
     is_archived = Column(Boolean, default=False)
+    # Set once the schedule has ended and its pending records were marked absent
+    finalized_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_attendance_schedule_room_date", "room_id", "date"),
+        Index("ix_attendance_schedule_finalized_end", "finalized_at", "date", "end_time"),
+        Index("ix_attendance_schedule_date", "date"),
+    )
 
     room = relationship("RoomsModel", back_populates="schedules")
     generated_qrs = relationship("GeneratedQRModel", back_populates="schedule", cascade="all, delete-orphan")
@@ -110,7 +118,10 @@ class GeneratedQRModel(Base):
 
 class AttendanceRecordModel(Base):
     __tablename__ = "attendance_record"
-    __table_args__ = (UniqueConstraint("room_id", "user_id", "schedule_id", name="unique_attendance_record"),)
+    __table_args__ = (
+        UniqueConstraint("room_id", "user_id", "schedule_id", name="unique_attendance_record"),
+        Index("ix_attendance_record_status_schedule", "status", "schedule_id"),
+    )
 
     attendance_id = Column(Integer, primary_key=True, index=True, unique=True)
     room_id = Column(Integer, ForeignKey("rooms.room_id"), nullable=False)
@@ -133,6 +144,22 @@ class GeofenceLocationModel(Base):
     latitude = Column(Float, nullable=False)
     radius = Column(Float, nullable=False)
 
+class GeofenceAttemptModel(Base):
+    __tablename__ = "geofence_attempts"
+    __table_args__ = (
+        Index("ix_geofence_attempts_fence_time", "geofence_id", "created_at"),
+        Index("ix_geofence_attempts_room_time", "room_id", "created_at"),
+    )
+
+    attempt_id = Column(Integer, primary_key=True, index=True, unique=True)
+    user_id = Column(Integer, ForeignKey("users.user_id", ondelete="CASCADE"), nullable=False)
+    room_id = Column(Integer, ForeignKey("rooms.room_id", ondelete="CASCADE"), nullable=False)
+    geofence_id = Column(Integer, ForeignKey("geofence_location.geofence_id", ondelete="CASCADE"), nullable=False)
+    distance = Column(Float, nullable=False)  # meters from the geofence center
+    accuracy = Column(Float, nullable=True)  # meters, as reported by the device
+    is_within = Column(Boolean, nullable=False)
+    created_at = Column(DateTime, default=datetime.now, nullable=False)
+
 class Logs(Base):
     __tablename__ = "logs"
 
@@ -183,4 +210,87 @@ class ExcusedModel(Base):
     attachment_path = Column(String(255), nullable=True)
 
     user = relationship("UserModel", back_populates="excused_attendances")
-    schedule = relationship("AttendanceScheduleModel", back_populates="excused_attendances")
\ No newline at end of file
+    schedule = relationship("AttendanceScheduleModel", back_populates="excused_attendances")
+
+class JobRunModel(Base):
+    __tablename__ = "job_runs"
+
+    run_id = Column(Integer, primary_key=True, index=True, unique=True)
+    job_id = Column(String(100), nullable=False)
+    job_name = Column(String(100), nullable=False)
+    status = Column(Enum("SUCCESS", "ERROR", "MISSED", "SKIPPED"), nullable=False)
+    scheduled_at = Column(DateTime, nullable=True)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=False)
+    duration_ms = Column(Float, nullable=True)
+    lag_ms = Column(Float, nullable=True)  # Start time minus the time the job was due
+    rows_affected = Column(Integer, nullable=True)
+    error = Column(String(2000), nullable=True)
+    worker_pid = Column(Integer, nullable=True)
+
+    __table_args__ = (Index("ix_job_runs_name_finished", "job_name", "finished_at"),)
+
+class StudentAttendanceCounterModel(Base):
+    __tablename__ = "student_attendance_counters"
+    __table_args__ = (UniqueConstraint("room_id", "user_id", "status", name="unique_student_attendance_counter"),)
+
+    id = Column(Integer, primary_key=True, index=True, unique=True)
+    room_id = Column(Integer, ForeignKey("rooms.room_id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.user_id"), nullable=False)
+    status = Column(Enum(AttendanceStatus), nullable=False)
+    count = Column(Integer, nullable=False, default=0)
+
+class ScheduleAttendanceCounterModel(Base):
+    __tablename__ = "schedule_attendance_counters"
+    __table_args__ = (UniqueConstraint("schedule_id", "status", name="unique_schedule_attendance_counter"),)
+
+    id = Column(Integer, primary_key=True, index=True, unique=True)
+    schedule_id = Column(Integer, ForeignKey("attendance_schedule.schedule_id"), nullable=False)
+    room_id = Column(Integer, ForeignKey("rooms.room_id"), nullable=False)
+    status = Column(Enum(AttendanceStatus), nullable=False)
+    count = Column(Integer, nullable=False, default=0)
+
+class RoomAttendanceCounterModel(Base):
+    __tablename__ = "room_attendance_counters"
+    __table_args__ = (UniqueConstraint("room_id", "status", name="unique_room_attendance_counter"),)
+
+    id = Column(Integer, primary_key=True, index=True, unique=True)
+    room_id = Column(Integer, ForeignKey("rooms.room_id"), nullable=False)
+    status = Column(Enum(AttendanceStatus), nullable=False)
+    count = Column(Integer, nullable=False, default=0)
+
+class AttendanceDailyRollupModel(Base):
+    __tablename__ = "attendance_daily_rollups"
+    __table_args__ = (UniqueConstraint("room_id", "day", name="unique_attendance_daily_rollup"),)
+
+    id = Column(Integer, primary_key=True, index=True, unique=True)
+    room_id = Column(Integer, ForeignKey("rooms.room_id"), nullable=False)
+    day = Column(Date, nullable=False)  # Date of the schedules counted
+    present = Column(Integer, nullable=False, default=0)
+    late = Column(Integer, nullable=False, default=0)
+    absent = Column(Integer, nullable=False, default=0)
+    excused = Column(Integer, nullable=False, default=0)
+    pending = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.now, nullable=False)
+
+class AtRiskStudentModel(Base):
+    __tablename__ = "at_risk_students"
+    __table_args__ = (UniqueConstraint("room_id", "user_id", name="unique_at_risk_student"),)
+
+    id = Column(Integer, primary_key=True, index=True, unique=True)
+    room_id = Column(Integer, ForeignKey("rooms.room_id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.user_id"), nullable=False)
+    sessions = Column(Integer, nullable=False)  # Finalized sessions with a present, late or absent record
+    absence_rate = Column(Float, nullable=False)
+    recent_absence_rate = Column(Float, nullable=False)
+    current_streak = Column(Integer, nullable=False)
+    longest_streak = Column(Integer, nullable=False)
+    reasons = Column(JSON, nullable=False)
+    flagged_at = Column(DateTime, default=datetime.now, nullable=False)
+
+class IdempotencyKeyModel(Base):
+    __tablename__ = "idempotency_keys"
+
+    key_hash = Column(String(64), primary_key=True)  # sha256 of the scope, endpoint and Idempotency-Key header
+    response = Column(JSON(none_as_null=True), nullable=True)  # NULL while the request is still running
+    expires_at = Column(DateTime, nullable=False, index=True)
@@ -0,0 +1,88 @@
+import base64
+import hashlib
+import hmac
+import io
+import os
+import time
+from datetime import datetime
+from functools import lru_cache
+
+import qrcode
+from fastapi import HTTPException
+
+QR_TOKEN_VERSION = "v1"
+# A new payload is issued every QR_TOKEN_ROTATE_SECONDS; the previous QR_TOKEN_GRACE_WINDOWS
+# payloads stay valid so a code scanned right before it rotates still works
+QR_TOKEN_ROTATE_SECONDS = int(os.getenv("QR_TOKEN_ROTATE_SECONDS", "30"))
+QR_TOKEN_GRACE_WINDOWS = int(os.getenv("QR_TOKEN_GRACE_WINDOWS", "1"))
+# Static QR codes only hold the room id, which anyone can share or type in; they are refused
+# unless explicitly allowed, e.g. while printed codes from an earlier release are replaced
+ALLOW_STATIC_ROOM_QR = os.getenv("ALLOW_STATIC_ROOM_QR", "false").lower() in ("1", "true", "yes")
+
+# Derived from SECRET_KEY so QR signatures never share a key with the JWTs
+_SIGNING_KEY = hmac.new((os.getenv("SECRET_KEY") or "").encode(), b"attendance-qr-token", hashlib.sha256).digest()
+
+
+def _sign(room_id: int, schedule_id: int, window: int) -> str:
+    message = f"{QR_TOKEN_VERSION}.{room_id}.{schedule_id}.{window}".encode()
+    digest = hmac.new(_SIGNING_KEY, message, hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+
+def is_qr_token(text: str) -> bool:
+    """True if a scanned text is a signed payload rather than a bare room id."""
+    return text.startswith(f"{QR_TOKEN_VERSION}.")
+
+
+def require_static_room_qr():
+    """Raise 400 for a bare room id unless ALLOW_STATIC_ROOM_QR is set."""
+    if not ALLOW_STATIC_ROOM_QR:
+        raise HTTPException(status_code=400, detail="This QR code is no longer valid. Please scan the code currently displayed.")
+
+
+def issue_qr_token(room_id: int, schedule_id: int, now: float = None):
+    """Return the current signed payload for a schedule and the datetime it stops being displayed."""
+    now = time.time() if now is None else now
+    window = int(now // QR_TOKEN_ROTATE_SECONDS)
+    payload = f"{QR_TOKEN_VERSION}.{room_id}.{schedule_id}.{window}.{_sign(room_id, schedule_id, window)}"
+    expires_at = datetime.fromtimestamp((window + 1) * QR_TOKEN_ROTATE_SECONDS)
+    return payload, expires_at
+
+
+def verify_qr_token(payload: str, now: float = None):
+    """
+    Check a scanned payload's signature and age without touching the database.
+    Returns (room_id, schedule_id); raises 400 for a malformed, forged or expired payload.
+    """
+    try:
+        version, room_id, schedule_id, window, signature = payload.strip().split(".")
+        room_id, schedule_id, window = int(room_id), int(schedule_id), int(window)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid QR code. Please try again.")
+
+    if version != QR_TOKEN_VERSION or not hmac.compare_digest(signature, _sign(room_id, schedule_id, window)):
+        raise HTTPException(status_code=400, detail="Invalid QR code. Please try again.")
+
+    now = time.time() if now is None else now
+    current_window = int(now // QR_TOKEN_ROTATE_SECONDS)
+    # One window ahead is tolerated for clock drift between workers
+    if not current_window - QR_TOKEN_GRACE_WINDOWS <= window <= current_window + 1:
+        raise HTTPException(status_code=400, detail="This QR code has expired. Please scan the code currently displayed.")
+
+    return room_id, schedule_id
+
+
+@lru_cache(maxsize=256)
+def render_qr_png(payload: str) -> str:
+    """Render a payload as a base64 encoded PNG QR code. Cached, every display polling a window gets the same image."""
+    qr = qrcode.QRCode(
+        version=None,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=10,
+        border=4,
+    )
+    qr.add_data(payload)
+    qr.make(fit=True)
+    buffer = io.BytesIO()
+    qr.make_image(fill_color="black", back_color="white").save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue()).decode()
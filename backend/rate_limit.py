@@ -0,0 +1,181 @@
+import asyncio
+import math
+import os
+import threading
+import time
+
+from fastapi import HTTPException
+
+# Requests per minute and burst size of each token bucket
+USER_RATE_PER_MINUTE = float(os.getenv("RATE_LIMIT_USER_PER_MINUTE", "10"))
+USER_BURST = float(os.getenv("RATE_LIMIT_USER_BURST", "5"))
+ROOM_RATE_PER_MINUTE = float(os.getenv("RATE_LIMIT_ROOM_PER_MINUTE", "300"))
+ROOM_BURST = float(os.getenv("RATE_LIMIT_ROOM_BURST", "60"))
+GLOBAL_RATE_PER_MINUTE = float(os.getenv("RATE_LIMIT_GLOBAL_PER_MINUTE", "1200"))
+GLOBAL_BURST = float(os.getenv("RATE_LIMIT_GLOBAL_BURST", "100"))
+
+# Face inference admission, per worker process
+MAX_CONCURRENT_INFERENCES = int(os.getenv("FACE_MAX_CONCURRENT_INFERENCES", str(os.cpu_count() or 4)))
+MAX_WAITING_INFERENCES = int(os.getenv("FACE_MAX_WAITING_INFERENCES", str(MAX_CONCURRENT_INFERENCES * 4)))
+INFERENCE_WAIT_SECONDS = float(os.getenv("FACE_INFERENCE_WAIT_SECONDS", "5"))
+
+# Set to share the buckets between workers, e.g. redis://localhost:6379/0
+REDIS_URL = os.getenv("REDIS_URL")
+
+
+class TokenBucket:
+    """In-process token bucket per key. Each worker enforces its own share of the limit."""
+
+    def __init__(self, name: str, rate_per_minute: float, burst: float):
+        self.name = name
+        self.rate = rate_per_minute / 60
+        self.burst = burst
+        self._buckets = {}  # key -> (tokens, updated_at)
+        self._lock = threading.Lock()
+
+    async def take(self, key) -> float:
+        """Take one token. Returns 0 on success, otherwise the seconds until a token is available."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                return 0
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > 10000:
+                self._prune(now)
+            return (1 - tokens) / self.rate
+
+    def _prune(self, now):
+        # Buckets that have refilled completely are the same as missing ones
+        full_after = self.burst / self.rate
+        for key in [key for key, (_, updated_at) in self._buckets.items() if now - updated_at > full_after]:
+            del self._buckets[key]
+
+
+_REDIS_TAKE_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local tokens = tonumber(bucket[1]) or burst
+local updated_at = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated_at) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated_at', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+
+class RedisTokenBucket(TokenBucket):
+    """Token bucket kept in Redis so all workers share one limit. Falls back to the local bucket if Redis fails."""
+
+    def __init__(self, name: str, rate_per_minute: float, burst: float, client):
+        super().__init__(name, rate_per_minute, burst)
+        self._take_script = client.register_script(_REDIS_TAKE_SCRIPT)
+
+    async def take(self, key) -> float:
+        try:
+            wait = await self._take_script(
+                keys=[f"rate_limit:{self.name}:{key}"],
+                args=[self.rate, self.burst, time.time()]
+            )
+            return float(wait)
+        except Exception as e:
+            print(f"Rate limit backend unavailable, using the local bucket: {e}")
+            return await super().take(key)
+
+
+def _make_bucket(name: str, rate_per_minute: float, burst: float) -> TokenBucket:
+    if REDIS_URL:
+        try:
+            import redis.asyncio as redis
+            return RedisTokenBucket(name, rate_per_minute, burst, redis.from_url(REDIS_URL))
+        except ImportError:
+            print("REDIS_URL is set but the redis package is not installed, using in-process rate limits")
+    return TokenBucket(name, rate_per_minute, burst)
+
+
+user_bucket = _make_bucket("user", USER_RATE_PER_MINUTE, USER_BURST)
+room_bucket = _make_bucket("room", ROOM_RATE_PER_MINUTE, ROOM_BURST)
+global_bucket = _make_bucket("global", GLOBAL_RATE_PER_MINUTE, GLOBAL_BURST)
+
+
+async def enforce_rate_limits(user_id: int, room_id: int = None):
+    """Take a token from the user, room and global buckets; raise 429 with Retry-After when one is empty."""
+    checks = [(user_bucket, user_id)]
+    if room_id is not None:
+        checks.append((room_bucket, room_id))
+    checks.append((global_bucket, "all"))
+
+    for bucket, key in checks:
+        retry_after = await bucket.take(key)
+        if retry_after:
+            raise HTTPException(
+                status_code=429,
+                detail="Too many requests. Please try again shortly.",
+                headers={"Retry-After": str(math.ceil(retry_after))}
+            )
+
+
+class InferenceGate:
+    """
+    Bounds the number of face inferences running at once in this worker. Requests wait a
+    short while for a slot; when too many are already waiting, or the wait times out,
+    they are turned away with 503 instead of piling up.
+    """
+
+    def __init__(self, limit: int, max_waiting: int, wait_seconds: float):
+        self.max_waiting = max_waiting
+        self.wait_seconds = wait_seconds
+        self._semaphore = asyncio.Semaphore(limit)
+        self._waiting = 0
+
+    def _busy(self):
+        return HTTPException(
+            status_code=503,
+            detail="Face verification is busy. Please try again in a moment.",
+            headers={"Retry-After": str(math.ceil(self.wait_seconds))}
+        )
+
+    async def _acquire(self):
+        if self._semaphore.locked() and self._waiting >= self.max_waiting:
+            raise self._busy()
+
+        self._waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.wait_seconds)
+        except asyncio.TimeoutError:
+            raise self._busy()
+        finally:
+            self._waiting -= 1
+
+    async def run(self, executor, fn, *args):
+        """
+        Run fn(*args) in an executor within a slot. The slot is held until fn has finished,
+        even when the caller is cancelled first, since the executor cannot stop a running job.
+        """
+        await self._acquire()
+        try:
+            future = asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+        except BaseException:
+            self._semaphore.release()
+            raise
+        future.add_done_callback(self._finished)
+        return await asyncio.shield(future)
+
+    def _finished(self, future):
+        self._semaphore.release()
+        if not future.cancelled():
+            # Retrieve the exception of an abandoned job so asyncio does not log it as never retrieved
+            future.exception()
+
+
+inference_gate = InferenceGate(MAX_CONCURRENT_INFERENCES, MAX_WAITING_INFERENCES, INFERENCE_WAIT_SECONDS)
@@ -0,0 +1,91 @@
+from typing import NamedTuple, Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from backend import models
+from backend.cache import TTLCache
+
+ROOM_CACHE_TTL_SECONDS = 30
+
+_MISSING = object()
+_NOT_A_MEMBER = ""
+
+
+class CachedRoom(NamedTuple):
+    """Read-only snapshot of the room columns used for access checks; names match RoomsModel."""
+    room_id: int
+    user_id: int
+    class_name: str
+    section: Optional[str]
+    description: Optional[str]
+    isGeofence: bool
+    isFaceAuth: bool
+    geofence_id: Optional[int]
+    is_archived: bool
+
+
+_ROOM_COLUMNS = [getattr(models.RoomsModel, field) for field in CachedRoom._fields]
+
+# room_id -> CachedRoom, (room_id, user_id) -> membership status.
+# Invalidation only reaches the current worker; other workers catch up within the TTL.
+room_cache = TTLCache(ttl_seconds=ROOM_CACHE_TTL_SECONDS)
+membership_cache = TTLCache(ttl_seconds=ROOM_CACHE_TTL_SECONDS)
+
+# (room_id, user_id) -> joined room, membership and geofence row, see utils.get_attendance_context
+ATTENDANCE_CONTEXT_TTL_SECONDS = 15
+attendance_context_cache = TTLCache(ttl_seconds=ATTENDANCE_CONTEXT_TTL_SECONDS)
+
+
+def get_room(db: Session, room_id: int) -> Optional[CachedRoom]:
+    """Return the cached room metadata, loading it on a miss. None if the room does not exist."""
+    room = room_cache.get(room_id)
+    if room is None:
+        row = db.execute(select(*_ROOM_COLUMNS).where(models.RoomsModel.room_id == room_id)).first()
+        if not row:
+            return None
+        room = CachedRoom(*row)
+        room_cache.set(room_id, room)
+    return room
+
+
+async def get_room_async(db: AsyncSession, room_id: int) -> Optional[CachedRoom]:
+    """Async variant of get_room."""
+    room = room_cache.get(room_id)
+    if room is None:
+        row = (await db.execute(select(*_ROOM_COLUMNS).where(models.RoomsModel.room_id == room_id))).first()
+        if not row:
+            return None
+        room = CachedRoom(*row)
+        room_cache.set(room_id, room)
+    return room
+
+
+def _membership_query(room_id: int, user_id: int):
+    return select(models.RoomUsersModel.status).where(
+        models.RoomUsersModel.room_id == room_id,
+        models.RoomUsersModel.user_id == user_id
+    ).limit(1)
+
+
+def get_membership_status(db: Session, room_id: int, user_id: int) -> Optional[str]:
+    """Return the user's join status in the room ("pending", "accepted", "rejected"), or None if not a member."""
+    status = membership_cache.get((room_id, user_id), _MISSING)
+    if status is _MISSING:
+        status = db.execute(_membership_query(room_id, user_id)).scalar()
+        status = getattr(status, "value", status) or _NOT_A_MEMBER
+        membership_cache.set((room_id, user_id), status)
+    return status or None
+
+
+def invalidate_room(room_id: int):
+    """Drop the cached metadata of a room after its settings, geofence or archive flag change."""
+    room_cache.invalidate(room_id)
+    attendance_context_cache.invalidate_where(lambda key: key[0] == room_id)
+
+
+def invalidate_membership(room_id: int, user_id: int):
+    """Drop the cached membership of a user after they join, are accepted, rejected or kicked."""
+    membership_cache.invalidate((room_id, user_id))
+    attendance_context_cache.invalidate((room_id, user_id))
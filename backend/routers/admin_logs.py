@@ -4,8 +4,10 @@ from backend import models, schemas
 from backend.database import get_db
 from backend.utils import get_current_user, hash_password
 import csv
-from fastapi.responses import StreamingResponse
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from io import StringIO
+from datetime import datetime, timedelta
+from backend.job_runs import job_run_metrics
 
 router = APIRouter()
 
@@ -65,4 +67,74 @@ def export_logs(
         )
     except Exception as e:
         print(f"Error exporting logs: {e}")
-        raise HTTPException(status_code=500, detail="An error occurred while exporting logs.")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail="An error occurred while exporting logs.")
+
+
+@router.get("/job_runs")
+def get_job_runs(
+    job_name: str = None,
+    status: str = None,
+    limit: int = 100,
+    token: str = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Retrieve the latest background job runs, newest first, optionally for one job or status
+    (SUCCESS, ERROR, MISSED, SKIPPED).
+    """
+    try:
+        query = db.query(models.JobRunModel)
+        if job_name:
+            query = query.filter(models.JobRunModel.job_name == job_name)
+        if status:
+            query = query.filter(models.JobRunModel.status == status.upper())
+        return query.order_by(models.JobRunModel.finished_at.desc()).limit(min(limit, 1000)).all()
+
+    except Exception as e:
+        print(f"Error retrieving job runs: {e}")
+        raise HTTPException(status_code=500, detail="An error occurred while retrieving job runs.")
+
+
+@router.get("/job_metrics")
+def get_job_metrics(
+    hours: int = 24,
+    format: str = "json",
+    token: str = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Per job counts of runs, errors, missed and skipped runs, duration, lag behind the fire time
+    and rows affected over the last hours. format=prometheus returns the Prometheus text format.
+    """
+    try:
+        metrics = job_run_metrics(db, datetime.now() - timedelta(hours=hours))
+        if format != "prometheus":
+            return {"hours": hours, "jobs": metrics}
+
+        series = [
+            ("runs", "attendance_job_runs"),
+            ("errors", "attendance_job_errors"),
+            ("missed", "attendance_job_missed_runs"),
+            ("skipped", "attendance_job_skipped_runs"),
+            ("avg_duration_ms", "attendance_job_avg_duration_ms"),
+            ("max_duration_ms", "attendance_job_max_duration_ms"),
+            ("avg_lag_ms", "attendance_job_avg_lag_ms"),
+            ("max_lag_ms", "attendance_job_max_lag_ms"),
+            ("rows_affected", "attendance_job_rows_affected"),
+        ]
+        lines = []
+        for field, metric in series:
+            lines.append(f"# TYPE {metric} gauge")
+            for job in metrics:
+                if job[field] is not None:
+                    name = job["job_name"]
+                    lines.append(f'{metric}{{job="{name}"}} {float(job[field])}')
+        lines.append("# TYPE attendance_job_last_finished_timestamp_seconds gauge")
+        for job in metrics:
+            name = job["job_name"]
+            lines.append(f'attendance_job_last_finished_timestamp_seconds{{job="{name}"}} {job["last_finished_at"].timestamp()}')
+        return PlainTextResponse("\n".join(lines) + "\n")
+
+    except Exception as e:
+        print(f"Error retrieving job metrics: {e}")
+        raise HTTPException(status_code=500, detail="An error occurred while retrieving job metrics.")
@@ -2,6 +2,7 @@ from fastapi import APIRouter, Body, Depends, HTTPException
 from sqlalchemy.orm import Session
 from backend import models, schemas
 from backend.database import get_db
+from backend.room_cache import invalidate_room
 from backend.utils import hash_password
 
 router = APIRouter()
@@ -168,6 +169,7 @@ def edit_room(
 
     db.commit()
     db.refresh(room)
+    invalidate_room(room_id)
 
     return {
         "room_id": room.room_id,
@@ -202,6 +204,7 @@ def edit_attendance_settings(
 
     db.commit()
     db.refresh(room)
+    invalidate_room(room_id)
 
     return {
         "room_id": room.room_id,
@@ -1,17 +1,28 @@
 import asyncio
-from datetime import datetime
+from datetime import date, datetime, timedelta
 import json
 import os
 from typing import List
 from uuid import uuid4
 from fastapi import APIRouter, Depends, File, Form, HTTPException, Header, Request, UploadFile
 from fastapi.security import OAuth2PasswordRequestForm
+from sqlalchemy import and_, case, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 import base64
 from backend import models, schemas
-from backend.database import get_db
+from backend.database import get_async_db, get_db
 from backend.routers import notification
-from backend.utils import check_pending_attendance, decode_base64_image, get_current_user, initialize_attendance_records, log_action, validate_face_authentication, validate_geofence
+from backend.attendance_analytics import flag_at_risk_students
+from backend.attendance_queue import attendance_queue
+from backend.idempotency import run_idempotent
+from backend.qr_tokens import is_qr_token, issue_qr_token, render_qr_png, require_static_room_qr, verify_qr_token
+from backend.rate_limit import enforce_rate_limits
+from backend.room_cache import get_membership_status, get_room, get_room_async
+from backend.routers.face_auth import arcface_model
+from backend.schedule_index import get_active_schedule, schedule_index
+from backend.scheduler import register_schedule_close, unregister_schedule_close
+from backend.utils import check_attendance_context, check_pending_attendance, decode_base64_image, get_attendance_context, get_current_user, log_action, materialize_attendance_roster, outside_geofence_error, record_geofence_attempt, upsert_attendance_records, validate_geofence, verify_face
 import numpy as np
 from backend.ArcFaceModel import ArcFaceModel
 from fastapi import Body
@@ -75,7 +86,7 @@ def create_attendance_schedule(
             raise HTTPException(status_code=400, detail="Date cannot be in the past")
 
         # Verify that the current user is the owner of the room
-        room = db.query(models.RoomsModel).filter(models.RoomsModel.room_id == room_id).first()
+        room = get_room(db, room_id)
         if not room:
             print("Room not found")
             raise HTTPException(status_code=404, detail="Room not found")
@@ -119,6 +130,11 @@ def create_attendance_schedule(
         db.add(new_schedule)
         db.commit()
         db.refresh(new_schedule)
+        schedule_index.upsert(new_schedule)
+        register_schedule_close(new_schedule)
+
+        # Create the pending records of the current roster once, instead of on every read
+        materialize_attendance_roster(db, [new_schedule.schedule_id])
 
         # Fetch all students in the room
         students = db.query(models.RoomUsersModel).filter(
@@ -164,24 +180,34 @@ def create_attendance_schedule(
         raise HTTPException(status_code=500, detail="An unexpected error occurred while creating the attendance schedule.")
 
 @router.get("/scan_qr")
-def scan_qr(
-    room_id: int,  # Room ID extracted from the QR code
+async def scan_qr(
     token: str,  # Token for authentication
-    db: Session = Depends(get_db),
+    room_id: int = None,  # Room ID of a static room QR code
+    qr: str = None,  # Signed payload of a rotating schedule QR code
+    db: AsyncSession = Depends(get_async_db),
     request: Request = None
 ):
     """
-    Fetch the room settings using the room_id extracted from the QR code.
-    Requires a valid token for authentication.
+    Fetch the room settings of a scanned QR code.
+    Accepts the signed payload of a rotating code, which is checked before any database access,
+    or the bare room_id of a static code when ALLOW_STATIC_ROOM_QR is set. Requires a valid token for authentication.
     """
     try:
+        schedule_id = None
+        if qr:
+            room_id, schedule_id = verify_qr_token(qr)
+        elif room_id is None:
+            raise HTTPException(status_code=400, detail="Invalid QR Code. Please try again.")
+        else:
+            require_static_room_qr()
+
         # Verify the user token and extract user details
         user = get_current_user(token)
         if not user:
             raise HTTPException(status_code=401, detail="Invalid or expired token")
 
         # Verify that the room exists
-        room = db.query(models.RoomsModel).filter(models.RoomsModel.room_id == room_id).first()
+        room = await get_room_async(db, room_id)
         if not room:
             raise HTTPException(status_code=404, detail="Room not found")
 
@@ -192,10 +218,13 @@ def scan_qr(
         level="INFO",
         details=f"User {user['user_id']} scanned QR code for room {room_id}",
         action_type="CREATE",
-        request=request,)
+        request=request,
+        commit=False,)
+        await db.commit()
         # Return the room settings
         return {
             "room_id": room.room_id,
+            "schedule_id": schedule_id,
             "class_name": room.class_name,
             "section": room.section,
             "description": room.description,
@@ -210,6 +239,74 @@ def scan_qr(
         print(f"Error fetching room settings: {e}")
         raise HTTPException(status_code=500, detail="An unexpected error occurred while fetching room settings.")
 
+@router.get("/{room_id}/live_qr")
+async def live_qr(
+    room_id: int,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Return the current rotating QR code of the room's active schedule for the teacher's display.
+    The display should fetch a new code at expires_at.
+    """
+    try:
+        room = await get_room_async(db, room_id)
+        if not room:
+            raise HTTPException(status_code=404, detail="Room not found")
+        if room.user_id != current_user["user_id"]:
+            raise HTTPException(status_code=403, detail="Only the room owner can display the attendance QR code")
+
+        schedule = await get_active_schedule(db, room_id)
+        if not schedule:
+            raise HTTPException(status_code=404, detail="No active attendance schedule for this room at this time")
+
+        payload, expires_at = issue_qr_token(room_id, schedule["schedule_id"])
+        return {
+            "room_id": room_id,
+            "schedule_id": schedule["schedule_id"],
+            "payload": payload,
+            "expires_at": expires_at,
+            "qr_code": render_qr_png(payload),
+        }
+    except HTTPException as http_exc:
+        raise http_exc
+    except Exception as e:
+        print(f"Error generating live QR code: {e}")
+        raise HTTPException(status_code=500, detail="An unexpected error occurred while generating the QR code.")
+
+@router.post("/preflight")
+async def attendance_preflight(
+    data: schemas.AttendancePreflight,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Check room membership, the active schedule and the geofence before the client captures
+    and uploads a face image. Raises the same errors take_attendance would for these checks.
+    """
+    try:
+        # Verify the user token and extract user details
+        user = get_current_user(data.token)
+        if not user:
+            raise HTTPException(status_code=401, detail="Invalid or expired token")
+
+        context = await get_attendance_context(db, data.room_id, user["user_id"])
+        geofence_valid, distance = check_attendance_context(context, data.geofence_location)
+        if not geofence_valid:
+            raise outside_geofence_error(distance)
+
+        return {
+            "room_id": data.room_id,
+            "schedule_id": context["schedule_id"],
+            "isGeofence": context["isGeofence"],
+            "isFaceAuth": context["isFaceAuth"],
+            "distance": distance,
+        }
+    except HTTPException as http_exc:
+        raise http_exc
+    except Exception as e:
+        print(f"Unexpected error in attendance_preflight: {e}")
+        raise HTTPException(status_code=500, detail="An unexpected error occurred. Please try again later.")
+
 from backend.utils import validate_face_auth_with_arcface
 from backend.ArcFaceModel import ArcFaceModel
 from concurrent.futures import ThreadPoolExecutor
@@ -218,96 +315,146 @@ from backend.ArcFaceModel import ArcFaceModel
 # Create a ThreadPoolExecutor instance
 executor = ThreadPoolExecutor()
 
+
 @router.post("/take_attendance")
 async def take_attendance(
     data: schemas.TakeAttendance,
-    db: Session = Depends(get_db),
-    request: Request = None
+    db: AsyncSession = Depends(get_async_db),
+    request: Request = None,
+    idempotency_key: str = Header(None)
 ):
     """
     Dynamically take attendance for a user in a specific room.
     If geofence or face authentication is enabled, validate the corresponding data.
+    Retries carrying the same Idempotency-Key header get the original response back.
+    The room_id is not signed, so this endpoint is only open when ALLOW_STATIC_ROOM_QR is set;
+    scans of rotating codes go through scan_and_attend.
     """
-    try:
-        # Extract room_id and token from the request
-        room_id = data.room_id
-        token = data.token
-
-        # Verify the user token and extract user details
-        user = get_current_user(token)
-        if not user:
-            raise HTTPException(status_code=401, detail="Invalid or expired token")
+    require_static_room_qr()
+    user = get_current_user(data.token)
+    return await run_idempotent(
+        user["user_id"], "take_attendance", idempotency_key,
+        lambda: _mark_attendance(db, request, user, data.room_id, data.geofence_location, data.base64_image)
+    )
 
-        # Verify that the room exists
-        room = db.query(models.RoomsModel).filter(models.RoomsModel.room_id == room_id).first()
-        if not room:
-            raise HTTPException(status_code=404, detail="Room not found")
-        
-        if room.is_archived:
-            raise HTTPException(status_code=400, detail="Attendance cannot be marked. The room is archived.")
 
-        # Verify that the user is part of the room
-        user_in_room = db.query(models.RoomUsersModel).filter(
-            models.RoomUsersModel.room_id == room_id,
-            models.RoomUsersModel.user_id == user["user_id"]
-        ).first()
-        if not user_in_room:
-            raise HTTPException(status_code=403, detail="You are not a member of this room")
+@router.post("/scan_and_attend")
+async def scan_and_attend(
+    data: schemas.ScanAndAttend,
+    db: AsyncSession = Depends(get_async_db),
+    request: Request = None,
+    idempotency_key: str = Header(None)
+):
+    """
+    Take attendance straight from a scanned QR code in a single request.
+    If the room requires a location or a face image that the request does not carry, responds
+    428 with the room's requirements so the client can collect them and send the scan again.
+    The 428 is only sent once the checks that need no face image have passed (membership,
+    active schedule and, when a location is sent, the geofence), so a student is never asked
+    for a selfie that would be rejected anyway.
+    Retries carrying the same Idempotency-Key header get the original response back.
+    """
+    if is_qr_token(data.qr):
+        room_id, schedule_id = verify_qr_token(data.qr)
+    else:
+        try:
+            room_id, schedule_id = int(data.qr), None
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid QR Code. Please try again.")
+        require_static_room_qr()
+
+    user = get_current_user(data.token)
+
+    # Run the cheap checks before telling the client what to collect
+    context = await get_attendance_context(db, room_id, user["user_id"])
+    missing_location = context and context["isGeofence"] and not data.geofence_location
+    missing_image = context and context["isFaceAuth"] and not data.base64_image
+    if missing_location or missing_image:
+        geofence_valid, distance = check_attendance_context(
+            {**context, "isGeofence": False} if missing_location else context, data.geofence_location
+        )
+        if not geofence_valid:
+            raise outside_geofence_error(distance)
+        if schedule_id is not None and context["schedule_id"] != schedule_id:
+            raise HTTPException(status_code=400, detail="This QR code is not for the current attendance schedule")
+        raise HTTPException(
+            status_code=428,
+            detail={
+                "message": "This room requires additional verification.",
+                "room_id": room_id,
+                "isGeofence": context["isGeofence"],
+                "isFaceAuth": context["isFaceAuth"],
+            }
+        )
 
-        # Ensure the user's status is "accepted"
-        if user_in_room.status != "accepted":
-            raise HTTPException(status_code=403, detail="You are not allowed to mark attendance in this room")
+    return await run_idempotent(
+        user["user_id"], "scan_and_attend", idempotency_key,
+        lambda: _mark_attendance(db, request, user, room_id, data.geofence_location, data.base64_image, schedule_id)
+    )
 
-        # Initialize validation flags
-        geofence_valid = True
-        face_auth_valid = True
 
-        # Validate geofence if enabled
-        if room.isGeofence:
-            if not data.geofence_location:
-                raise HTTPException(status_code=400, detail="Geofence location is required for this room")
+async def _mark_attendance(
+    db: AsyncSession,
+    request: Request,
+    user: dict,
+    room_id: int,
+    geofence_location: dict = None,
+    base64_image: str = None,
+    schedule_id: int = None
+):
+    """
+    Validate a student's scan for a room and queue their attendance record.
+    Shared by take_attendance and scan_and_attend. When schedule_id is given (from a signed
+    QR code) the room's active schedule must be that schedule.
+    """
+    try:
+        await enforce_rate_limits(user["user_id"], room_id)
 
-            # Retrieve geofence details using the geofence_id foreign key
-            geofence = db.query(models.GeofenceLocationModel).filter(
-                models.GeofenceLocationModel.geofence_id == room.geofence_id
-            ).first()
-            if not geofence:
-                raise HTTPException(status_code=404, detail="Geofence data not found for this room")
-
-            # Validate geofence location
-            user_latitude = data.geofence_location["latitude"]
-            user_longitude = data.geofence_location["longitude"]
-            geofence_valid, distance = validate_geofence(
-                user_longitude=user_longitude,
-                user_latitude=user_latitude,
-                geofence_longitude=geofence.longitude,
-                geofence_latitude=geofence.latitude,
-                radius=geofence.radius
-            )
+        # Room, membership, geofence and active schedule come from one joined lookup
+        context = await get_attendance_context(db, room_id, user["user_id"])
+        geofence_valid, distance = check_attendance_context(context, geofence_location)
+        if schedule_id is not None and context["schedule_id"] != schedule_id:
+            raise HTTPException(status_code=400, detail="This QR code is not for the current attendance schedule")
 
-            # Log the geofence validation result and distance
-            log_action(
+        if context["isGeofence"]:
+            # Record the geofence validation result in the audit table
+            record_geofence_attempt(
                 db=db,
                 user_id=user['user_id'],
-                action="Geofence Validation",
-                level="INFO",
-                details=(f"User {user['user_id']} attempted geofence validation. "
-                         f"Result: {geofence_valid}, Distance: {distance:.2f} meters"),
-                action_type="GEOFENCE",
-                request=request,
+                room_id=room_id,
+                geofence_id=context["geofence_id"],
+                distance=distance,
+                is_within=geofence_valid,
+                accuracy=geofence_location.get("accuracy"),
+                commit=False,
             )
 
             if not geofence_valid:
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"You are outside the geofence area. You are {distance:.2f} meters away from the geofence center."
-                )
+                raise outside_geofence_error(distance)
+
+        schedule_id = context["schedule_id"]
+        already_marked = HTTPException(status_code=400, detail="You have already marked attendance for the current schedule")
+
+        # A scan of this student may still be waiting in the write queue
+        if attendance_queue.pending(room_id, user["user_id"], schedule_id):
+            raise already_marked
+
+        # Check if the user already has an attendance record for the schedule
+        result = await db.execute(select(models.AttendanceRecordModel.status).where(
+            models.AttendanceRecordModel.room_id == room_id,
+            models.AttendanceRecordModel.user_id == user["user_id"],
+            models.AttendanceRecordModel.schedule_id == schedule_id
+        ).limit(1))
+        existing_status = result.scalar()
+        if existing_status and existing_status != "pending":
+            raise already_marked
 
-        # Validate face authentication if enabled
+        # Face inference only runs for scans that passed every cheap check
         confidence = None
-        if room.isFaceAuth:
-            arcface_model = ArcFaceModel()
-            confidence = await validate_face_authentication(data, user, db, arcface_model, threshold=0.80)
+        if context["isFaceAuth"]:
+            if not base64_image:
+                raise HTTPException(status_code=400, detail="Face authentication data is required.")
+            confidence = await verify_face(base64_image, user["user_id"], arcface_model, threshold=0.80)
 
             # Log the face authentication result
             log_action(
@@ -318,140 +465,47 @@ async def take_attendance(
                 details=f"User {user['user_id']} attempted face authentication with result: {confidence}",
                 action_type="FACEAUTH",
                 request=request,
+                commit=False,
             )
 
-            if confidence < 0.80:
-                face_auth_valid = False
-
-        # Ensure both validations pass if both are enabled
-        if room.isGeofence and room.isFaceAuth:
-            if not (geofence_valid and face_auth_valid):
-                raise HTTPException(
-                    status_code=400,
-                    detail="Attendance cannot be marked. Both geofence and face authentication must be valid."
-                )
-        elif room.isGeofence and not geofence_valid:
-            raise HTTPException(
-                status_code=400,
-                detail="Attendance cannot be marked. Geofence validation failed."
-            )
-        elif room.isFaceAuth and not face_auth_valid:
-            raise HTTPException(
-                status_code=400,
-                detail="Attendance cannot be marked. Face authentication failed."
-            )
-
-        # Check if there is an active attendance schedule for the room
-        current_time = datetime.now().time()
-        current_date = datetime.now().date()
-        active_schedule = db.query(models.AttendanceScheduleModel).filter(
-            models.AttendanceScheduleModel.room_id == room_id,
-            models.AttendanceScheduleModel.date == current_date,
-            models.AttendanceScheduleModel.start_time <= current_time,
-            models.AttendanceScheduleModel.end_time >= current_time
-        ).first()
-        if not active_schedule:
-            raise HTTPException(status_code=400, detail="No active attendance schedule for this room at this time")
-
-        # Check if the user has a pending attendance record
-        pending_attendance = db.query(models.AttendanceRecordModel).filter(
-            models.AttendanceRecordModel.room_id == room_id,
-            models.AttendanceRecordModel.user_id == user["user_id"],
-            models.AttendanceRecordModel.schedule_id == active_schedule.schedule_id,
-            models.AttendanceRecordModel.status == "pending"
-        ).first()
-
         # Determine if the student is late or present
-        schedule_start = datetime.combine(active_schedule.date, active_schedule.start_time)
+        schedule_start = datetime.combine(context["schedule_date"], context["schedule_start_time"])
         current_datetime = datetime.now()
         time_difference = (current_datetime - schedule_start).total_seconds() / 60  # Difference in minutes
+        status = "late" if time_difference > 15 else "present"
 
-        status = None
-        if pending_attendance:
-            # Update the pending record
-            if time_difference > 15:
-                pending_attendance.status = "late"
-                status = "late"
-            else:
-                pending_attendance.status = "present"
-                status = "present"
-            pending_attendance.taken_at = current_datetime
-            db.commit()
-            db.refresh(pending_attendance)
-        else:
-            # Check if the user has already marked attendance
-            existing_attendance = db.query(models.AttendanceRecordModel).filter(
-                models.AttendanceRecordModel.room_id == room_id,
-                models.AttendanceRecordModel.user_id == user["user_id"],
-                models.AttendanceRecordModel.schedule_id == active_schedule.schedule_id
-            ).first()
-            if existing_attendance:
-                raise HTTPException(status_code=400, detail="You have already marked attendance for the current schedule")
+        # The record, its log and the teacher notification are written by the queue's flusher
+        queued = attendance_queue.submit({
+            "room_id": room_id,
+            "user_id": user["user_id"],
+            "schedule_id": schedule_id,
+            "status": status,
+            "taken_at": current_datetime,
+            "owner_id": context["owner_id"],
+            "schedule_name": context["schedule_name"],
+            "class_name": context["class_name"],
+            "ip_address": request.headers.get("X-Forwarded-For", request.client.host) if request else None,
+            "user_agent": request.headers.get("User-Agent", "Unknown") if request else None,
+        })
+        if not queued:
+            raise already_marked
 
-            # Create a new attendance record
-            status = "late" if time_difference > 15 else "present"
-            new_attendance = models.AttendanceRecordModel(
-                room_id=room_id,
-                user_id=user["user_id"],
-                schedule_id=active_schedule.schedule_id,
-                status=status,
-                taken_at=current_datetime,
-                qr_id=None
-            )
-            db.add(new_attendance)
-            db.commit()
-            db.refresh(new_attendance)
-
-        # Notify the teacher
-        notification = models.Notification(
-            user_id=room.user_id,
-            title="Student Attendance Marked",
-            message=f"Student {user['user_id']} has marked {status} attendance for schedule '{active_schedule.schedule_name}'.",
-            created_at=datetime.utcnow()
-        )
-        db.add(notification)
-        db.commit()
-
-        log_action(
-            db=db,
-            user_id=user["user_id"],
-            action="Take Attendance",
-            level="INFO",
-            details=f"User {user['user_id']} marked attendance for schedule {active_schedule.schedule_id}",
-            action_type="CREATE",
-            request=request,
-        )
-        # ...after determining status and before sending notification...
-
-        # Fetch student details from the database
-        student = db.query(models.UserModel).filter(models.UserModel.user_id == user["user_id"]).first()
-
-        # Notify the teacher
-        notification = models.Notification(
-            user_id=room.user_id,  # Teacher's user_id (owner of the room)
-            title="Student Attendance Marked",
-            message=(
-                f"Student {student.first_name} {student.last_name} (ID: {student.user_id}) "
-                f"has marked '{status}' attendance for schedule '{active_schedule.schedule_name}' "
-                f"in room '{room.class_name}'."
-            ),
-            is_read=False,
-            created_at=datetime.utcnow(),
-            room_id=room.room_id
-        )
-        db.add(notification)
-        db.commit()
+        # Commit the geofence and face authentication audit rows
+        await db.commit()
 
         return {
             "message": "Attendance marked successfully",
-            "attendance_id": pending_attendance.attendance_id if pending_attendance else new_attendance.attendance_id,
+            "attendance_id": None,  # Assigned when the queued record is written
             "status": status,
             "confidence": confidence
         }
 
     except HTTPException as http_exc:
+        # Keep the geofence and face authentication audit rows of rejected attempts
+        await db.commit()
         raise http_exc
     except Exception as e:
+        await db.rollback()
         print(f"Unexpected error in take_attendance: {e}")
         raise HTTPException(status_code=500, detail="An unexpected error occurred. Please try again later.")
     
@@ -480,9 +534,7 @@ def update_attendance_schedule(
             raise HTTPException(status_code=404, detail="Schedule not found")
 
         # Verify that the current user is authorized to update the schedule
-        room = db.query(models.RoomsModel).filter(
-            models.RoomsModel.room_id == existing_schedule.room_id
-        ).first()
+        room = get_room(db, existing_schedule.room_id)
         if not room or room.user_id != current_user["user_id"]:
             print("User not authorized to update this schedule")
             raise HTTPException(status_code=403, detail="You are not authorized to update this schedule")
@@ -525,6 +577,10 @@ def update_attendance_schedule(
             print(f"Updating end_time to: {schedule.end_time}")
             existing_schedule.end_time = schedule.end_time
 
+        # A finalized schedule moved to end in the future is finalized again when it ends
+        if existing_schedule.finalized_at and datetime.combine(existing_schedule.date, existing_schedule.end_time) > datetime.now():
+            existing_schedule.finalized_at = None
+
         user = current_user["user_id"]
         log_action(
         db=db,
@@ -540,6 +596,8 @@ def update_attendance_schedule(
         db.commit()
         print("Database commit successful")
         db.refresh(existing_schedule)
+        schedule_index.upsert(existing_schedule)
+        register_schedule_close(existing_schedule)
 
         return {"message": "Attendance schedule updated successfully", "schedule": existing_schedule}
     except HTTPException as http_exc:
@@ -551,20 +609,69 @@ def update_attendance_schedule(
         print(f"Unexpected error in update_attendance_schedule: {e}")
         raise HTTPException(status_code=500, detail="An unexpected error occurred. Please try again later.")
 
+@router.put("/{schedule_id}/archive_attendance_schedule")
+def archive_attendance_schedule(
+    schedule_id: int,
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(get_current_user),
+    request: Request = None
+):
+    """
+    Archive an attendance schedule. Archived schedules no longer accept attendance.
+    """
+    try:
+        existing_schedule = db.query(models.AttendanceScheduleModel).filter(
+            models.AttendanceScheduleModel.schedule_id == schedule_id
+        ).first()
+        if not existing_schedule:
+            raise HTTPException(status_code=404, detail="Schedule not found")
+
+        # Verify that the current user owns the room of the schedule
+        room = get_room(db, existing_schedule.room_id)
+        if not room or room.user_id != current_user["user_id"]:
+            raise HTTPException(status_code=403, detail="You are not authorized to archive this schedule")
+
+        if existing_schedule.is_archived:
+            raise HTTPException(status_code=400, detail="Schedule is already archived")
+
+        existing_schedule.is_archived = True
+        log_action(
+        db=db,
+        user_id=current_user["user_id"],
+        action="Archive attendance schedule",
+        level="INFO",
+        details=f"User {current_user['user_id']} archived schedule {schedule_id}",
+        action_type="UPDATE",
+        request=request,)
+        db.commit()
+        schedule_index.remove(schedule_id)
+        unregister_schedule_close(schedule_id)
+
+        return {"message": "Attendance schedule archived successfully"}
+    except HTTPException as http_exc:
+        raise http_exc
+    except Exception as e:
+        print(f"Unexpected error in archive_attendance_schedule: {e}")
+        raise HTTPException(status_code=500, detail="An unexpected error occurred. Please try again later.")
+
 
 @router.get("/{roomId}/{scheduleId}/attendance_records")
 def attendance_records(
     roomId: int,
     scheduleId: int,
+    status: schemas.AttendanceStatus = None,
+    after: int = None,
+    limit: int = None,
     db: Session = Depends(get_db),
 ):
     """
     Fetch all students enrolled in the room associated with the given roomId
-    and their attendance records for the given scheduleId.
+    and their attendance records for the given scheduleId. Read-only: the records are
+    created when the schedule is created and completed when it closes.
+    Optionally filtered by status, and paged by student id: pass limit, then the returned
+    next_cursor as after to get the following page.
     """
     try:
-        initialize_attendance_records(scheduleId, roomId, db)
-
         # Fetch the schedule to ensure it belongs to the specified room
         schedule = db.query(models.AttendanceScheduleModel).filter(
             models.AttendanceScheduleModel.schedule_id == scheduleId,
@@ -574,59 +681,70 @@ def attendance_records(
         if not schedule:
             raise HTTPException(status_code=404, detail="Schedule not found for the specified room")
 
-        # Fetch all students with an "accepted" join status in the room
-        enrolled_students = db.query(models.UserModel).join(
-            models.RoomUsersModel,
-            models.UserModel.user_id == models.RoomUsersModel.user_id
-        ).filter(
+        # Students without a record are pending until the schedule ends and absent afterwards
+        schedule_end = datetime.combine(schedule.date, schedule.end_time)
+        default_status = "absent" if datetime.now() > schedule_end else "pending"
+        record = models.AttendanceRecordModel
+        attendance_status = func.coalesce(record.status, default_status)
+
+        # Accepted members joined to their record for the schedule, in student id order
+        query = select(
+            models.UserModel.user_id,
+            models.UserModel.first_name,
+            models.UserModel.last_name,
+            attendance_status.label("attendance_status"),
+            record.status.label("record_status"),
+            record.taken_at,
+        ).select_from(models.RoomUsersModel).join(
+            models.UserModel, models.UserModel.user_id == models.RoomUsersModel.user_id
+        ).outerjoin(
+            record,
+            # Matches unique_attendance_record (room_id, user_id, schedule_id), one index probe per student
+            and_(
+                record.room_id == roomId,
+                record.user_id == models.RoomUsersModel.user_id,
+                record.schedule_id == scheduleId
+            )
+        ).where(
             models.RoomUsersModel.room_id == roomId,
             models.RoomUsersModel.status == "accepted"  # Only include students with accepted status
-        ).all()
-
-        # Fetch attendance records for the given scheduleId
-        attendance_records = db.query(models.AttendanceRecordModel).filter(
-            models.AttendanceRecordModel.schedule_id == scheduleId
-        ).all()
-
-        # Get the current time
-        current_time = datetime.now()
-
-        # Map attendance records to students
-        student_attendance = []
-        for student in enrolled_students:
-            # Use user_id to find the corresponding attendance record
-            record = next(
-                (attendance for attendance in attendance_records if attendance.user_id == student.user_id),
-                None
-            )
-
-            # Determine attendance status
-            if record:
-                # If a record exists, use its status
-                status = record.status
-                taken_at = record.taken_at
-            else:
-                # If no record exists, determine status based on schedule timing
-                schedule_start = datetime.combine(schedule.date, schedule.start_time)
-                schedule_end = datetime.combine(schedule.date, schedule.end_time)
-
-                if schedule_start <= current_time <= schedule_end:
-                    # Schedule is still open, mark as pending
-                    status = "pending"
-                    taken_at = None
-                else:
-                    # Schedule has ended, mark as absent
-                    status = "absent"
-                    taken_at = None
-
-            student_attendance.append({
-                "student_id": student.user_id,
-                "student_name": f"{student.first_name} {student.last_name}",
-                "attendance_status": status,
-                "taken_at": taken_at,
-            })
+        ).order_by(models.RoomUsersModel.user_id)
+
+        if status is not None:
+            query = query.where(attendance_status == status.value)
+        if after is not None:
+            query = query.where(models.RoomUsersModel.user_id > after)
+        if limit is not None:
+            limit = min(max(limit, 1), 1000)
+            # One extra row tells whether there is a next page
+            query = query.limit(limit + 1)
+
+        rows = db.execute(query).all()
+        next_cursor = None
+        if limit is not None and len(rows) > limit:
+            rows = rows[:-1]
+            next_cursor = rows[-1].user_id
+
+        student_attendance = [
+            {
+                "student_id": row.user_id,
+                "student_name": f"{row.first_name} {row.last_name}",
+                "attendance_status": getattr(row.attendance_status, "value", row.attendance_status),
+                # Pending records are placeholders, their taken_at is only when they were created
+                "taken_at": None if row.record_status in (None, "pending") else row.taken_at,
+            }
+            for row in rows
+        ]
 
-        return {"schedule_id": scheduleId, "room_id": roomId, "students": student_attendance}
+        return {
+            "schedule_id": scheduleId,
+            "room_id": roomId,
+            "schedule_date": schedule.date,
+            "schedule_start_time": schedule.start_time,
+            "schedule_end_time": schedule.end_time,
+            "students": student_attendance,
+            "next_cursor": next_cursor,
+        }
 
     except HTTPException as http_exc:
         raise http_exc
@@ -654,16 +772,12 @@ def get_student_attendance_status(
         user_id = user["user_id"]
 
         # Verify that the room exists
-        room = db.query(models.RoomsModel).filter(models.RoomsModel.room_id == room_id).first()
+        room = get_room(db, room_id)
         if not room:
             raise HTTPException(status_code=404, detail="Room not found")
 
         # Verify that the user is part of the room
-        user_in_room = db.query(models.RoomUsersModel).filter(
-            models.RoomUsersModel.room_id == room_id,
-            models.RoomUsersModel.user_id == user_id
-        ).first()
-        if not user_in_room:
+        if not get_membership_status(db, room_id, user_id):
             raise HTTPException(status_code=403, detail="You are not a member of this room")
 
         # Fetch all attendance schedules for the room
@@ -683,6 +797,9 @@ def get_student_attendance_status(
         # Map attendance records by schedule_id for quick lookup
         attendance_status_map = {record.schedule_id: record for record in attendance_records}
 
+        # Scans still waiting in the write queue take precedence over pending records
+        queued_scans = attendance_queue.pending(room_id, user_id)
+
         # Get the current time
         current_time = datetime.now()
 
@@ -692,11 +809,16 @@ def get_student_attendance_status(
             schedule_start = datetime.combine(schedule.date, schedule.start_time)
             schedule_end = datetime.combine(schedule.date, schedule.end_time)
 
-            if schedule.schedule_id in attendance_status_map:
+            if schedule.schedule_id in queued_scans:
+                queued = queued_scans[schedule.schedule_id]
+                status = queued["status"]
+                taken_at = queued["taken_at"].strftime("%Y-%m-%d %H:%M:%S")
+            elif schedule.schedule_id in attendance_status_map:
                 # If a record exists, use its status
                 record = attendance_status_map[schedule.schedule_id]
                 status = record.status
-                taken_at = record.taken_at.strftime("%Y-%m-%d %H:%M:%S") if record.taken_at else None
+                # Pending records are placeholders, their taken_at is only when they were created
+                taken_at = record.taken_at.strftime("%Y-%m-%d %H:%M:%S") if record.taken_at and status != "pending" else None
             else:
                 # If no record exists, determine status based on schedule timing
                 if current_time < schedule_start:
@@ -732,63 +854,315 @@ def get_student_attendance_status(
         raise HTTPException(status_code=500, detail="An error occurred while fetching attendance status.")
 
 
+ATTENDANCE_COUNT_STATUSES = ("present", "late", "absent", "excused", "pending")
+
+
+def _status_counts(status_column, amount=1):
+    """One conditional SUM per attendance status, labelled with the status name."""
+    return [
+        func.coalesce(func.sum(case((status_column == status, amount), else_=0)), 0).label(status)
+        for status in ATTENDANCE_COUNT_STATUSES
+    ]
+
+
+def _schedules_in_range(room_id: int, date_from: date = None, date_to: date = None):
+    schedule = models.AttendanceScheduleModel
+    query = select(schedule.schedule_id).where(schedule.room_id == room_id)
+    if date_from is not None:
+        query = query.where(schedule.date >= date_from)
+    if date_to is not None:
+        query = query.where(schedule.date <= date_to)
+    return query
+
+
 # Get overall attendance percentage for a class
 @router.get("/{room_id}/attendance_summary")
-def attendance_summary(room_id: int, db: Session = Depends(get_db)):
-    total_sessions = db.query(models.AttendanceScheduleModel).filter(
-        models.AttendanceScheduleModel.room_id == room_id
-    ).count()
-    total_students = db.query(models.RoomUsersModel).filter(
+def attendance_summary(room_id: int, date_from: date = None, date_to: date = None, db: Session = Depends(get_db)):
+    """
+    Overall attendance of a room, optionally for the schedules between date_from and date_to:
+    the share of present records out of sessions times enrolled students, and the record
+    count of each status. One aggregate query; without a date range the counts come from
+    the room's attendance counters instead of the records.
+    """
+    record = models.AttendanceRecordModel
+    counter = models.RoomAttendanceCounterModel
+    schedules = _schedules_in_range(room_id, date_from, date_to)
+    total_sessions = select(func.count()).select_from(schedules.subquery()).scalar_subquery()
+    total_students = select(func.count()).select_from(models.RoomUsersModel).where(
         models.RoomUsersModel.room_id == room_id,
         models.RoomUsersModel.status == "accepted"
-    ).count()
-    total_attendance = db.query(models.AttendanceRecordModel).filter(
-        models.AttendanceRecordModel.room_id == room_id,
-        models.AttendanceRecordModel.status == "present"
-    ).count()
-    overall_percentage = (total_attendance / (total_sessions * total_students)) * 100 if total_sessions and total_students else 0
-    return {"overall_percentage": overall_percentage}
+    ).scalar_subquery()
+
+    if date_from is None and date_to is None:
+        query = select(
+            total_sessions.label("total_sessions"),
+            total_students.label("total_students"),
+            *_status_counts(counter.status, counter.count),
+        ).select_from(counter).where(counter.room_id == room_id)
+    else:
+        query = select(
+            total_sessions.label("total_sessions"),
+            total_students.label("total_students"),
+            *_status_counts(record.status),
+        ).select_from(record).where(
+            record.room_id == room_id,
+            record.schedule_id.in_(schedules)
+        )
+    row = db.execute(query).one()
+
+    counts = {status: int(row._mapping[status]) for status in ATTENDANCE_COUNT_STATUSES}
+    possible = row.total_sessions * row.total_students
+    overall_percentage = (counts["present"] / possible) * 100 if possible else 0
+    return {
+        "overall_percentage": overall_percentage,
+        "total_sessions": row.total_sessions,
+        "total_students": row.total_students,
+        **counts,
+    }
 
 # Get individual student attendance rates
 @router.get("/{room_id}/student_attendance_rates")
-def student_attendance_rates(room_id: int, db: Session = Depends(get_db)):
-    students = db.query(models.RoomUsersModel).filter(
-        models.RoomUsersModel.room_id == room_id,
-        models.RoomUsersModel.status == "accepted"
+def student_attendance_rates(room_id: int, date_from: date = None, date_to: date = None, db: Session = Depends(get_db)):
+    """
+    Attendance rate and per status record counts of every enrolled student, optionally for the
+    schedules between date_from and date_to. One query: the per student counts are LEFT JOINed
+    to the roster. They come from the student attendance counters, or from the records
+    grouped per student when a date range is given.
+    """
+    record = models.AttendanceRecordModel
+    counter = models.StudentAttendanceCounterModel
+    schedules = _schedules_in_range(room_id, date_from, date_to)
+    if date_from is None and date_to is None:
+        per_student = select(counter.user_id, *_status_counts(counter.status, counter.count)).where(
+            counter.room_id == room_id
+        ).group_by(counter.user_id).subquery()
+    else:
+        per_student = select(record.user_id, *_status_counts(record.status)).where(
+            record.room_id == room_id,
+            record.schedule_id.in_(schedules)
+        ).group_by(record.user_id).subquery()
+
+    rows = db.execute(
+        select(
+            models.UserModel.user_id,
+            models.UserModel.first_name,
+            models.UserModel.last_name,
+            select(func.count()).select_from(schedules.subquery()).scalar_subquery().label("sessions"),
+            *[func.coalesce(per_student.c[status], 0).label(status) for status in ATTENDANCE_COUNT_STATUSES],
+        ).select_from(models.RoomUsersModel).join(
+            models.UserModel, models.UserModel.user_id == models.RoomUsersModel.user_id
+        ).outerjoin(
+            per_student, per_student.c.user_id == models.RoomUsersModel.user_id
+        ).where(
+            models.RoomUsersModel.room_id == room_id,
+            models.RoomUsersModel.status == "accepted"
+        ).order_by(models.RoomUsersModel.user_id)
     ).all()
-    sessions = db.query(models.AttendanceScheduleModel).filter(
-        models.AttendanceScheduleModel.room_id == room_id
-    ).count()
+
+    sessions = rows[0].sessions if rows else 0
     rates = []
-    for student in students:
-        present_count = db.query(models.AttendanceRecordModel).filter(
-            models.AttendanceRecordModel.room_id == room_id,
-            models.AttendanceRecordModel.user_id == student.user_id,
-            models.AttendanceRecordModel.status == "present"
-        ).count()
-        rate = (present_count / sessions) * 100 if sessions else 0
+    for row in rows:
+        counts = {status: int(row._mapping[status]) for status in ATTENDANCE_COUNT_STATUSES}
         rates.append({
-            "user_id": student.user_id,
-            "first_name": student.user.first_name,
-            "last_name": student.user.last_name,
-            "attendance_rate": rate
+            "user_id": row.user_id,
+            "first_name": row.first_name,
+            "last_name": row.last_name,
+            "attendance_rate": (counts["present"] / sessions) * 100 if sessions else 0,
+            **counts,
         })
-    return {"rates": rates}
+    return {"sessions": sessions, "rates": rates}
 
 # Get attendance trend over time
 @router.get("/{room_id}/attendance_trend")
-def attendance_trend(room_id: int, db: Session = Depends(get_db)):
-    from sqlalchemy import func
-    trend = db.query(
-        func.date(models.AttendanceRecordModel.taken_at),
-        func.count(models.AttendanceRecordModel.user_id)
-    ).filter(
-        models.AttendanceRecordModel.room_id == room_id,
-        models.AttendanceRecordModel.status == "present"
-    ).group_by(func.date(models.AttendanceRecordModel.taken_at)).all()
-    return [{"date": str(t[0]), "present_count": t[1]} for t in trend]
+def attendance_trend(
+    room_id: int,
+    date_from: date = None,
+    date_to: date = None,
+    granularity: str = "day",
+    db: Session = Depends(get_db)
+):
+    """
+    Attendance counts of a room per day, week (starting Monday) or month of the schedule date,
+    read from the daily rollups. Today's counts may lag by a few minutes.
+    """
+    if granularity not in ("day", "week", "month"):
+        raise HTTPException(status_code=400, detail="granularity must be one of day, week or month")
+
+    rollup = models.AttendanceDailyRollupModel
+    query = db.query(rollup).filter(rollup.room_id == room_id)
+    if date_from is not None:
+        query = query.filter(rollup.day >= date_from)
+    if date_to is not None:
+        query = query.filter(rollup.day <= date_to)
+
+    buckets = {}
+    for row in query.order_by(rollup.day):
+        if granularity == "week":
+            bucket = row.day - timedelta(days=row.day.weekday())
+        elif granularity == "month":
+            bucket = row.day.replace(day=1)
+        else:
+            bucket = row.day
+        totals = buckets.setdefault(bucket, dict.fromkeys(ATTENDANCE_COUNT_STATUSES, 0))
+        for status in ATTENDANCE_COUNT_STATUSES:
+            totals[status] += getattr(row, status)
+
+    return [
+        {"date": str(bucket), "present_count": totals["present"], **totals}
+        for bucket, totals in buckets.items()
+    ]
+
+
+# Attendance overview of every room a teacher owns
+@router.get("/teacher_dashboard")
+def teacher_dashboard(
+    days: int = 14,
+    include_archived: bool = False,
+    current_user: dict = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    attendance_summary and the daily attendance_trend of the last `days` days for all rooms of
+    the signed in teacher. Three queries whatever the number of rooms: rooms with their session
+    and student totals, the room counters, and the daily rollups. counts_as_of is when the live
+    counters were read, trend_updated_at when the room's rollups were last refreshed.
+    """
+    room = models.RoomsModel
+    schedule = models.AttendanceScheduleModel
+    room_user = models.RoomUsersModel
+    counter = models.RoomAttendanceCounterModel
+    rollup = models.AttendanceDailyRollupModel
+
+    days = max(1, min(days, 366))
+    owned = select(room.room_id).where(room.user_id == current_user["user_id"])
+    if not include_archived:
+        owned = owned.where(room.is_archived.isnot(True))
+
+    sessions = select(schedule.room_id, func.count().label("total_sessions")).where(
+        schedule.room_id.in_(owned)
+    ).group_by(schedule.room_id).subquery()
+    students = select(room_user.room_id, func.count().label("total_students")).where(
+        room_user.room_id.in_(owned),
+        room_user.status == "accepted"
+    ).group_by(room_user.room_id).subquery()
+
+    rooms = db.execute(
+        select(
+            room.room_id,
+            room.class_name,
+            room.section,
+            room.is_archived,
+            func.coalesce(sessions.c.total_sessions, 0).label("total_sessions"),
+            func.coalesce(students.c.total_students, 0).label("total_students"),
+        ).outerjoin(
+            sessions, sessions.c.room_id == room.room_id
+        ).outerjoin(
+            students, students.c.room_id == room.room_id
+        ).where(room.room_id.in_(owned)).order_by(room.room_id)
+    ).all()
+    counts_as_of = datetime.now()
+
+    room_counts = {
+        row.room_id: {status: int(row._mapping[status]) for status in ATTENDANCE_COUNT_STATUSES}
+        for row in db.execute(
+            select(counter.room_id, *_status_counts(counter.status, counter.count)).where(
+                counter.room_id.in_(owned)
+            ).group_by(counter.room_id)
+        )
+    }
+
+    trends = {}
+    trend_updated_at = {}
+    for row in db.query(rollup).filter(
+        rollup.room_id.in_(owned),
+        rollup.day > date.today() - timedelta(days=days)
+    ).order_by(rollup.room_id, rollup.day):
+        counts = {status: getattr(row, status) for status in ATTENDANCE_COUNT_STATUSES}
+        trends.setdefault(row.room_id, []).append(
+            {"date": str(row.day), "present_count": counts["present"], **counts}
+        )
+        if row.room_id not in trend_updated_at or row.updated_at > trend_updated_at[row.room_id]:
+            trend_updated_at[row.room_id] = row.updated_at
+
+    dashboard = []
+    for row in rooms:
+        counts = room_counts.get(row.room_id, dict.fromkeys(ATTENDANCE_COUNT_STATUSES, 0))
+        possible = row.total_sessions * row.total_students
+        dashboard.append({
+            "room_id": row.room_id,
+            "class_name": row.class_name,
+            "section": row.section,
+            "is_archived": bool(row.is_archived),
+            "summary": {
+                "overall_percentage": (counts["present"] / possible) * 100 if possible else 0,
+                "total_sessions": row.total_sessions,
+                "total_students": row.total_students,
+                **counts,
+            },
+            "trend": trends.get(row.room_id, []),
+            "counts_as_of": counts_as_of,
+            "trend_updated_at": trend_updated_at.get(row.room_id),
+        })
+    return {"generated_at": counts_as_of, "rooms": dashboard}
 
 
+def _require_room_owner(db: Session, room_id: int, current_user: dict):
+    room = get_room(db, room_id)
+    if not room:
+        raise HTTPException(status_code=404, detail="Room not found")
+    if room.user_id != current_user["user_id"]:
+        raise HTTPException(status_code=403, detail="Only the room owner can access at-risk students")
+
+
+# Students flagged for chronic absence
+@router.get("/{room_id}/at_risk_students")
+def at_risk_students(
+    room_id: int,
+    current_user: dict = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Students of a room flagged by the nightly at-risk detection, with their absence rates and
+    streaks. Only the room owner can see them.
+    """
+    _require_room_owner(db, room_id, current_user)
+
+    flagged = models.AtRiskStudentModel
+    rows = db.query(flagged, models.UserModel.first_name, models.UserModel.last_name).join(
+        models.UserModel, models.UserModel.user_id == flagged.user_id
+    ).filter(flagged.room_id == room_id).order_by(
+        flagged.current_streak.desc(), flagged.absence_rate.desc()
+    ).all()
+
+    return [
+        {
+            "user_id": student.user_id,
+            "first_name": first_name,
+            "last_name": last_name,
+            "sessions": student.sessions,
+            "absence_rate": student.absence_rate * 100,
+            "recent_absence_rate": student.recent_absence_rate * 100,
+            "current_streak": student.current_streak,
+            "longest_streak": student.longest_streak,
+            "reasons": student.reasons,
+            "flagged_at": student.flagged_at,
+        }
+        for student, first_name, last_name in rows
+    ]
+
+
+@router.post("/{room_id}/at_risk_students/refresh")
+def refresh_at_risk_students(
+    room_id: int,
+    current_user: dict = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Recompute a room's at-risk flags now instead of waiting for the nightly job. Room owner only."""
+    _require_room_owner(db, room_id, current_user)
+
+    flagged = flag_at_risk_students(db, room_id)
+    db.commit()
+    return {"message": "At-risk students refreshed", "flagged": flagged}
 
 
 EXCUSE_UPLOAD_DIR = "excuse_attachments"
@@ -805,14 +1179,32 @@ async def mark_excused(
     attachment: UploadFile = File(None),
     db: Session = Depends(get_db),
     current_user: dict = Depends(get_current_user),
-    request: Request = None
+    request: Request = None,
+    idempotency_key: str = Header(None)
 ):
     """
     Mark a student as excused for a specific attendance schedule, with optional attachment.
     Only the teacher (room owner) can perform this action.
+    Retries carrying the same Idempotency-Key header get the original response back.
     """
+    return await run_idempotent(
+        current_user["user_id"], "mark_excused", idempotency_key,
+        lambda: _mark_excused(room_id, schedule_id, user_id, reason, attachment, db, current_user, request)
+    )
+
+
+async def _mark_excused(
+    room_id: int,
+    schedule_id: int,
+    user_id: int,
+    reason: str,
+    attachment: UploadFile,
+    db: Session,
+    current_user: dict,
+    request: Request
+):
     # Verify room exists and current user is the owner
-    room = db.query(models.RoomsModel).filter(models.RoomsModel.room_id == room_id).first()
+    room = get_room(db, room_id)
     if not room:
         raise HTTPException(status_code=404, detail="Room not found")
     if room.user_id != current_user["user_id"]:
@@ -830,12 +1222,7 @@ async def mark_excused(
     student = db.query(models.UserModel).filter(models.UserModel.user_id == user_id).first()
     if not student:
         raise HTTPException(status_code=404, detail="Student not found")
-    room_user = db.query(models.RoomUsersModel).filter(
-        models.RoomUsersModel.room_id == room_id,
-        models.RoomUsersModel.user_id == user_id,
-        models.RoomUsersModel.status == "accepted"
-    ).first()
-    if not room_user:
+    if get_membership_status(db, room_id, user_id) != "accepted":
         raise HTTPException(status_code=400, detail="Student is not a member of this room")
 
     # Check if already excused
@@ -864,18 +1251,21 @@ async def mark_excused(
         attachment_path=attachment_path,
     )
     db.add(excused)
-    db.commit()
-    db.refresh(excused)
 
-    # Optionally, update attendance record status to "excused"
-    attendance_record = db.query(models.AttendanceRecordModel).filter(
-        models.AttendanceRecordModel.room_id == room_id,
-        models.AttendanceRecordModel.user_id == user_id,
-        models.AttendanceRecordModel.schedule_id == schedule_id
-    ).first()
-    if attendance_record:
-        attendance_record.status = "excused"
-        db.commit()
+    # Set the attendance record to "excused", creating it if needed, in the same transaction
+    # as the excuse and the attendance counters
+    upsert_attendance_records(
+        db,
+        [{
+            "room_id": room_id,
+            "user_id": user_id,
+            "schedule_id": schedule_id,
+            "status": "excused",
+            "taken_at": datetime.now(),
+        }],
+        update_from=("pending", "present", "late", "absent")
+    )
+    db.commit()
 
     # Log action
     log_action(
@@ -1,3 +1,4 @@
+import asyncio
 import cv2
 from fastapi import APIRouter, Depends, HTTPException, Request
 from sqlalchemy.orm import Session
@@ -5,7 +6,8 @@ from backend import models, schemas
 from backend.ArcFaceModel import ArcFaceModel
 from backend.database import get_db
 
-from backend.utils import decode_base64_image, get_current_user, log_action
+from backend.rate_limit import enforce_rate_limits, inference_gate
+from backend.utils import embed_base64_image, get_current_user, log_action
 import base64
 import numpy as np
 from backend.ArcFaceModel import ArcFaceModel
@@ -16,6 +18,11 @@ router = APIRouter()
 # Initialize the ArcFace model
 arcface_model = ArcFaceModel()
 
+
+async def _embed_image(base64_image: str):
+    """Generate the embedding of one image in a thread, within the worker's inference limit."""
+    return await inference_gate.run(None, embed_base64_image, base64_image, arcface_model)
+
 @router.post("/register_face")
 async def register_face(
     data: schemas.RegisterFace,
@@ -28,6 +35,7 @@ async def register_face(
     try:
         # Decode the token and get the user
         user = get_current_user(data.token)
+        await enforce_rate_limits(user["user_id"])
         db_user = db.query(models.UserModel).filter(models.UserModel.user_id == user["user_id"]).first()
         if not db_user or not db_user.is_verified:
             raise HTTPException(status_code=403, detail="Face registration is only allowed for verified users.")
@@ -39,8 +47,7 @@ async def register_face(
         # Process each image and generate embeddings
         embeddings = []
         for base64_image in data.images:
-            decoded_image = decode_base64_image(base64_image)
-            embedding = arcface_model.process_image_with_arcface(decoded_image)
+            embedding = await _embed_image(base64_image)
             embeddings.append(embedding.tolist())
 
         # Check if the user already has a face record
@@ -72,6 +79,8 @@ async def register_face(
 
         return {"message": "Face registered successfully", "face_id": new_face.face_id}
 
+    except HTTPException as http_exc:
+        raise http_exc
     except Exception as e:
         print(f"Error registering face: {e}")
         raise HTTPException(status_code=500, detail="An error occurred while registering the face.")
@@ -90,6 +99,7 @@ async def overwrite_face(
     try:
         # Decode the token and get the user
         user = get_current_user(data.token)
+        await enforce_rate_limits(user["user_id"])
         
         # Only allow face registration for verified users
         db_user = db.query(models.UserModel).filter(models.UserModel.user_id == user["user_id"]).first()
@@ -103,8 +113,7 @@ async def overwrite_face(
         # Process each image and generate embeddings
         embeddings = []
         for base64_image in data.images:
-            decoded_image = decode_base64_image(base64_image)
-            embedding = arcface_model.process_image_with_arcface(decoded_image)
+            embedding = await _embed_image(base64_image)
             embeddings.append(embedding.tolist())
 
         # Check if the user already has a face record
@@ -132,6 +141,8 @@ async def overwrite_face(
 
         return {"message": "Face data updated successfully", "face_id": existing_face.face_id}
 
+    except HTTPException as http_exc:
+        raise http_exc
     except Exception as e:
         print(f"Error overwriting face data: {e}")
         raise HTTPException(status_code=500, detail="An error occurred while overwriting the face data.")
@@ -1,8 +1,13 @@
-from fastapi import APIRouter, Depends, HTTPException
+import math
+from datetime import datetime
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import case, func
 from sqlalchemy.orm import Session
 from backend import models, schemas
 from backend.database import get_db
-from backend.utils import log_action
+from backend.room_cache import get_room, invalidate_room
+from backend.utils import get_current_user, log_action
 
 router = APIRouter()
 
@@ -72,6 +77,13 @@ def get_geofence(
         raise HTTPException(status_code=500, detail="An error occurred while retrieving the geofence.")
 
 
+def _geofence_room_ids(db: Session, geofence_id: int):
+    """Rooms using a geofence; their cached attendance context holds its coordinates."""
+    return [room_id for room_id, in db.query(models.RoomsModel.room_id).filter(
+        models.RoomsModel.geofence_id == geofence_id
+    )]
+
+
 @router.put("/update_geofence/{geofence_id}")
 def update_geofence(
     geofence_id: int,
@@ -96,6 +108,8 @@ def update_geofence(
 
         db.commit()
         db.refresh(geofence)
+        for room_id in _geofence_room_ids(db, geofence_id):
+            invalidate_room(room_id)
 
         return {"message": "Geofence updated successfully", "geofence_id": geofence.geofence_id}
 
@@ -119,8 +133,11 @@ def delete_geofence(
         if not geofence:
             raise HTTPException(status_code=404, detail="Geofence not found")
 
+        room_ids = _geofence_room_ids(db, geofence_id)
         db.delete(geofence)
         db.commit()
+        for room_id in room_ids:
+            invalidate_room(room_id)
 
         return {"message": "Geofence deleted successfully"}
 
@@ -140,9 +157,7 @@ def get_geofence_byroom(
     """
     try:
         # Query the room to get the geofence_id and attendance settings
-        room = db.query(models.RoomsModel).filter(
-            models.RoomsModel.room_id == roomId
-        ).first()
+        room = get_room(db, roomId)
 
         if not room:
             raise HTTPException(status_code=404, detail="Room not found")
@@ -183,3 +198,115 @@ def get_all_geofences(db: Session = Depends(get_db)):
     return [{"geofence_id": g.geofence_id, "location": g.location} for g in geofences]
 
 
+def _attempt_time_filters(start: Optional[datetime], end: Optional[datetime]):
+    """Build optional created_at range filters for geofence attempt queries."""
+    filters = []
+    if start:
+        filters.append(models.GeofenceAttemptModel.created_at >= start)
+    if end:
+        filters.append(models.GeofenceAttemptModel.created_at < end)
+    return filters
+
+
+@router.get("/attempt_stats")
+def geofence_attempt_stats(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    token: str = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Retrieve the attempt count, reject count and reject rate for every geofence.
+    """
+    try:
+        rejected = func.sum(case((models.GeofenceAttemptModel.is_within == False, 1), else_=0))
+        stats = db.query(
+            models.GeofenceAttemptModel.geofence_id,
+            models.GeofenceLocationModel.location,
+            func.count(models.GeofenceAttemptModel.attempt_id).label("attempts"),
+            rejected.label("rejected"),
+            func.avg(models.GeofenceAttemptModel.distance).label("avg_distance"),
+            func.avg(models.GeofenceAttemptModel.accuracy).label("avg_accuracy"),
+        ).join(
+            models.GeofenceLocationModel,
+            models.GeofenceAttemptModel.geofence_id == models.GeofenceLocationModel.geofence_id
+        ).filter(
+            *_attempt_time_filters(start, end)
+        ).group_by(
+            models.GeofenceAttemptModel.geofence_id,
+            models.GeofenceLocationModel.location
+        ).all()
+
+        return [
+            {
+                "geofence_id": stat.geofence_id,
+                "location": stat.location,
+                "attempts": stat.attempts,
+                "rejected": int(stat.rejected or 0),
+                "reject_rate": (int(stat.rejected or 0) / stat.attempts) * 100 if stat.attempts else 0,
+                "avg_distance": stat.avg_distance,
+                "avg_accuracy": stat.avg_accuracy,
+            }
+            for stat in stats
+        ]
+
+    except Exception as e:
+        print(f"Error retrieving geofence attempt stats: {e}")
+        raise HTTPException(status_code=500, detail="An error occurred while retrieving geofence attempt stats.")
+
+
+def _bucket_bounds(bucket: int, bucket_size: float, max_distance: float, overflow_bucket: int):
+    """Distance range of a histogram bucket; the overflow bucket starts at max_distance and has no upper bound."""
+    if bucket >= overflow_bucket:
+        return {"min_distance": max_distance, "max_distance": None}
+    return {"min_distance": bucket * bucket_size, "max_distance": min((bucket + 1) * bucket_size, max_distance)}
+
+
+@router.get("/{geofence_id}/distance_histogram")
+def geofence_distance_histogram(
+    geofence_id: int,
+    bucket_size: float = Query(25, gt=0),
+    max_distance: float = Query(1000, gt=0),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    token: str = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Retrieve a histogram of attempt distances for a geofence, split into accepted and rejected counts.
+    Distances at or beyond max_distance are grouped into a single overflow bucket; when
+    max_distance is not a multiple of bucket_size, the last bucket below it is narrower.
+    """
+    try:
+        # First bucket index past the in-range ones, so a partial last bucket keeps its own index
+        overflow_bucket = math.ceil(max_distance / bucket_size)
+        bucket = case(
+            (models.GeofenceAttemptModel.distance >= max_distance, overflow_bucket),
+            else_=func.floor(models.GeofenceAttemptModel.distance / bucket_size)
+        ).label("bucket")
+
+        histogram = db.query(
+            bucket,
+            func.sum(case((models.GeofenceAttemptModel.is_within == True, 1), else_=0)).label("accepted"),
+            func.sum(case((models.GeofenceAttemptModel.is_within == False, 1), else_=0)).label("rejected"),
+        ).filter(
+            models.GeofenceAttemptModel.geofence_id == geofence_id,
+            *_attempt_time_filters(start, end)
+        ).group_by(bucket).order_by(bucket).all()
+
+        return {
+            "geofence_id": geofence_id,
+            "bucket_size": bucket_size,
+            "buckets": [
+                {
+                    **_bucket_bounds(int(row.bucket), bucket_size, max_distance, overflow_bucket),
+                    "accepted": int(row.accepted or 0),
+                    "rejected": int(row.rejected or 0),
+                }
+                for row in histogram
+            ],
+        }
+
+    except Exception as e:
+        print(f"Error retrieving geofence distance histogram: {e}")
+        raise HTTPException(status_code=500, detail="An error occurred while retrieving the distance histogram.")
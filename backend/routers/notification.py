@@ -1,19 +1,20 @@
 from datetime import datetime
 from typing import List
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy import String, cast, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from backend import models, schemas
-from backend.database import get_db
+from backend.database import get_async_db
 from backend.utils import get_current_user
 
 router = APIRouter()
 
 
 @router.post("/create-notifications")
-def create_notification(
+async def create_notification(
     notification: schemas.NotificationCreate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Create a new notification for a user.
@@ -26,17 +27,17 @@ def create_notification(
         created_at=datetime.utcnow()
     )
     db.add(new_notification)
-    db.commit()
-    db.refresh(new_notification)
+    await db.commit()
+    await db.refresh(new_notification)
     return {"message": "Notification created successfully", "notification": new_notification}
 
 
 
 
 @router.post("/get-notifications/")
-def get_notifications(
+async def get_notifications(
     data: schemas.GetNotificationToken,  # Schema to validate the token
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Retrieve notifications for a specific user based on the token.
@@ -51,9 +52,12 @@ def get_notifications(
         user_id = token_data["user_id"]
 
         # Query notifications for the user
-        notifications = db.query(models.Notification).filter(
-            models.Notification.user_id == user_id
-        ).order_by(models.Notification.created_at.desc()).all()
+        result = await db.execute(
+            select(models.Notification).where(
+                models.Notification.user_id == user_id
+            ).order_by(models.Notification.created_at.desc())
+        )
+        notifications = result.scalars().all()
 
         return notifications
     except HTTPException as http_exc:
@@ -64,8 +68,8 @@ def get_notifications(
         raise HTTPException(status_code=500, detail="An error occurred while retrieving notifications")
 
 @router.put("/mark_all_as_read")
-def mark_all_as_read(
-    db: Session = Depends(get_db),
+async def mark_all_as_read(
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)  # Properly inject the current user
 ):
     """
@@ -78,11 +82,13 @@ def mark_all_as_read(
             raise HTTPException(status_code=401, detail="Invalid token")
 
         # Update all notifications for the user to mark them as read
-        db.query(models.Notification).filter(
-            models.Notification.user_id == user_id,
-            models.Notification.is_read == False  # Only update unread notifications
-        ).update({"is_read": True})
-        db.commit()
+        await db.execute(
+            update(models.Notification).where(
+                models.Notification.user_id == user_id,
+                models.Notification.is_read == False  # Only update unread notifications
+            ).values(is_read=True)
+        )
+        await db.commit()
 
         return {"message": "All notifications marked as read"}
     except Exception as e:
@@ -90,23 +96,23 @@ def mark_all_as_read(
         raise HTTPException(status_code=500, detail="An error occurred while marking notifications as read")
 
 @router.put("/{notification_id}/mark_as_read")
-def mark_notification_as_read(
+async def mark_notification_as_read(
     notification_id: int,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Mark a notification as read.
     """
     try:
         # Query the notification by ID
-        notification = db.query(models.Notification).filter(models.Notification.id == notification_id).first()
+        notification = await db.get(models.Notification, notification_id)
         if not notification:
             raise HTTPException(status_code=404, detail="Notification not found")
 
         # Update the notification's is_read status
         notification.is_read = True
-        db.commit()
-        db.refresh(notification)
+        await db.commit()
+        await db.refresh(notification)
 
         return {"message": "Notification marked as read", "notification": notification}
     except Exception as e:
@@ -115,33 +121,33 @@ def mark_notification_as_read(
 
 
 @router.delete("/delete-notifications/{notification_id}")
-def delete_notification(
+async def delete_notification(
     notification_id: int,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Delete a notification.
     """
     try:
         # Query the notification by ID
-        notification = db.query(models.Notification).filter(models.Notification.id == notification_id).first()
+        notification = await db.get(models.Notification, notification_id)
         if not notification:
             raise HTTPException(status_code=404, detail="Notification not found")
 
         # Delete the notification
-        db.delete(notification)
-        db.commit()
+        await db.delete(notification)
+        await db.commit()
 
         return {"message": "Notification deleted successfully"}
     except Exception as e:
         print(f"Error deleting notification: {e}")
         raise HTTPException(status_code=500, detail="An error occurred while deleting the notification")
-    
-    
-    
+
+
+
 @router.post("/get-teacher-notifications")
-def get_teacher_notifications(
-    db: Session = Depends(get_db),
+async def get_teacher_notifications(
+    db: AsyncSession = Depends(get_async_db),
     current_user: dict = Depends(get_current_user)
 ):
     """
@@ -151,15 +157,19 @@ def get_teacher_notifications(
         # Extract the user ID and role from the current user
         user_id = current_user.get("user_id")
         role = current_user.get("role")
-        # Query rooms owned by the teacher
-        owned_rooms = db.query(models.RoomsModel.room_id).filter(
-            models.RoomsModel.user_id == user_id
-        ).subquery()
 
-        # Query notifications related to the teacher's rooms
-        notifications = db.query(models.Notification).filter(
-            models.Notification.room_id.in_(owned_rooms)
-        ).order_by(models.Notification.created_at.desc()).all()
+        # Query notifications related to the teacher's rooms, joined with the room name
+        result = await db.execute(
+            select(
+                models.Notification,
+                models.RoomsModel.class_name.label("room_name")
+            ).join(
+                models.RoomsModel,
+                models.Notification.room_id == cast(models.RoomsModel.room_id, String)
+            ).where(
+                models.RoomsModel.user_id == user_id
+            ).order_by(models.Notification.created_at.desc())
+        )
 
         # Transform the notifications into a list of dictionaries
         notification_list = [
@@ -170,11 +180,9 @@ def get_teacher_notifications(
                 "is_read": notification.is_read,
                 "created_at": notification.created_at,
                 "room_id": notification.room_id,
-                "room_name": db.query(models.RoomsModel.class_name).filter(
-                    models.RoomsModel.room_id == notification.room_id
-                ).scalar(),  # Fetch the room name
+                "room_name": room_name,
             }
-            for notification in notifications
+            for notification, room_name in result.all()
         ]
 
         return notification_list
@@ -184,4 +192,4 @@ def get_teacher_notifications(
         raise http_exc
     except Exception as e:
         print(f"Error retrieving teacher notifications: {e}")
-        raise HTTPException(status_code=500, detail="An error occurred while retrieving notifications")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail="An error occurred while retrieving notifications")
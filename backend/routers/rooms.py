@@ -1,10 +1,12 @@
 import os
 from typing import List
-from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi import APIRouter, Depends, HTTPException, Header, Request
 from fastapi.responses import FileResponse
 from sqlalchemy.orm import Session
 from backend import models, schemas
 from backend.database import get_db
+from backend.idempotency import run_idempotent_sync
+from backend.room_cache import get_room, invalidate_membership, invalidate_room
 from datetime import datetime
 
 from backend.utils import check_pending_attendance, generate_qr_code, get_current_user, log_action
@@ -139,7 +141,33 @@ def get_room_details(room_id: int, db: Session = Depends(get_db)):
 # Join Room
 # ------------------------------
 @router.post("/join_room_by_code")
-def join_room_by_code(room_user: schemas.JoinRoom, db: Session = Depends(get_db), request: Request = None):
+def join_room_by_code(
+    room_user: schemas.JoinRoom,
+    db: Session = Depends(get_db),
+    request: Request = None,
+    idempotency_key: str = Header(None),
+    authorization: str = Header(None)
+):
+    """
+    Request to join a room by its code. Retries carrying the same Idempotency-Key header get
+    the original response back; keys are scoped to the user of the bearer token, which is
+    required with a key and must be the user joining.
+    """
+    user = None
+    if authorization and authorization.startswith("Bearer "):
+        user = get_current_user(authorization.split(" ")[1])
+        if user["user_id"] != room_user.user_id:
+            raise HTTPException(status_code=403, detail="You can only join rooms with your own account")
+    elif idempotency_key:
+        raise HTTPException(status_code=401, detail="Invalid or missing token")
+
+    return run_idempotent_sync(
+        user["user_id"] if user else None, "join_room_by_code", idempotency_key,
+        lambda: _join_room_by_code(room_user, db, request)
+    )
+
+
+def _join_room_by_code(room_user: schemas.JoinRoom, db: Session, request: Request):
     # Check if the room exists by room_code
     room = db.query(models.RoomsModel).filter(models.RoomsModel.room_code == room_user.room_code).first()
     if not room:
@@ -177,6 +205,7 @@ def join_room_by_code(room_user: schemas.JoinRoom, db: Session = Depends(get_db)
     )
     db.add(new_membership)
     db.commit()
+    invalidate_membership(room.room_id, room_user.user_id)
 
     # Notify the room owner
     notification = models.Notification(
@@ -320,6 +349,7 @@ def update_join_request_status(
         request=request2,)
         
         db.commit()
+        invalidate_membership(room_id, user_id)
 
         print(f"Join request updated to {request.status}")
         return {"message": f"Join request has been {request.status}"}
@@ -490,7 +520,7 @@ def get_attendance_settings(room_id: int, db: Session = Depends(get_db)):
     Fetch attendance settings for a specific room.
     """
     try:
-        room = db.query(models.RoomsModel).filter(models.RoomsModel.room_id == room_id).first()
+        room = get_room(db, room_id)
         if not room:
             raise HTTPException(status_code=404, detail="Room not found")
 
@@ -522,6 +552,7 @@ def update_attendance_settings(
         room.isGeofence = settings.isGeofence
         room.isFaceAuth = settings.isFaceAuth
         db.commit()
+        invalidate_room(room_id)
 
         log_action(
         db=db,
@@ -550,6 +581,7 @@ def set_geofence(room_id: int, geofence: schemas.SetGeofence, db: Session = Depe
 
     room.geofence_id = geofence.geofence_id
     db.commit()
+    invalidate_room(room_id)
     
     log_action(
         db=db,
@@ -596,6 +628,7 @@ def update_room_details(room_id: int, room: schemas.UpdateRoom, db: Session = De
         db.commit()
         print("Database commit successful")
         db.refresh(existing_room)
+        invalidate_room(room_id)
         
         log_action(
         db=db,
@@ -674,6 +707,7 @@ def accept_rejected_join_request(
         # Update the status to 'accepted'
         join_request.status = schemas.JoinStatus.accepted
         db.commit()
+        invalidate_membership(room_id, user_id)
 
         log_action(
             db=db,
@@ -714,6 +748,7 @@ def kick_student(
         # Update the status to 'rejected'
         student.status = schemas.JoinStatus.rejected
         db.commit()
+        invalidate_membership(room_id, user_id)
 
         log_action(
             db=db,
@@ -760,6 +795,7 @@ def archive_room(
         # Archive the room
         room.is_archived = True
         db.commit()
+        invalidate_room(room_id)
 
         log_action(
             db=db,
@@ -0,0 +1,145 @@
+import os
+import threading
+from bisect import bisect_right, insort
+from datetime import date, datetime
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from backend import models
+from backend.database import SessionLocal
+
+# How often every worker reloads today's schedules to pick up changes made through the others
+SCHEDULE_INDEX_REFRESH_SECONDS = int(os.getenv("SCHEDULE_INDEX_REFRESH_SECONDS", "15"))
+
+
+def _schedule_entry(schedule):
+    """Flatten a schedule row into the keys used by the attendance context."""
+    return {
+        "schedule_id": schedule.schedule_id,
+        "room_id": schedule.room_id,
+        "schedule_name": schedule.schedule_name,
+        "schedule_date": schedule.date,
+        "schedule_start_time": schedule.start_time,
+        "schedule_end_time": schedule.end_time,
+    }
+
+
+class ScheduleIndex:
+    """
+    Today's non-archived attendance schedules, kept per room and ordered by start time.
+    Schedules in a room never overlap, so the active one is the last schedule that
+    started at or before now, provided it has not ended yet.
+    """
+
+    def __init__(self):
+        self.day = None
+        self._rooms = {}  # room_id -> sorted list of (start_time, schedule_id, entry)
+        self._lock = threading.Lock()
+
+    def load(self, db: Session, day: date = None):
+        """Rebuild the index from the database for the given day (today by default)."""
+        day = day or datetime.now().date()
+        schedules = db.query(models.AttendanceScheduleModel).filter(
+            models.AttendanceScheduleModel.date == day,
+            models.AttendanceScheduleModel.is_archived.isnot(True)
+        ).all()
+
+        rooms = {}
+        for schedule in schedules:
+            rooms.setdefault(schedule.room_id, []).append(
+                (schedule.start_time, schedule.schedule_id, _schedule_entry(schedule))
+            )
+        for entries in rooms.values():
+            entries.sort(key=lambda item: (item[0], item[1]))
+
+        with self._lock:
+            self.day = day
+            self._rooms = rooms
+
+    def active(self, room_id: int, now: datetime = None):
+        """
+        Return the active schedule entry for a room, or None if there is none.
+        Raises LookupError if the index has not been loaded for today.
+        """
+        now = now or datetime.now()
+        with self._lock:
+            if self.day != now.date():
+                raise LookupError("Schedule index is not loaded for today")
+            entries = self._rooms.get(room_id)
+            if not entries:
+                return None
+            position = bisect_right(entries, now.time(), key=lambda item: item[0]) - 1
+            if position < 0:
+                return None
+            entry = entries[position][2]
+            return entry if entry["schedule_end_time"] >= now.time() else None
+
+    def upsert(self, schedule):
+        """Add or move a schedule after it was created or updated."""
+        with self._lock:
+            self._discard(schedule.schedule_id)
+            if schedule.date == self.day and not schedule.is_archived:
+                insort(
+                    self._rooms.setdefault(schedule.room_id, []),
+                    (schedule.start_time, schedule.schedule_id, _schedule_entry(schedule)),
+                    key=lambda item: (item[0], item[1])
+                )
+
+    def remove(self, schedule_id: int):
+        """Drop a schedule, e.g. after it was archived."""
+        with self._lock:
+            self._discard(schedule_id)
+
+    def _discard(self, schedule_id: int):
+        for room_id, entries in list(self._rooms.items()):
+            remaining = [item for item in entries if item[1] != schedule_id]
+            if len(remaining) != len(entries):
+                if remaining:
+                    self._rooms[room_id] = remaining
+                else:
+                    del self._rooms[room_id]
+
+
+schedule_index = ScheduleIndex()
+
+
+def refresh_schedule_index():
+    """Reload today's schedules; run at startup, at midnight and periodically to pick up changes made by other workers."""
+    db = SessionLocal()
+    try:
+        schedule_index.load(db)
+    except Exception as e:
+        print(f"Error loading the schedule index: {e}")
+    finally:
+        db.close()
+
+
+async def get_active_schedule(db: AsyncSession, room_id: int, now: datetime = None):
+    """
+    Resolve the active schedule of a room from the index, including "no active schedule".
+    Changes made through this worker update the index right away; a schedule created, moved
+    or archived through another worker is seen here after the next refresh, up to
+    SCHEDULE_INDEX_REFRESH_SECONDS later. Only while the index is not loaded for today does
+    this read the database.
+    """
+    now = now or datetime.now()
+    try:
+        return schedule_index.active(room_id, now)
+    except LookupError:
+        pass
+
+    result = await db.execute(select(models.AttendanceScheduleModel).where(
+        models.AttendanceScheduleModel.room_id == room_id,
+        models.AttendanceScheduleModel.date == now.date(),
+        models.AttendanceScheduleModel.start_time <= now.time(),
+        models.AttendanceScheduleModel.end_time >= now.time(),
+        models.AttendanceScheduleModel.is_archived.isnot(True)
+    ).limit(1))
+    schedule = result.scalars().first()
+    if not schedule:
+        return None
+
+    schedule_index.upsert(schedule)
+    return _schedule_entry(schedule)
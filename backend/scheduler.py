@@ -0,0 +1,243 @@
+import os
+from datetime import date, datetime, timedelta
+
+from apscheduler.jobstores.base import JobLookupError
+from apscheduler.schedulers.background import BackgroundScheduler
+from sqlalchemy import and_, or_
+
+from backend import models
+from backend.attendance_analytics import flag_at_risk_students
+from backend.attendance_queue import attendance_queue
+from backend.attendance_counters import refresh_daily_rollups
+from backend.database import SessionLocal
+from backend.idempotency import prune_idempotency_keys
+from backend.job_runs import job_run_recorder, prune_job_runs
+from backend.leader_lock import make_leader_lock
+from backend.schedule_index import SCHEDULE_INDEX_REFRESH_SECONDS, refresh_schedule_index
+from backend.utils import mark_pending_as_absent
+
+# Close a schedule a moment after its end time, once "end_time < now" holds
+SCHEDULE_CLOSE_DELAY_SECONDS = 1
+# How often every worker tries to become the leader, or checks that it still is
+LEADER_CHECK_SECONDS = 15
+# How often the leader picks up schedules created or moved through other workers
+SCHEDULE_SYNC_SECONDS = 60
+# Today's daily rollups are refreshed every few minutes, the last week's every night
+# to pick up late changes such as excuses
+ROLLUP_REFRESH_MINUTES = 15
+ROLLUP_NIGHTLY_DAYS = 7
+
+# Every worker runs its own scheduler for per-process jobs (the schedule index refresh).
+# Jobs that write shared rows, the schedule closes, only run in the worker holding the
+# leader lock, so each of them runs once across all workers.
+scheduler = BackgroundScheduler()
+job_run_recorder.attach(scheduler)
+leader_lock = make_leader_lock()
+_is_leader = False
+_last_sync = None
+LEADER_JOB_IDS = {
+    "restore_schedule_closes", "sync_schedule_closes", "prune_job_runs", "refresh_rollups", "refresh_rollups_nightly",
+    "flag_at_risk_students", "prune_idempotency_keys"
+}
+
+
+def _close_job_id(schedule_id: int) -> str:
+    return f"close_schedule_{schedule_id}"
+
+
+def _ends_at_or_after(moment: datetime):
+    schedule = models.AttendanceScheduleModel
+    return or_(
+        schedule.date > moment.date(),
+        and_(schedule.date == moment.date(), schedule.end_time >= moment.time())
+    )
+
+
+def close_schedule(schedule_id: int):
+    """Mark the pending records of a schedule that just ended as absent. Returns the number of records marked."""
+    db = SessionLocal()
+    try:
+        # The schedule may have been archived through another worker since the job was registered
+        archived = db.query(models.AttendanceScheduleModel.is_archived).filter(
+            models.AttendanceScheduleModel.schedule_id == schedule_id
+        ).scalar()
+        if archived is None or archived:
+            return 0
+        # Scans this worker validated before the end may still be queued. Scans queued in other
+        # workers, or still retrying, replace the absent records when they are written
+        if not attendance_queue.drain(schedule_id):
+            print(f"Closing schedule {schedule_id} with attendance scans still queued")
+        return mark_pending_as_absent(db, schedule_id)
+    finally:
+        db.close()
+
+
+def register_schedule_close(schedule: models.AttendanceScheduleModel):
+    """
+    (Re)schedule the close event of a schedule at its end time; replaces the event
+    registered for its previous end time. Archived schedules are not closed.
+    Only the leader keeps close events; other workers leave it to the leader's next sync.
+    """
+    if not _is_leader:
+        return
+    if schedule.is_archived:
+        unregister_schedule_close(schedule.schedule_id)
+        return
+
+    run_date = datetime.combine(schedule.date, schedule.end_time) + timedelta(seconds=SCHEDULE_CLOSE_DELAY_SECONDS)
+    scheduler.add_job(
+        close_schedule,
+        "date",
+        run_date=max(run_date, datetime.now()),
+        args=[schedule.schedule_id],
+        id=_close_job_id(schedule.schedule_id),
+        replace_existing=True,
+        misfire_grace_time=None,
+    )
+
+
+def unregister_schedule_close(schedule_id: int):
+    """Drop the close event of an archived schedule."""
+    if not _is_leader:
+        return
+    try:
+        scheduler.remove_job(_close_job_id(schedule_id))
+    except JobLookupError:
+        pass
+
+
+def _register_schedules_ending_after(db, moment: datetime) -> int:
+    schedule = models.AttendanceScheduleModel
+    upcoming = db.query(schedule).filter(
+        schedule.finalized_at.is_(None),
+        schedule.is_archived.isnot(True),
+        _ends_at_or_after(moment)
+    ).all()
+    for upcoming_schedule in upcoming:
+        register_schedule_close(upcoming_schedule)
+    return len(upcoming)
+
+
+def restore_schedule_closes():
+    """
+    Register the close events of every schedule that has not ended yet, after closing the
+    schedules that ended while no leader was running. Returns the number of records marked absent.
+    """
+    global _last_sync
+    db = SessionLocal()
+    try:
+        now = datetime.now()
+        marked = mark_pending_as_absent(db)
+        count = _register_schedules_ending_after(db, now)
+        _last_sync = now
+        print(f"Registered close events for {count} upcoming schedules")
+        return marked
+    finally:
+        db.close()
+
+
+def sync_schedule_closes():
+    """
+    Register the close events of schedules created or moved through other workers. Looks at
+    the schedules ending since the previous sync, so one that was created on another worker
+    and already ended is still closed. Returns the number of schedules registered.
+    """
+    global _last_sync
+    db = SessionLocal()
+    try:
+        now = datetime.now()
+        count = _register_schedules_ending_after(db, (_last_sync or now) - timedelta(seconds=SCHEDULE_SYNC_SECONDS))
+        _last_sync = now
+        return count
+    finally:
+        db.close()
+
+
+def refresh_recent_rollups(days: int = 0) -> int:
+    """Recompute the daily rollups of today and the given number of previous days. Returns the rows written."""
+    db = SessionLocal()
+    try:
+        count = refresh_daily_rollups(db, since=date.today() - timedelta(days=days))
+        db.commit()
+        return count
+    finally:
+        db.close()
+
+
+def flag_all_at_risk_students() -> int:
+    """Recompute the at-risk flags of every room. Returns the number of students flagged."""
+    db = SessionLocal()
+    try:
+        count = flag_at_risk_students(db)
+        db.commit()
+        return count
+    finally:
+        db.close()
+
+
+def _become_leader():
+    global _is_leader
+    _is_leader = True
+    print(f"Process {os.getpid()} is now the background scheduler leader")
+    # Run as jobs rather than inline so their runs are recorded like the others
+    scheduler.add_job(restore_schedule_closes, id="restore_schedule_closes", replace_existing=True)
+    scheduler.add_job(
+        sync_schedule_closes, "interval", seconds=SCHEDULE_SYNC_SECONDS,
+        id="sync_schedule_closes", replace_existing=True
+    )
+    scheduler.add_job(prune_job_runs, "cron", hour=3, minute=0, id="prune_job_runs", replace_existing=True)
+    scheduler.add_job(
+        prune_idempotency_keys, "interval", hours=1, id="prune_idempotency_keys", replace_existing=True
+    )
+    scheduler.add_job(
+        refresh_recent_rollups, "interval", minutes=ROLLUP_REFRESH_MINUTES,
+        id="refresh_rollups", replace_existing=True
+    )
+    scheduler.add_job(
+        refresh_recent_rollups, "cron", hour=0, minute=5, args=[ROLLUP_NIGHTLY_DAYS],
+        id="refresh_rollups_nightly", replace_existing=True
+    )
+    scheduler.add_job(
+        flag_all_at_risk_students, "cron", hour=0, minute=15, id="flag_at_risk_students", replace_existing=True
+    )
+
+
+def _step_down():
+    global _is_leader
+    _is_leader = False
+    print(f"Process {os.getpid()} lost the background scheduler leader lock")
+    for job in scheduler.get_jobs():
+        if job.id in LEADER_JOB_IDS or job.id.startswith("close_schedule_"):
+            job.remove()
+
+
+def campaign_for_leader():
+    """Take the leader lock if it is free, or step down if this process lost it."""
+    try:
+        if _is_leader:
+            if not leader_lock.held():
+                _step_down()
+        elif leader_lock.acquire():
+            _become_leader()
+    except Exception as e:
+        print(f"Error checking the background scheduler leader lock: {e}")
+
+
+def start_scheduler():
+    """Start the background jobs of this process and try to become the leader."""
+    # Load the new day's schedules at midnight, and refresh regularly so this worker
+    # sees schedules changed through another worker
+    scheduler.add_job(refresh_schedule_index, "cron", hour=0, minute=0, id="refresh_schedule_index_midnight")
+    scheduler.add_job(
+        refresh_schedule_index, "interval", seconds=SCHEDULE_INDEX_REFRESH_SECONDS, id="refresh_schedule_index"
+    )
+    # Workers keep campaigning so another one takes over when the leader exits
+    scheduler.add_job(campaign_for_leader, "interval", seconds=LEADER_CHECK_SECONDS, id="campaign_for_leader")
+
+    scheduler.start()
+    campaign_for_leader()
+
+
+def stop_scheduler():
+    scheduler.shutdown()
+    leader_lock.release()
@@ -162,6 +162,17 @@ class TakeAttendance(BaseModel):
     base64_image: Optional[str] = None # Base64-encoded facial landmark data    face_auth_data: Optional[List[FaceAuthData]] = None  # Accept an array of objects
     geofence_location: Optional[dict] = None
 
+class ScanAndAttend(BaseModel):
+    token: str
+    qr: str  # Scanned QR content: a signed schedule payload, or a bare room id when ALLOW_STATIC_ROOM_QR is set
+    base64_image: Optional[str] = None
+    geofence_location: Optional[dict] = None
+
+class AttendancePreflight(BaseModel):
+    room_id: int
+    token: str
+    geofence_location: Optional[dict] = None
+
 class  GeofenceLocation(BaseModel):
     location: str
     longitude: float
@@ -13,7 +13,7 @@ import qrcode
 from apscheduler.schedulers.background import BackgroundScheduler
 from datetime import datetime
 from sqlalchemy.orm import Session
-from backend.database import SessionLocal
+from backend.database import AsyncSessionLocal, SessionLocal
 from backend import models
 
 
@@ -100,37 +100,13 @@ def check_pending_attendance():
         # Get the current time
         current_time = datetime.now()
 
-        # Find schedules that have ended but are still active for attendance
+        # Find schedules that have ended but are not finalized yet
         ended_schedules = db.query(models.AttendanceScheduleModel).filter(
-            models.AttendanceScheduleModel.end_time < current_time.time(),
-            models.AttendanceScheduleModel.date <= current_time.date()
+            models.AttendanceScheduleModel.schedule_id.in_(ended_schedules_query(current_time))
         ).all()
 
-        for schedule in ended_schedules:
-            # Get all students in the room
-            students_in_room = db.query(models.RoomUsersModel).filter(
-                models.RoomUsersModel.room_id == schedule.room_id,
-                models.RoomUsersModel.status == "accepted"  # Ensure they are active members
-            ).all()
-
-            for student in students_in_room:
-                # Check if the student already has an attendance record for this schedule
-                existing_record = db.query(models.AttendanceRecordModel).filter(
-                    models.AttendanceRecordModel.schedule_id == schedule.schedule_id,
-                    models.AttendanceRecordModel.user_id == student.user_id
-                ).first()
-
-                if not existing_record:
-                    # Create a new attendance record with 'pending' status
-                    new_record = models.AttendanceRecordModel(
-                        room_id=schedule.room_id,
-                        user_id=student.user_id,
-                        schedule_id=schedule.schedule_id,
-                        taken_at=current_time,
-                        status="pending",
-                        qr_id=None  # Assuming QR ID is not applicable for pending records
-                    )
-                    db.add(new_record)
+        # Create 'pending' records for students without one, existing records are kept
+        materialize_attendance_roster(db, [schedule.schedule_id for schedule in ended_schedules])
 
         db.commit()
         print(f"Checked and updated pending attendance for schedules at {current_time}")
@@ -315,8 +291,14 @@ def log_action(
     level: str,
     details: str,
     action_type: str,
-    request: Request
+    request: Request,
+    commit: bool = True
 ):
+    """
+    Add an audit log entry. Pass commit=False to leave the entry in the caller's
+    transaction so it is written together with the rest of the unit of work.
+    Callers holding an AsyncSession must pass commit=False and await the commit themselves.
+    """
     client_ip = request.headers.get("X-Forwarded-For", request.client.host)
     user_agent = request.headers.get("User-Agent", "Unknown")
     log_entry = Logs(
@@ -330,8 +312,158 @@ def log_action(
         action_type=action_type,
     )
     db.add(log_entry)
-    db.commit()
-    
+    if commit:
+        db.commit()
+
+
+def record_geofence_attempt(
+    db: Session,
+    user_id: int,
+    room_id: int,
+    geofence_id: int,
+    distance: float,
+    is_within: bool,
+    accuracy: float = None,
+    commit: bool = True
+):
+    """
+    Store a geofence validation result as a typed row so reject rates and
+    distance distributions can be aggregated in SQL.
+    Pass commit=False to keep the row in the caller's transaction.
+    """
+    attempt = models.GeofenceAttemptModel(
+        user_id=user_id,
+        room_id=room_id,
+        geofence_id=geofence_id,
+        distance=distance,
+        accuracy=accuracy,
+        is_within=is_within,
+        created_at=datetime.now(),
+    )
+    db.add(attempt)
+    if commit:
+        db.commit()
+
+
+from collections import defaultdict
+from sqlalchemy import String, and_, case, cast, func, insert, inspect, literal, or_, select, text, tuple_, union_all, update
+from backend.attendance_counters import apply_counter_deltas, apply_counter_select
+from sqlalchemy.ext.asyncio import AsyncSession
+from backend.rate_limit import inference_gate
+from backend.room_cache import attendance_context_cache
+from backend.schedule_index import get_active_schedule
+
+
+
+async def get_attendance_context(db: AsyncSession, room_id: int, user_id: int):
+    """
+    Load everything needed to decide whether a user may mark attendance in a room
+    (room settings, membership and geofence with a single joined query, plus the active
+    schedule from the schedule index). Room data is cached briefly per (room_id, user_id).
+    Returns None if the room does not exist.
+    """
+    cache_key = (room_id, user_id)
+    context = attendance_context_cache.get(cache_key)
+    if context is None:
+        context = await _load_room_context(db, room_id, user_id)
+        if context is None:
+            return None
+        attendance_context_cache.set(cache_key, context)
+
+    schedule = await get_active_schedule(db, room_id)
+    return {**context, **(schedule or _NO_SCHEDULE)}
+
+
+_NO_SCHEDULE = {
+    "schedule_id": None,
+    "schedule_name": None,
+    "schedule_date": None,
+    "schedule_start_time": None,
+    "schedule_end_time": None,
+}
+
+
+async def _load_room_context(db: AsyncSession, room_id: int, user_id: int):
+    result = await db.execute(select(
+        models.RoomsModel.room_id,
+        models.RoomsModel.user_id.label("owner_id"),
+        models.RoomsModel.class_name,
+        models.RoomsModel.isGeofence,
+        models.RoomsModel.isFaceAuth,
+        models.RoomsModel.is_archived,
+        models.RoomsModel.geofence_id,
+        models.RoomUsersModel.status.label("membership_status"),
+        models.GeofenceLocationModel.latitude.label("geofence_latitude"),
+        models.GeofenceLocationModel.longitude.label("geofence_longitude"),
+        models.GeofenceLocationModel.radius.label("geofence_radius"),
+    ).outerjoin(
+        models.RoomUsersModel,
+        and_(
+            models.RoomUsersModel.room_id == models.RoomsModel.room_id,
+            models.RoomUsersModel.user_id == user_id
+        )
+    ).outerjoin(
+        models.GeofenceLocationModel,
+        models.GeofenceLocationModel.geofence_id == models.RoomsModel.geofence_id
+    ).where(
+        models.RoomsModel.room_id == room_id
+    ).limit(1))
+    row = result.first()
+    return row._asdict() if row else None
+
+
+def check_attendance_context(context, geofence_location: dict = None):
+    """
+    Validate room membership, the active schedule and the geofence for an attendance context.
+    Raises an HTTPException describing the first failed check, except for a location outside
+    the geofence, which callers handle with outside_geofence_error so the attempt can be recorded.
+    Returns (geofence_valid, distance); distance is None when the room has no geofence.
+    """
+    if not context:
+        raise HTTPException(status_code=404, detail="Room not found")
+
+    if context["is_archived"]:
+        raise HTTPException(status_code=400, detail="Attendance cannot be marked. The room is archived.")
+
+    if context["membership_status"] is None:
+        raise HTTPException(status_code=403, detail="You are not a member of this room")
+
+    if context["membership_status"] != "accepted":
+        raise HTTPException(status_code=403, detail="You are not allowed to mark attendance in this room")
+
+    now = datetime.now()
+    if context["schedule_id"] is None or not (
+        datetime.combine(context["schedule_date"], context["schedule_start_time"]) <= now
+        <= datetime.combine(context["schedule_date"], context["schedule_end_time"])
+    ):
+        raise HTTPException(status_code=400, detail="No active attendance schedule for this room at this time")
+
+    if not context["isGeofence"]:
+        return True, None
+
+    if not geofence_location:
+        raise HTTPException(status_code=400, detail="Geofence location is required for this room")
+
+    if context["geofence_latitude"] is None:
+        raise HTTPException(status_code=404, detail="Geofence data not found for this room")
+
+    geofence_valid, distance = validate_geofence(
+        user_longitude=geofence_location["longitude"],
+        user_latitude=geofence_location["latitude"],
+        geofence_longitude=context["geofence_longitude"],
+        geofence_latitude=context["geofence_latitude"],
+        radius=context["geofence_radius"]
+    )
+    return geofence_valid, distance
+
+
+def outside_geofence_error(distance: float) -> HTTPException:
+    """Build the error returned when a user is outside the room's geofence."""
+    return HTTPException(
+        status_code=400,
+        detail=f"You are outside the geofence area. You are {distance:.2f} meters away from the geofence center."
+    )
+
     
 from datetime import datetime, timedelta
 from sqlalchemy.orm import Session
@@ -339,178 +471,275 @@ from backend.models import AttendanceRecordModel, AttendanceScheduleModel, RoomU
 
 
 
-def initialize_attendance_records(schedule_id: int, room_id: int, db: Session):
+def upsert_attendance_records(db: Session, rows, update_from=("pending",)):
     """
-    Initialize attendance records for all students in the room.
-    Mark them as 'pending' if the schedule is ongoing, or 'absent' if the schedule has already ended.
-    Update existing 'pending' records to 'absent' if the schedule has ended.
+    Write attendance records with a single INSERT keyed on unique_attendance_record.
+    Each row holds room_id, user_id, schedule_id, status and taken_at. A row whose record
+    already exists only updates it while the stored status is one of update_from;
+    pass update_from=() to insert missing records and leave existing ones untouched.
+    Uses INSERT ... ON DUPLICATE KEY UPDATE on MySQL and ON CONFLICT on SQLite.
+    The attendance counters are updated in the same transaction.
+    Returns the (room_id, user_id, schedule_id) keys of the records inserted or updated,
+    decided under the lock on the existing records.
     """
-    try:
-        # Query the schedule to check its status
-        schedule = db.query(AttendanceScheduleModel).filter(
-            AttendanceScheduleModel.schedule_id == schedule_id
-        ).first()
+    if not rows:
+        return set()
+
+    table = AttendanceRecordModel.__table__
+    rows = [{"qr_id": None, **row} for row in rows]
+    can_update = table.c.status.in_(update_from) if update_from else None
+
+    # Lock the existing records to know which status each row replaces
+    keys = [(row["room_id"], row["user_id"], row["schedule_id"]) for row in rows]
+    current = {
+        (room_id, user_id, schedule_id): getattr(status, "value", status)
+        for room_id, user_id, schedule_id, status in db.execute(
+            select(table.c.room_id, table.c.user_id, table.c.schedule_id, table.c.status)
+            .where(tuple_(table.c.room_id, table.c.user_id, table.c.schedule_id).in_(keys))
+            .with_for_update()
+        )
+    }
+    deltas = defaultdict(int)
+    written = set()
+    for key, row in zip(keys, rows):
+        new_status = getattr(row["status"], "value", row["status"])
+        old_status = current.get(key)
+        if old_status is None:
+            deltas[key + (new_status,)] += 1
+            written.add(key)
+        elif old_status in update_from:
+            written.add(key)
+            if old_status != new_status:
+                deltas[key + (old_status,)] -= 1
+                deltas[key + (new_status,)] += 1
+
+    if db.get_bind().dialect.name == "mysql":
+        from sqlalchemy.dialects.mysql import insert
+
+        stmt = insert(table).values(rows)
+        if can_update is None:
+            # Assigning a column to itself turns the duplicate into a no-op
+            stmt = stmt.on_duplicate_key_update(status=table.c.status)
+        else:
+            # taken_at first: MySQL evaluates the assignments in order
+            stmt = stmt.on_duplicate_key_update([
+                ("taken_at", case((can_update, stmt.inserted.taken_at), else_=table.c.taken_at)),
+                ("status", case((can_update, stmt.inserted.status), else_=table.c.status)),
+            ])
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+
+        stmt = insert(table).values(rows)
+        index_elements = ["room_id", "user_id", "schedule_id"]
+        if can_update is None:
+            stmt = stmt.on_conflict_do_nothing(index_elements=index_elements)
+        else:
+            stmt = stmt.on_conflict_do_update(
+                index_elements=index_elements,
+                set_={"taken_at": stmt.excluded.taken_at, "status": stmt.excluded.status},
+                where=can_update
+            )
+    db.execute(stmt)
+    apply_counter_deltas(db, deltas)
+    return written
 
-        if not schedule:
-            print(f"Schedule {schedule_id} not found.")
-            return
 
-        # Determine if the schedule has ended
-        now = datetime.now()
-        schedule_end_time = datetime.combine(schedule.date, schedule.end_time)
-        is_schedule_ended = now > schedule_end_time
+def materialize_attendance_roster(db: Session, schedule_ids) -> int:
+    """
+    Create a 'pending' record for every accepted member of the schedules' rooms that has none
+    yet, with a single INSERT ... SELECT from room_users. Existing records are left untouched.
+    Returns the number of records created. The caller commits.
+    """
+    if not schedule_ids:
+        return 0
+
+    table = AttendanceRecordModel.__table__
+    # Accepted members without a record: an anti-join on unique_attendance_record
+    missing = select().select_from(AttendanceScheduleModel).join(
+        RoomUsersModel, RoomUsersModel.room_id == AttendanceScheduleModel.room_id
+    ).outerjoin(
+        table,
+        and_(
+            table.c.room_id == RoomUsersModel.room_id,
+            table.c.user_id == RoomUsersModel.user_id,
+            table.c.schedule_id == AttendanceScheduleModel.schedule_id
+        )
+    ).where(
+        AttendanceScheduleModel.schedule_id.in_(schedule_ids),
+        RoomUsersModel.status == "accepted",
+        table.c.attendance_id.is_(None)
+    )
 
-        # Query all students in the room
-        students_in_room = db.query(RoomUsersModel).filter(
-            RoomUsersModel.room_id == room_id,
-            RoomUsersModel.status == "accepted"  # Ensure they are active members
-        ).all()
+    # Lock the gaps of the missing records so a scan flushed meanwhile waits for this transaction
+    created = db.execute(missing.add_columns(func.count()).with_for_update()).scalar()
+    if not created:
+        return 0
+
+    roster = missing.add_columns(RoomUsersModel.room_id, RoomUsersModel.user_id, AttendanceScheduleModel.schedule_id)
+    # Counted from the anti-join before the rows exist, instead of matching them afterwards
+    apply_counter_select(db, roster.add_columns(literal("pending").label("status"), literal(1).label("delta")))
+
+    # taken_at is required; the read paths report None for pending records
+    db.execute(insert(table).from_select(
+        ["room_id", "user_id", "schedule_id", "status", "taken_at"],
+        roster.add_columns(literal("pending"), literal(datetime.now()))
+    ))
+    return created
+
+
+def _ended_by(now: datetime):
+    return or_(
+        AttendanceScheduleModel.date < now.date(),
+        and_(
+            AttendanceScheduleModel.date == now.date(),
+            AttendanceScheduleModel.end_time < now.time()
+        )
+    )
 
-        # Create or update attendance records
-        new_records = []
-        for student in students_in_room:
-            # Check if the student already has an attendance record for this schedule
-            existing_record = db.query(AttendanceRecordModel).filter(
-                AttendanceRecordModel.schedule_id == schedule_id,
-                AttendanceRecordModel.user_id == student.user_id
-            ).first()
-
-            if existing_record:
-                # Update 'pending' records to 'absent' if the schedule has ended
-                if existing_record.status == "pending" and is_schedule_ended:
-                    print(f"Updating record for User {student.user_id} in Schedule {schedule_id} to 'absent'")
-                    existing_record.status = "absent"
-            else:
-                # Create a new record if no record exists
-                status = "absent" if is_schedule_ended else "pending"
-                new_record = AttendanceRecordModel(
-                    room_id=room_id,
-                    user_id=student.user_id,
-                    schedule_id=schedule_id,
-                    status=status,
-                    taken_at=None,  # No scan yet
-                    qr_id=None  # Assuming QR ID is not applicable initially
-                )
-                new_records.append(new_record)
-
-        # Bulk insert new attendance records
-        if new_records:
-            db.bulk_save_objects(new_records)
-
-        # Commit changes to the database
-        db.commit()
-        print(f"Attendance records initialized or updated for schedule {schedule_id}")
-    except Exception as e:
-        print(f"Error initializing attendance records: {e}")
-        db.rollback()
+
+def ended_schedules_query(now: datetime):
+    """
+    Select the ids of the schedules that have ended by now and are not finalized yet.
+    Archived schedules are left alone, as close_schedule does.
+    """
+    return select(AttendanceScheduleModel.schedule_id).where(
+        AttendanceScheduleModel.finalized_at.is_(None),
+        AttendanceScheduleModel.is_archived.isnot(True),
+        _ended_by(now)
+    )
+
+
+def add_schedule_finalized_column(bind) -> bool:
+    """
+    Add attendance_schedule.finalized_at to a database created before the column existed, and
+    stamp the schedules that had already ended. Their records were closed by the previous
+    release; left unfinalized, the first catch-up would copy today's roster into every past
+    schedule and notify each of those students of an absence. Returns True if the column was added.
+    """
+    table = AttendanceScheduleModel.__table__
+    if "finalized_at" in {column["name"] for column in inspect(bind).get_columns(table.name)}:
+        return False
+
+    now = datetime.now().replace(microsecond=0)
+    with bind.begin() as connection:
+        connection.execute(text("ALTER TABLE attendance_schedule ADD COLUMN finalized_at DATETIME NULL"))
+        for index in table.indexes:
+            if "finalized_at" in index.columns:
+                index.create(connection)
+        stamped = connection.execute(
+            update(table).where(table.c.finalized_at.is_(None), _ended_by(now)).values(finalized_at=now)
+        ).rowcount
+    print(f"Added attendance_schedule.finalized_at, {stamped} schedules that had already ended marked finalized")
+    return True
 
 
-def mark_pending_as_absent(db: Session, batch_size=1000):
+def create_missing_index(bind, table, name: str) -> bool:
+    """
+    Create one of the table's indexes on a database created before it was added;
+    create_all only builds the indexes of new tables. Returns True if it was created.
+    """
+    if name in {index["name"] for index in inspect(bind).get_indexes(table.name)}:
+        return False
+
+    index = next(index for index in table.indexes if index.name == name)
+    index.create(bind)
+    print(f"Created index {name} on {table.name}")
+    return True
+
+
+def mark_pending_as_absent(db: Session, schedule_id: int = None):
+    """
+    Mark every 'pending' record of an ended schedule as 'absent', notify the student and the
+    room's teacher, and stamp the schedule's finalized_at. With schedule_id, only that schedule
+    is closed, if it has ended. Only schedules that ended since the last run are considered;
+    their records are handled by two INSERT ... SELECT statements for the notifications, one
+    for the counters and one UPDATE, in a single transaction.
+    Returns the number of records marked absent.
+    """
     try:
         now = datetime.now()
-        ended_schedules = db.query(AttendanceScheduleModel).filter(
-            AttendanceScheduleModel.end_time < now.time(),
-            AttendanceScheduleModel.date <= now.date()
-        ).all()
+        created_at = datetime.utcnow()
+        record = AttendanceRecordModel
+        schedule = AttendanceScheduleModel
+        room = models.RoomsModel
+        student = models.UserModel
+
+        ended_query = ended_schedules_query(now)
+        if schedule_id is not None:
+            ended_query = ended_query.where(schedule.schedule_id == schedule_id)
+        schedule_ids = db.execute(ended_query).scalars().all()
+        if not schedule_ids:
+            return 0
+        ended = record.schedule_id.in_(schedule_ids)
+
+        # Members accepted after the schedule was created get their record now, so they are marked too
+        materialize_attendance_roster(db, schedule_ids)
+
+        # Lock the pending records so a scan flushed meanwhile cannot slip between the statements below
+        db.execute(select(func.count()).select_from(record).where(record.status == "pending", ended).with_for_update())
+        pending = select(record.room_id, record.user_id, record.schedule_id).where(record.status == "pending", ended)
+        apply_counter_select(db, union_all(
+            pending.add_columns(literal("absent").label("status"), literal(1).label("delta")),
+            pending.add_columns(literal("pending").label("status"), literal(-1).label("delta")),
+        ))
+
+        newly_absent = (
+            select()
+            .select_from(record)
+            .join(schedule, schedule.schedule_id == record.schedule_id)
+            .join(room, room.room_id == record.room_id)
+            .join(student, student.user_id == record.user_id)
+            .where(record.status == "pending", ended)
+        )
+        notification_columns = ["user_id", "title", "message", "is_read", "created_at", "room_id"]
+
+        # Notifications are built from the rows before they are updated, in the same transaction
+        db.execute(insert(models.Notification).from_select(
+            notification_columns,
+            newly_absent.add_columns(
+                record.user_id,
+                literal("Marked Absent"),
+                literal("You have been marked as 'absent' for schedule '")
+                + schedule.schedule_name + "' in room '" + room.class_name + "'.",
+                literal(False),
+                literal(created_at),
+                cast(record.room_id, String)
+            )
+        ))
+        db.execute(insert(models.Notification).from_select(
+            notification_columns,
+            newly_absent.add_columns(
+                room.user_id,
+                literal("Student Marked Absent"),
+                literal("Student ") + student.first_name + " " + student.last_name
+                + " (ID: " + cast(student.user_id, String) + ") was marked 'absent' for schedule '"
+                + schedule.schedule_name + "' in room '" + room.class_name + "'.",
+                literal(False),
+                literal(created_at),
+                cast(record.room_id, String)
+            )
+        ))
+
+        result = db.execute(
+            update(record)
+            .where(record.status == "pending", ended)
+            .values(status="absent")
+            .execution_options(synchronize_session=False)
+        )
+        db.execute(
+            update(schedule)
+            .where(schedule.schedule_id.in_(schedule_ids))
+            .values(finalized_at=now)
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
 
-        if not ended_schedules:
-            print("No schedules have ended.")
-            return
-
-        schedule_ids = [schedule.schedule_id for schedule in ended_schedules]
-
-        # Process attendance records in batches
-        offset = 0
-        while True:
-            pending_records = db.query(AttendanceRecordModel).filter(
-                AttendanceRecordModel.schedule_id.in_(schedule_ids),
-                AttendanceRecordModel.status == "pending"
-            ).limit(batch_size).offset(offset).all()
-
-            if not pending_records:
-                break
-
-            for record in pending_records:
-                # Update status to absent if still pending
-                record.status = "absent"
-
-                # Fetch related data for notifications
-                student = db.query(models.UserModel).filter(models.UserModel.user_id == record.user_id).first()
-                schedule = db.query(AttendanceScheduleModel).filter(
-                    AttendanceScheduleModel.schedule_id == record.schedule_id
-                ).first()
-                room = db.query(models.RoomsModel).filter(models.RoomsModel.room_id == record.room_id).first()
-
-                if not (student and schedule and room):
-                    continue
-
-                # --- Notify Student if not already notified for this status ---
-                existing_student_notification = db.query(models.Notification).filter(
-                    models.Notification.user_id == student.user_id,
-                    models.Notification.room_id == room.room_id,
-                    models.Notification.title == "Marked Absent",
-                    models.Notification.message.like(f"%schedule '{schedule.schedule_name}'%"),
-                    models.Notification.is_read == False
-                ).first()
-                if not existing_student_notification:
-                    student_notification = models.Notification(
-                        user_id=student.user_id,
-                        title="Marked Absent",
-                        message=(
-                            f"You have been marked as 'absent' for schedule '{schedule.schedule_name}' "
-                            f"in room '{room.class_name}'."
-                        ),
-                        is_read=False,
-                        created_at=datetime.utcnow(),
-                        room_id=room.room_id
-                    )
-                    db.add(student_notification)
-
-            # Commit student notifications before teacher notifications
-            db.commit()
-
-            for record in pending_records:
-                # Fetch related data again (could be optimized)
-                student = db.query(models.UserModel).filter(models.UserModel.user_id == record.user_id).first()
-                schedule = db.query(AttendanceScheduleModel).filter(
-                    AttendanceScheduleModel.schedule_id == record.schedule_id
-                ).first()
-                room = db.query(models.RoomsModel).filter(models.RoomsModel.room_id == record.room_id).first()
-
-                if not (student and schedule and room):
-                    continue
-
-                # --- Notify Teacher if not already notified for this student/status ---
-                existing_teacher_notification = db.query(models.Notification).filter(
-                    models.Notification.user_id == room.user_id,
-                    models.Notification.room_id == room.room_id,
-                    models.Notification.title == "Student Marked Absent",
-                    models.Notification.message.like(f"%Student {student.first_name} {student.last_name} (ID: {student.user_id})%"),
-                    models.Notification.message.like(f"%schedule '{schedule.schedule_name}'%"),
-                    models.Notification.is_read == False
-                ).first()
-                if not existing_teacher_notification:
-                    teacher_notification = models.Notification(
-                        user_id=room.user_id,
-                        title="Student Marked Absent",
-                        message=(
-                            f"Student {student.first_name} {student.last_name} (ID: {student.user_id}) "
-                            f"was marked 'absent' for schedule '{schedule.schedule_name}' "
-                            f"in room '{room.class_name}'."
-                        ),
-                        is_read=False,
-                        created_at=datetime.utcnow(),
-                        room_id=room.room_id
-                    )
-                    db.add(teacher_notification)
-
-            db.commit()
-            offset += batch_size
-
-        print(f"Processed pending records for schedules: {schedule_ids}")
+        print(f"Finalized {len(schedule_ids)} ended schedules, {result.rowcount} pending attendance records marked absent")
+        return result.rowcount
     except Exception as e:
         print(f"Error marking pending as absent: {e}")
         db.rollback()
+        raise
 
 from concurrent.futures import ProcessPoolExecutor
 import asyncio
@@ -569,34 +798,44 @@ def decode_base64_image(base64_image: str) -> np.ndarray:
     return decoded_image
 
 
-async def validate_face_authentication(data, user, db, arcface_model, threshold=0.80):
+def embed_base64_image(base64_image: str, arcface_model):
+    """Decode a base64 image and generate its face embedding. Runs in the process pool."""
+    return arcface_model.process_image_with_arcface(decode_base64_image(base64_image))
+
+
+async def extract_face_embedding(base64_image: str, arcface_model):
     """
-    Validate face authentication using multiple registered embeddings.
-    Returns the highest confidence score if authentication is successful.
+    Decode a base64 image and generate its face embedding (offloaded to a process).
+    Waits for a slot of the inference gate, which raises 503 when the worker is saturated.
     """
-    if not data.base64_image:
+    if not base64_image:
         raise HTTPException(status_code=400, detail="Face authentication data is required.")
 
-    # Decode image (offloaded to a process)
-    image = await asyncio.get_event_loop().run_in_executor(
-        executor, decode_base64_image, data.base64_image
-    )
+    return await inference_gate.run(executor, embed_base64_image, base64_image, arcface_model)
 
-    # Generate face embedding for the provided image (offloaded to a process)
-    face_embedding = await asyncio.get_event_loop().run_in_executor(
-        executor, arcface_model.process_image_with_arcface, image
-    )
 
-    # Perform the database query in the main process
-    user_face_data = db.query(models.FaceDataModel).filter_by(user_id=user["user_id"]).first()
-    if not user_face_data or not isinstance(user_face_data.face_data, list) or len(user_face_data.face_data) == 0:
+async def load_registered_embeddings(user_id: int):
+    """
+    Fetch a user's registered face embeddings as np.ndarrays.
+    Uses its own session so it can run concurrently with other queries of the request.
+    """
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            select(models.FaceDataModel.face_data).where(models.FaceDataModel.user_id == user_id).limit(1)
+        )
+        face_data = result.scalars().first()
+    if not isinstance(face_data, list) or len(face_data) == 0:
         raise HTTPException(status_code=404, detail="No registered face data found.")
 
     # Convert all registered embeddings to np.ndarray format (offloaded to a process)
-    registered_embeddings = await asyncio.get_event_loop().run_in_executor(
-        executor, convert_embeddings, user_face_data.face_data
-    )
+    return await asyncio.get_event_loop().run_in_executor(executor, convert_embeddings, face_data)
+
 
+async def match_face_embedding(face_embedding, registered_embeddings, arcface_model, threshold=0.80):
+    """
+    Compare a face embedding against the registered ones.
+    Returns the highest confidence score, or raises if authentication failed.
+    """
     # Compare with each stored embedding and get the confidence scores (offloaded to a process)
     confidence_scores = await asyncio.get_event_loop().run_in_executor(
         executor, compare_embeddings, registered_embeddings, face_embedding, arcface_model, threshold
@@ -615,7 +854,49 @@ async def validate_face_authentication(data, user, db, arcface_model, threshold=
         )
 
     return highest_confidence
-      
+
+
+async def verify_face(base64_image: str, user_id: int, arcface_model, threshold=0.80):
+    """
+    Full face authentication stage: the embedding is generated while the registered
+    embeddings are fetched, then both are matched. Returns the highest confidence score.
+    """
+    face_embedding, registered_embeddings = await asyncio.gather(
+        extract_face_embedding(base64_image, arcface_model),
+        load_registered_embeddings(user_id)
+    )
+    return await match_face_embedding(face_embedding, registered_embeddings, arcface_model, threshold)
+
+
+def decode_base64_image(base64_image: str) -> np.ndarray:
+    """
+    Decode a base64-encoded image into an OpenCV image.
+    """
+    import base64
+    import cv2
+
+    if not base64_image:
+        raise ValueError("No image data provided.")
+
+    # Handle base64 string with or without the prefix
+    header, encoded = base64_image.split(",", 1) if "," in base64_image else ("", base64_image)
+    image_data = base64.b64decode(encoded)
+    if not image_data:
+        raise ValueError("Failed to decode base64 image data.")
+
+    # Convert binary data to a NumPy array
+    image_array = np.frombuffer(image_data, dtype=np.uint8)
+    if image_array.size == 0:
+        raise ValueError("Decoded image data is empty.")
+
+    # Decode the NumPy array into an OpenCV image
+    decoded_image = cv2.imdecode(image_array, cv2.IMREAD_COLOR)
+    if decoded_image is None:
+        raise ValueError("Failed to decode image. Ensure the base64 string is valid.")
+
+    return decoded_image
+
+
 def decode_base64_image(base64_image: str) -> np.ndarray:
     """
     Decode a base64-encoded image into an OpenCV image.
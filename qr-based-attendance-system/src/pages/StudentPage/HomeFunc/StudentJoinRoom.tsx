@@ -9,6 +9,8 @@ const StudentJoinRoom: React.FC = () => {
   const [errorMessage, setErrorMessage] = React.useState<string | null>(null);
   const [isLoading, setIsLoading] = React.useState<boolean>(false);
   const [isModalOpen, setIsModalOpen] = React.useState<boolean>(true); // Modal state
+  // One key per join attempt: kept for retries of the same request, replaced once it succeeds or the code changes
+  const idempotencyKey = React.useRef<string>(crypto.randomUUID());
 
   const handleClose = () => {
     setIsModalOpen(false); // Close the modal
@@ -39,12 +41,14 @@ const StudentJoinRoom: React.FC = () => {
       headers: {
         "Content-Type": "application/json",
         Authorization: `Bearer ${token}`,
+        "Idempotency-Key": idempotencyKey.current,
       },
       body: JSON.stringify(payload),
     });
 
     if (response.ok) {
       const data = await response.json();
+      idempotencyKey.current = crypto.randomUUID();
       alert(data.message); // Show success message
       handleClose(); // Navigate back to the home route only on success
     } else {
@@ -86,7 +90,10 @@ const StudentJoinRoom: React.FC = () => {
                 className="mt-1 block w-full px-3 py-2 border border-gray-300 rounded-md shadow-sm focus:outline-none focus:ring-indigo-500 focus:border-indigo-500 sm:text-sm"
                 placeholder="Enter Room code"
                 value={roomcode}
-                onChange={(e) => setRoomCode(e.target.value)}
+                onChange={(e) => {
+                  setRoomCode(e.target.value);
+                  idempotencyKey.current = crypto.randomUUID(); // A different code is a new attempt
+                }}
               />
               {errorMessage && (
                 <p className="text-red-500 text-sm mt-2">{errorMessage}</p>
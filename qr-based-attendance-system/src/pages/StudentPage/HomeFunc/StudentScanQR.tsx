@@ -10,90 +10,83 @@ const StudentScanQR: React.FC = () => {
   const navigate = useNavigate();
   const [isQRScannerOpen, setIsQRScannerOpen] = useState<boolean>(true); // State to control QRScanner visibility
   const [isFaceAuthOpen, setIsFaceAuthOpen] = useState<boolean>(false);
-  const [roomIdForFaceAuth, setRoomIdForFaceAuth] = useState<number | null>(
-    null
-  );
+  const [pendingScan, setPendingScan] = useState<{
+    qr: string;
+    roomId: number | null;
+    idempotencyKey: string;
+  } | null>(null);
   const [geofenceLocation, setGeofenceLocation] = useState<{
     latitude: number;
     longitude: number;
+    accuracy: number;
   } | null>(null);
   const [errorMessage, setErrorMessage] = useState<string | null>(null);
 
+  // Room requirements from earlier scans, so the location can be sent with the first request.
+  // The face image is only captured after the server answered 428, i.e. once the membership,
+  // schedule and geofence checks have passed
+  const getCachedRoomSettings = (roomId: number | null) => {
+    if (roomId === null) return null;
+    const cached = localStorage.getItem(`room_settings_${roomId}`);
+    return cached ? JSON.parse(cached) : null;
+  };
+
+  const cacheRoomSettings = (roomId: number, isGeofence: boolean, isFaceAuth: boolean) => {
+    localStorage.setItem(`room_settings_${roomId}`, JSON.stringify({ isGeofence, isFaceAuth }));
+  };
+
+  const fetchLocation = async () => {
+    try {
+      const location = await getGeolocation();
+      setGeofenceLocation(location); // Save geolocation for the face authentication step
+      console.log("Geolocation fetched:", location);
+      return location;
+    } catch (error) {
+      console.error("Error fetching geolocation:", error);
+      setErrorMessage(
+        "Failed to fetch your location. Please enable location services and try again."
+      );
+      return null;
+    }
+  };
+
   const handleScanSuccess = async (decodedText: string) => {
     console.log(`QR Code scanned: ${decodedText}`);
 
     // Close the QRScanner modal
     setIsQRScannerOpen(false);
 
-    try {
-      const token = localStorage.getItem("access_token");
-      if (!token) {
-        setErrorMessage("You are not logged in. Please log in to join a room.");
-        return;
-      }
-
-      const roomId = parseInt(decodedText); // Assuming the QR code contains the room_id
-      if (isNaN(roomId)) {
-        setErrorMessage("Invalid QR Code. Please try again.");
-        return;
-      }
-
-      // Fetch room settings
-      const roomSettingsResponse = await axios.get(
-        `${API_URL}/attendance/scan_qr`,
-        {
-          params: { room_id: roomId, token },
-        }
-      );
+    const token = localStorage.getItem("access_token");
+    if (!token) {
+      setErrorMessage("You are not logged in. Please log in to join a room.");
+      return;
+    }
 
-      const { isFaceAuth, isGeofence, is_archived } = roomSettingsResponse.data;
+    // Rotating schedule codes carry a signed payload ("v1.<room>.<schedule>...."), static room codes the bare room_id
+    const qr = decodedText.trim();
+    const roomId = parseInt(qr.startsWith("v1.") ? qr.split(".")[1] : qr);
+    // One key per scan, reused when the scan is resubmitted with a location or face image
+    const scan = {
+      qr,
+      roomId: isNaN(roomId) ? null : roomId,
+      idempotencyKey: `scan-${Date.now()}-${qr.slice(-12)}`,
+    };
+    setPendingScan(scan);
 
-      if (is_archived) {
-        setErrorMessage("This room is archived. You cannot Mark Attendance.");
-        return;
-      }
-      if (isGeofence) {
-        // Handle geolocation
-        try {
-          const location = await getGeolocation();
-          setGeofenceLocation(location); // Save geolocation for later use
-          console.log("Geolocation fetched:", location);
-
-          if (isFaceAuth) {
-            // If both geofencing and face authentication are required, open the FaceAuth modal
-            setRoomIdForFaceAuth(roomId);
-            setIsFaceAuthOpen(true);
-          } else {
-            // If only geofencing is required, mark attendance
-            await takeAttendance(roomId, token, undefined, location);
-          }
-        } catch (error) {
-          console.error("Error fetching geolocation:", error);
-          setErrorMessage(
-            "Failed to fetch your location. Please enable location services and try again."
-          );
-        }
-      } else if (isFaceAuth) {
-        // If only face authentication is required, open the FaceAuth modal
-        setRoomIdForFaceAuth(roomId);
-        setIsFaceAuthOpen(true);
-      } else {
-        // Handle attendance without face authentication or geolocation
-        await takeAttendance(roomId, token);
-      }
-    } catch (error: any) {
-      console.error("Error fetching room settings:", error);
-      if (error.response) {
-        setErrorMessage(error.response.data.detail || "An error occurred.");
-      } else {
-        setErrorMessage("An error occurred while processing the QR code.");
-      }
+    const settings = getCachedRoomSettings(scan.roomId);
+    let location: { latitude: number; longitude: number; accuracy: number } | undefined;
+    if (settings?.isGeofence) {
+      location = (await fetchLocation()) || undefined;
+      if (!location) return;
     }
+
+    await scanAndAttend(scan, token, undefined, location);
   };
 
   const getGeolocation = (): Promise<{
     latitude: number;
     longitude: number;
+    accuracy: number;
   }> => {
     return new Promise((resolve, reject) => {
       if (!navigator.geolocation) {
@@ -103,8 +96,8 @@ const StudentScanQR: React.FC = () => {
 
       navigator.geolocation.getCurrentPosition(
         (position) => {
-          const { latitude, longitude } = position.coords;
-          resolve({ latitude, longitude });
+          const { latitude, longitude, accuracy } = position.coords;
+          resolve({ latitude, longitude, accuracy });
         },
         (error) => {
           reject(error);
@@ -118,15 +111,15 @@ const StudentScanQR: React.FC = () => {
     });
   };
 
-  const takeAttendance = async (
-    roomId: number,
+  const scanAndAttend = async (
+    scan: { qr: string; roomId: number | null; idempotencyKey: string },
     token: string,
     base64Image?: string,
-    geofenceLocation?: { latitude: number; longitude: number }
+    location?: { latitude: number; longitude: number; accuracy: number }
   ) => {
     try {
       const requestBody: any = {
-        room_id: roomId,
+        qr: scan.qr,
         token: token,
       };
 
@@ -136,21 +129,45 @@ const StudentScanQR: React.FC = () => {
       }
 
       // Include geolocation data if provided
-      if (geofenceLocation) {
-        requestBody.geofence_location = geofenceLocation;
+      if (location) {
+        requestBody.geofence_location = location;
       }
 
       const response = await axios.post(
-        `${API_URL}/attendance/take_attendance`,
-        requestBody
+        `${API_URL}/attendance/scan_and_attend`,
+        requestBody,
+        {
+          headers: { "Idempotency-Key": scan.idempotencyKey },
+        }
       );
 
       alert(response.data.message);
       navigate("/student-dashboard/home");
     } catch (error: any) {
+      // The scan passed every check that needs no location or face image: collect what the room needs and resubmit
+      if (error.response?.status === 428) {
+        const { room_id, isGeofence, isFaceAuth } = error.response.data.detail;
+        cacheRoomSettings(room_id, isGeofence, isFaceAuth);
+
+        if (isGeofence && !location) {
+          // Resubmit with the location first so the geofence is checked before the face image is taken
+          location = (await fetchLocation()) || undefined;
+          if (!location) return;
+          await scanAndAttend(scan, token, base64Image, location);
+          return;
+        }
+        if (isFaceAuth && !base64Image) {
+          setIsFaceAuthOpen(true);
+          return;
+        }
+        await scanAndAttend(scan, token, base64Image, location);
+        return;
+      }
+
       console.error("Error marking attendance:", error);
       if (error.response) {
-        setErrorMessage(error.response.data.detail || "An error occurred.");
+        const detail = error.response.data.detail;
+        setErrorMessage((typeof detail === "string" ? detail : detail?.message) || "An error occurred.");
       } else {
         setErrorMessage("An error occurred while marking attendance.");
       }
@@ -165,30 +182,24 @@ const StudentScanQR: React.FC = () => {
       setErrorMessage("You are not logged in. Please log in to join a room.");
       return;
     }
+    if (!pendingScan) {
+      setErrorMessage("Please scan the QR code again.");
+      return;
+    }
 
-    try {
-      // Use the saved geolocation (if available) along with the base64 image
-      await takeAttendance(
-        roomIdForFaceAuth!,
-        token,
-        base64_image, // Pass the base64 image as a string
-        geofenceLocation || undefined
-      );
-    } catch (error: any) {
-      console.error(
-        "Error during face authentication:",
-        error.response?.data || error.message
-      );
-      setErrorMessage(
-        error.response?.data?.detail ||
-          "An error occurred during face authentication."
-      );
+    let location = geofenceLocation || undefined;
+    if (!location && getCachedRoomSettings(pendingScan.roomId)?.isGeofence) {
+      location = (await fetchLocation()) || undefined;
+      if (!location) return;
     }
+
+    // Use the saved geolocation (if available) along with the base64 image
+    await scanAndAttend(pendingScan, token, base64_image, location);
   };
 
   const handleCloseFaceAuth = () => {
     setIsFaceAuthOpen(false);
-    setRoomIdForFaceAuth(null);
+    setPendingScan(null);
   };
 
   const closeErrorModal = () => {
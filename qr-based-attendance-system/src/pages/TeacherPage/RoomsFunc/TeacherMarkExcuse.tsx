@@ -1,4 +1,4 @@
-import React, { useState } from "react";
+import React, { useRef, useState } from "react";
 import axios from "axios";
 
 const API_URL = import.meta.env.VITE_API_URL;
@@ -22,6 +22,8 @@ const TeacherMarkExcuse: React.FC<Props> = ({
   const [attachment, setAttachment] = useState<File | null>(null);
   const [loading, setLoading] = useState(false);
   const [message, setMessage] = useState<string | null>(null);
+  // One key per excuse submitted from this form: kept for retries, replaced once it succeeds
+  const idempotencyKey = useRef<string>(crypto.randomUUID());
 
   const handleFileChange = (e: React.ChangeEvent<HTMLInputElement>) => {
     if (e.target.files && e.target.files.length > 0) {
@@ -53,9 +55,11 @@ const TeacherMarkExcuse: React.FC<Props> = ({
           headers: {
             Authorization: `Bearer ${localStorage.getItem("access_token")}`,
             "Content-Type": "multipart/form-data",
+            "Idempotency-Key": idempotencyKey.current,
           },
         }
       );
+      idempotencyKey.current = crypto.randomUUID();
       setMessage("Student marked as excused successfully.");
       setReason("");
       setAttachment(null);
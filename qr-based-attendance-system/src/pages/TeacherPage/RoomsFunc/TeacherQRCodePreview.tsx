@@ -8,8 +8,34 @@ const TeacherQRCodePreview: React.FC = () => {
   const { roomId } = useParams<{ roomId: string }>(); // Extract roomId from the URL
   const [qrCodeUrl, setQrCodeUrl] = useState<string | null>(null); // State to store QR code URL
   const [errorMessage, setErrorMessage] = useState<string | null>(null); // State for error messages
+  const [isLive, setIsLive] = useState<boolean>(false); // Showing the rotating code of the active schedule
 
   useEffect(() => {
+    let refreshTimer: ReturnType<typeof setTimeout> | undefined;
+
+    // While a schedule is active, show its rotating signed code and fetch the next one when it expires
+    const fetchLiveQRCode = async (token: string): Promise<boolean> => {
+      try {
+        const response = await axios.get(`${API_URL}/attendance/${roomId}/live_qr`, {
+          headers: {
+            Authorization: `Bearer ${token}`,
+          },
+        });
+        setQrCodeUrl(`data:image/png;base64,${response.data.qr_code}`);
+        setIsLive(true);
+        setErrorMessage(null);
+
+        const refreshIn = new Date(response.data.expires_at).getTime() - Date.now();
+        refreshTimer = setTimeout(() => fetchQRCode(), Math.max(refreshIn, 1000));
+        return true;
+      } catch (error: any) {
+        if (error.response && error.response.status === 404) {
+          return false; // No active schedule, fall back to the static room code
+        }
+        throw error;
+      }
+    };
+
     const fetchQRCode = async () => {
       try {
         if (!roomId) {
@@ -23,6 +49,11 @@ const TeacherQRCodePreview: React.FC = () => {
           return;
         }
 
+        if (await fetchLiveQRCode(token)) {
+          return;
+        }
+        setIsLive(false);
+
         const response = await axios.get(
           `${API_URL}/rooms/${roomId}/qr_code_preview`,
           {
@@ -56,6 +87,12 @@ const TeacherQRCodePreview: React.FC = () => {
     };
 
     fetchQRCode();
+
+    return () => {
+      if (refreshTimer) {
+        clearTimeout(refreshTimer);
+      }
+    };
   }, [roomId]);
 
   return (
@@ -68,6 +105,11 @@ const TeacherQRCodePreview: React.FC = () => {
             alt="QR Code Preview"
             className="w-64 h-64 object-contain border rounded shadow"
           />
+          {isLive && (
+            <p className="text-sm text-gray-500 mt-2">
+              Live code for the current schedule, it refreshes automatically.
+            </p>
+          )}
         </div>
       ) : (
         !errorMessage && <p>Loading QR code...</p>
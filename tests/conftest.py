@@ -0,0 +1,61 @@
+import os
+import tempfile
+from datetime import date, time
+
+import pytest
+
+# The backend builds its engines on import, point them at a throwaway SQLite database first
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'attendance.db')}")
+os.environ.setdefault("SECRET_KEY", "test-secret")
+
+from backend import models  # noqa: E402
+from backend.database import SessionLocal, engine  # noqa: E402
+
+
+@pytest.fixture
+def db():
+    """A session on a freshly created schema."""
+    models.Base.metadata.drop_all(bind=engine)
+    models.Base.metadata.create_all(bind=engine)
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.fixture
+def room(db):
+    """A room owned by a teacher with two accepted students."""
+    teacher = models.UserModel(
+        username="teacher", email="teacher@example.com", hashed_password="x", id_number="T1",
+        first_name="Tess", last_name="Teacher", role="teacher"
+    )
+    students = [
+        models.UserModel(
+            username=f"student{i}", email=f"student{i}@example.com", hashed_password="x", id_number=f"S{i}",
+            first_name=f"Student{i}", last_name="Test", role="student"
+        )
+        for i in range(2)
+    ]
+    db.add_all([teacher, *students])
+    db.commit()
+
+    room = models.RoomsModel(
+        user_id=teacher.user_id, class_name="Math", section="A", isGeofence=False, isFaceAuth=False,
+        created_at=str(date.today()), room_code="ROOM01"
+    )
+    db.add(room)
+    db.commit()
+    db.add_all([models.RoomUsersModel(room_id=room.room_id, user_id=s.user_id, status="accepted") for s in students])
+    db.commit()
+    return room
+
+
+def make_schedule(db, room, day, start=time(8, 0), end=time(9, 0), **columns):
+    schedule = models.AttendanceScheduleModel(
+        room_id=room.room_id, schedule_name="Lecture", date=day, start_time=start, end_time=end, **columns
+    )
+    db.add(schedule)
+    db.commit()
+    return schedule
@@ -0,0 +1,50 @@
+from datetime import date, datetime
+
+from backend import models
+from backend import attendance_queue as attendance_queue_module
+from backend.attendance_queue import AttendanceWriteQueue
+from backend.utils import upsert_attendance_records
+
+from conftest import make_schedule
+
+
+def _scan(room, schedule, user_id, status="present"):
+    return {
+        "room_id": room.room_id,
+        "user_id": user_id,
+        "schedule_id": schedule.schedule_id,
+        "status": status,
+        "taken_at": datetime.now(),
+        "ip_address": "127.0.0.1",
+        "user_agent": "pytest",
+        "owner_id": room.user_id,
+        "schedule_name": schedule.schedule_name,
+        "class_name": room.class_name,
+    }
+
+
+def test_flush_only_logs_and_notifies_the_records_it_changed(db, room, monkeypatch):
+    schedule = make_schedule(db, room, date.today())
+    first, second = [member.user_id for member in db.query(models.RoomUsersModel).filter_by(room_id=room.room_id)]
+
+    def write_concurrently(session, rows, **kwargs):
+        # Another worker records the second student right before the flush takes its lock
+        upsert_attendance_records(session, [
+            {"room_id": room.room_id, "user_id": second, "schedule_id": schedule.schedule_id,
+             "status": "late", "taken_at": datetime.now()}
+        ])
+        return upsert_attendance_records(session, rows, **kwargs)
+
+    monkeypatch.setattr(attendance_queue_module, "upsert_attendance_records", write_concurrently)
+    queue = AttendanceWriteQueue()
+    assert queue.submit(_scan(room, schedule, first))
+    assert queue.submit(_scan(room, schedule, second))
+    queue.flush(force=True)
+
+    statuses = {
+        record.user_id: record.status.value
+        for record in db.query(models.AttendanceRecordModel).filter_by(schedule_id=schedule.schedule_id)
+    }
+    assert statuses == {first: "present", second: "late"}
+    assert [log.user_id for log in db.query(models.Logs).filter_by(action="Take Attendance")] == [first]
+    assert db.query(models.Notification).filter_by(title="Student Attendance Marked").count() == 1
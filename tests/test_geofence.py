@@ -0,0 +1,37 @@
+from backend import models
+from backend.routers.geofence import geofence_distance_histogram
+
+
+def _histogram(db, room, distances, **params):
+    geofence = models.GeofenceLocationModel(location="Campus", latitude=8.0, longitude=124.0, radius=50)
+    db.add(geofence)
+    db.commit()
+    db.add_all([
+        models.GeofenceAttemptModel(
+            user_id=room.user_id, room_id=room.room_id, geofence_id=geofence.geofence_id,
+            distance=distance, is_within=distance <= 50
+        )
+        for distance in distances
+    ])
+    db.commit()
+    return geofence_distance_histogram(geofence.geofence_id, start=None, end=None, token={}, db=db, **params)["buckets"]
+
+
+def test_distance_histogram_boundary_not_a_multiple_of_the_bucket_size(db, room):
+    buckets = _histogram(db, room, [10, 995, 999.9, 1000, 1500], bucket_size=30, max_distance=1000)
+
+    assert buckets == [
+        {"min_distance": 0, "max_distance": 30, "accepted": 1, "rejected": 0},
+        # The last in-range bucket ends at max_distance instead of merging into the overflow bucket
+        {"min_distance": 990, "max_distance": 1000, "accepted": 0, "rejected": 2},
+        {"min_distance": 1000, "max_distance": None, "accepted": 0, "rejected": 2},
+    ]
+
+
+def test_distance_histogram_boundary_on_a_bucket_edge(db, room):
+    buckets = _histogram(db, room, [975, 1000], bucket_size=25, max_distance=1000)
+
+    assert buckets == [
+        {"min_distance": 975, "max_distance": 1000, "accepted": 0, "rejected": 1},
+        {"min_distance": 1000, "max_distance": None, "accepted": 0, "rejected": 1},
+    ]
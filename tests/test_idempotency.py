@@ -0,0 +1,67 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from fastapi import HTTPException
+
+from backend import models
+from backend.idempotency import IdempotencyStore, prune_idempotency_keys, run_idempotent, run_idempotent_sync
+
+
+def test_retry_gets_the_stored_response(db):
+    calls = []
+
+    def handler():
+        calls.append(1)
+        return {"message": "Join Request sent to the room owner", "at": datetime(2024, 1, 1)}
+
+    first = run_idempotent_sync(1, "join_room_by_code", "key", handler)
+    retry = run_idempotent_sync(1, "join_room_by_code", "key", handler)
+
+    assert len(calls) == 1
+    assert first["message"] == retry["message"]
+    assert retry["at"] == "2024-01-01T00:00:00"
+    # Another caller or endpoint with the same key runs on its own
+    run_idempotent_sync(2, "join_room_by_code", "key", handler)
+    run_idempotent_sync(1, "mark_excused", "key", handler)
+    assert len(calls) == 3
+
+
+def test_async_endpoints_share_the_store(db):
+    async def handler():
+        return {"status": "present"}
+
+    assert asyncio.run(run_idempotent(1, "scan_and_attend", "key", handler)) == {"status": "present"}
+    assert run_idempotent_sync(1, "scan_and_attend", "key", lambda: {"status": "absent"}) == {"status": "present"}
+
+
+def test_keys_are_shared_between_workers(db):
+    # Each worker has its own store object; the claim is the database row
+    worker_a, worker_b = IdempotencyStore(), IdempotencyStore()
+
+    assert worker_a.begin((1, "scan_and_attend", "key")) is None
+    with pytest.raises(HTTPException) as busy:
+        worker_b.begin((1, "scan_and_attend", "key"))
+    assert busy.value.status_code == 409
+
+    worker_a.complete((1, "scan_and_attend", "key"), {"status": "present"})
+    assert worker_b.begin((1, "scan_and_attend", "key")) == {"status": "present"}
+
+
+def test_failed_request_can_be_retried(db):
+    def failing():
+        raise HTTPException(status_code=400, detail="Invalid QR Code")
+
+    with pytest.raises(HTTPException):
+        run_idempotent_sync(1, "scan_and_attend", "key", failing)
+    assert run_idempotent_sync(1, "scan_and_attend", "key", lambda: {"status": "late"}) == {"status": "late"}
+
+
+def test_expired_keys_are_claimed_again_and_pruned(db):
+    store = IdempotencyStore(in_flight_seconds=-1)
+    assert store.begin((1, "take_attendance", "key")) is None
+    # The claim of a worker that died mid-request has expired
+    assert store.begin((1, "take_attendance", "key")) is None
+
+    assert prune_idempotency_keys() == 1
+    assert db.query(models.IdempotencyKeyModel).count() == 0
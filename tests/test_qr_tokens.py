@@ -0,0 +1,34 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from backend import qr_tokens, schemas
+from backend.qr_tokens import issue_qr_token, verify_qr_token
+from backend.routers.attendance import scan_and_attend, scan_qr
+
+
+def test_signed_payload_round_trip():
+    payload, _ = issue_qr_token(3, 7, now=1000)
+    assert verify_qr_token(payload, now=1000) == (3, 7)
+
+    forged = payload.replace("v1.3.", "v1.4.", 1)
+    with pytest.raises(HTTPException):
+        verify_qr_token(forged, now=1000)
+    with pytest.raises(HTTPException):
+        verify_qr_token(payload, now=1000 + 10 * qr_tokens.QR_TOKEN_ROTATE_SECONDS)
+
+
+def test_bare_room_id_is_refused_by_default():
+    with pytest.raises(HTTPException) as scan:
+        asyncio.run(scan_and_attend(schemas.ScanAndAttend(token="unused", qr="3"), db=None))
+    assert scan.value.status_code == 400
+
+    with pytest.raises(HTTPException) as settings:
+        asyncio.run(scan_qr(token="unused", room_id=3, db=None))
+    assert settings.value.status_code == 400
+
+
+def test_bare_room_id_is_accepted_when_allowed(monkeypatch):
+    monkeypatch.setattr(qr_tokens, "ALLOW_STATIC_ROOM_QR", True)
+    qr_tokens.require_static_room_qr()
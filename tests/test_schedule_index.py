@@ -0,0 +1,23 @@
+import asyncio
+from datetime import datetime, time
+
+from backend.schedule_index import get_active_schedule, schedule_index
+
+from conftest import make_schedule
+
+
+def test_loaded_index_answers_without_the_database(db, room):
+    now = datetime.now()
+    schedule_index.load(db, now.date())
+    # Created behind the index's back, as through another worker: seen after the next refresh
+    schedule = make_schedule(db, room, now.date(), start=time(0, 0), end=time(23, 59, 59))
+
+    assert asyncio.run(get_active_schedule(None, room.room_id, now)) is None
+
+    schedule_index.load(db, now.date())
+    assert asyncio.run(get_active_schedule(None, room.room_id, now))["schedule_id"] == schedule.schedule_id
+
+    schedule.is_archived = True
+    db.commit()
+    schedule_index.upsert(schedule)
+    assert asyncio.run(get_active_schedule(None, room.room_id, now)) is None
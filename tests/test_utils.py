@@ -0,0 +1,69 @@
+from datetime import date, timedelta
+
+from sqlalchemy import inspect, text
+
+from backend import models
+from backend.database import engine
+from backend.utils import create_missing_index, mark_pending_as_absent, materialize_attendance_roster
+
+from conftest import make_schedule
+
+
+def _records(db, schedule):
+    return db.query(models.AttendanceRecordModel).filter_by(schedule_id=schedule.schedule_id).all()
+
+
+def _pending_count(db, schedule):
+    counter = db.query(models.ScheduleAttendanceCounterModel).filter_by(
+        schedule_id=schedule.schedule_id, status="pending"
+    ).first()
+    return counter.count if counter else 0
+
+
+def test_materialize_attendance_roster_counts_each_record_once(db, room):
+    first = make_schedule(db, room, date.today())
+    second = make_schedule(db, room, date.today())
+
+    # Within the same second, the second call must not count the rows of the first again
+    assert materialize_attendance_roster(db, [first.schedule_id]) == 2
+    assert materialize_attendance_roster(db, [first.schedule_id, second.schedule_id]) == 2
+    assert materialize_attendance_roster(db, [first.schedule_id, second.schedule_id]) == 0
+    db.commit()
+
+    assert _pending_count(db, first) == 2
+    assert _pending_count(db, second) == 2
+    assert {record.status.value for record in _records(db, first)} == {"pending"}
+
+
+def test_mark_pending_as_absent_finalizes_ended_schedules(db, room):
+    schedule = make_schedule(db, room, date.today() - timedelta(days=1))
+
+    assert mark_pending_as_absent(db) == 2
+
+    db.refresh(schedule)
+    assert schedule.finalized_at is not None
+    assert {record.status.value for record in _records(db, schedule)} == {"absent"}
+
+
+def test_mark_pending_as_absent_skips_archived_schedules(db, room):
+    schedule = make_schedule(db, room, date.today() - timedelta(days=1), is_archived=True)
+
+    assert mark_pending_as_absent(db) == 0
+    assert mark_pending_as_absent(db, schedule.schedule_id) == 0
+
+    db.refresh(schedule)
+    assert schedule.finalized_at is None
+    assert _records(db, schedule) == []
+    assert db.query(models.Notification).count() == 0
+
+
+def test_create_missing_index_upgrades_an_existing_table(db):
+    table = models.AttendanceScheduleModel.__table__
+    with engine.begin() as connection:
+        connection.execute(text("DROP INDEX ix_attendance_schedule_room_date"))
+    # A restart against the older database; pooled SQLite connections cache their DDL statements
+    engine.dispose()
+
+    assert create_missing_index(engine, table, "ix_attendance_schedule_room_date")
+    assert "ix_attendance_schedule_room_date" in {index["name"] for index in inspect(engine).get_indexes(table.name)}
+    assert not create_missing_index(engine, table, "ix_attendance_schedule_room_date")